@@ -0,0 +1,78 @@
+# Tên file: benchmarks/bench_case_aggregation.py
+"""
+Đo chi phí bước gộp xác suất chunk theo case (core/utils.py).
+
+So sánh trên cùng bộ entry giả (2–6 chunk / entry):
+    - mean     : trung bình thường trên ChunkMatrix (cách cũ)
+    - by_case  : detect_sentiment_case + aggregate_* đúng case
+    - batch    : aggregate_by_case_batch cho cả lô (job phân tích lại)
+Thời gian dựng ChunkMatrix (quét từ nối 1 lần) được đo riêng.
+
+Chạy:
+    python benchmarks/bench_case_aggregation.py
+    python benchmarks/bench_case_aggregation.py --entries 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.utils import (  # noqa: E402
+    aggregate_by_case,
+    aggregate_by_case_batch,
+    chunks_to_matrix,
+)
+
+LABELS = ("negative", "neutral", "positive")
+WORDS = ("hôm nay học thi bạn mẹ vui buồn mệt nhưng tuy nhiên điểm lo sợ thích "
+         "deadline đồ án nhóm thầy cô áp lực").split()
+
+
+def _fake_entry(rng):
+    chunks = []
+    for _ in range(rng.randint(2, 6)):
+        raw = [rng.random() ** 2 for _ in range(3)]
+        s = sum(raw)
+        probs = [p / s for p in raw]
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        chunks.append({"text": text, "probs": probs, "label": LABELS[probs.index(max(probs))],
+                       "length": len(text)})
+    return chunks
+
+
+def _per_entry_us(fn, items):
+    t0 = time.perf_counter()
+    for it in items:
+        fn(it)
+    return (time.perf_counter() - t0) * 1e6 / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark case-specific aggregation")
+    parser.add_argument("--entries", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    entries = [_fake_entry(rng) for _ in range(args.entries)]
+
+    build_us = _per_entry_us(chunks_to_matrix, entries)
+    matrices = [chunks_to_matrix(e) for e in entries]
+    mean_us = _per_entry_us(lambda m: m.probs.mean(axis=0), matrices)
+    case_us = _per_entry_us(aggregate_by_case, matrices)
+
+    t0 = time.perf_counter()
+    aggregate_by_case_batch(matrices)
+    batch_us = (time.perf_counter() - t0) * 1e6 / len(matrices)
+
+    print(f"🧱 chunks_to_matrix : {build_us:.1f} µs / entry")
+    print(f"➗ mean             : {mean_us:.1f} µs / entry")
+    print(f"🧠 by_case          : {case_us:.1f} µs / entry (+{case_us - mean_us:.1f} µs so với mean)")
+    print(f"📦 batch            : {batch_us:.1f} µs / entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Tên file: benchmarks/bench_import_time.py
+"""
+Đo thời gian import (cold start) của các module core.
+
+Mỗi lần đo chạy 1 process Python mới → không bị ảnh hưởng bởi sys.modules đã cache.
+Đồng thời liệt kê các thư viện nặng (torch, google.generativeai, aiohttp, ...)
+có bị kéo vào lúc import hay không.
+
+Chạy:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --modules core.hf_client core.pipeline --repeat 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["torch", "google.generativeai", "aiohttp", "transformers", "onnxruntime", "numpy"]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+try:
+    __import__({module!r})
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - t0
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy, "error": error}}))
+"""
+
+
+def measure(module: str, repeat: int) -> dict:
+    """Import `module` trong `repeat` process mới, trả về thống kê (giây)."""
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    samples, heavy, error = [], [], None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        data = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(data["elapsed"])
+        heavy, error = data["heavy"], data["error"]
+    return {
+        "module": module,
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "heavy": heavy,
+        "error": error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thời gian import core.*")
+    parser.add_argument("--modules", nargs="+", default=["core.hf_client", "core.pipeline"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"🐍 {sys.version.split()[0]} – mỗi module import {args.repeat} lần (process mới)\n")
+    for module in args.modules:
+        r = measure(module, args.repeat)
+        print(f"📦 {r['module']:<20} median {r['median'] * 1000:8.1f} ms | min {r['min'] * 1000:8.1f} ms")
+        print(f"   thư viện nặng đã load: {', '.join(r['heavy']) or '(không có)'}")
+        if r["error"]:
+            print(f"   ⚠️ import lỗi: {r['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Tên file: benchmarks/bench_semantic_context.py
+"""
+Đo thời gian tìm ký ức theo ngữ nghĩa (core/history_embeddings.py).
+
+Tạo N entry giả cho 1 user trong thư mục tạm, rồi đo:
+    - thời gian embed + thêm tăng dần (add_many)
+    - latency search top-k: tìm chính xác (exact) và ANN (LSH)
+
+Chạy:
+    python benchmarks/bench_semantic_context.py
+    python benchmarks/bench_semantic_context.py --entries 50000 --queries 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.history_embeddings import EmbeddingIndex  # noqa: E402
+
+WORDS = ("học thi bạn mẹ vui buồn mệt ngủ chạy ăn đi làm điểm lo sợ thích "
+         "deadline đồ án cà phê nhóm thầy cô ký túc xá gia đình áp lực").split()
+
+
+def _fake_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 40)))
+
+
+def _bench(index, queries, k):
+    samples = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q, user_id="u1", k=k)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark semantic context")
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    entries = [{"user_id": "u1", "text": _fake_text(rng), "timestamp": f"2025-01-01 00:00:{i % 60:02d}"}
+               for i in range(args.entries)]
+    queries = [_fake_text(rng) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as root:
+        index = EmbeddingIndex(root)
+        t0 = time.perf_counter()
+        for start in range(0, len(entries), 100):
+            index.add_many(entries[start:start + 100])
+        add_ms = (time.perf_counter() - t0) * 1000 / len(entries)
+        print(f"📥 {args.entries} entry – add_many: {add_ms:.3f} ms / entry")
+
+        index.exact_max = args.entries
+        med, worst = _bench(index, queries, args.k)
+        print(f"🎯 exact : median {med:.2f} ms | max {worst:.2f} ms")
+
+        index.exact_max = 0
+        med, worst = _bench(index, queries, args.k)
+        print(f"⚡ LSH   : median {med:.2f} ms | max {worst:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
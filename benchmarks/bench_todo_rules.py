@@ -0,0 +1,60 @@
+# Tên file: benchmarks/bench_todo_rules.py
+"""
+Đo thời gian trích nhiệm vụ (core/todo_engine.py) khi danh mục rule lớn dần.
+
+Sinh thêm rule giả (keyword ngẫu nhiên) vào bộ rule mặc định rồi đo
+extract_tasks_from_text trên các câu nhật ký mẫu: với regex gộp dạng
+trie, thời gian / entry gần như không đổi theo số rule.
+
+Chạy:
+    python benchmarks/bench_todo_rules.py
+    python benchmarks/bench_todo_rules.py --sizes 10 100 1000 5000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.todo_engine import TodoRule, TodoRuleSet, extract_tasks_from_text, get_todo_rules  # noqa: E402
+
+SYLLABLES = ("học thi bạn mẹ vui buồn mệt ngủ chạy ăn làm điểm lo sợ thích "
+             "bài nhóm thầy cô nộp dọn đi mua sắm khám gọi viết đọc tập").split()
+TEXTS = [
+    "Mai thi Toán rồi mà chưa ôn gì cả.",
+    "Deadline bài thuyết trình tối nay mà slide chưa làm.",
+    "Không biết sao nữa, bài tập lớn phải nộp tuần này.",
+    "Hôm nay đi chơi với bạn, thích lắm, chẳng nghĩ gì tới việc học.",
+] * 250
+
+
+def _rule_set(n, rng):
+    base = get_todo_rules().rules
+    extra = [
+        TodoRule(id=f"fake_{i}", keywords=[" ".join(rng.sample(SYLLABLES, 3)) + f" {i}"],
+                 action=f"Việc {i}", description="", confidence=0.5)
+        for i in range(max(0, n - len(base)))
+    ]
+    return TodoRuleSet(base + extra)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark todo rule matching")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 100, 500, 2000])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for n in args.sizes:
+        rules = _rule_set(n, rng)
+        t0 = time.perf_counter()
+        for text in TEXTS:
+            extract_tasks_from_text(text, rules=rules)
+        per_entry = (time.perf_counter() - t0) * 1e6 / len(TEXTS)
+        print(f"📋 {len(rules):>5} rule → {per_entry:.1f} µs / entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# Tên file: compact_history.py
+"""
+Compaction lịch sử (chạy định kỳ, vd cron mỗi đêm):
+    - Bản ghi cũ hơn --hot-days ngày → tổng kết theo ngày + chuyển bản gốc vào kho lạnh (gzip)
+    - Tổng kết ngày cũ hơn --weekly-after-days ngày → gộp thành tổng kết theo tuần
+    - Vector + text của bản ghi đã compact được xoá khỏi index embedding
+    - Chạy lại sau khi bị dừng giữa chừng không cộng trùng
+
+Chạy:
+    python compact_history.py
+    python compact_history.py --hot-days 14 --weekly-after-days 60
+"""
+
+import argparse
+
+from core.config import HISTORY_HOT_DAYS, HISTORY_WEEKLY_AFTER_DAYS, HISTORY_ARCHIVE_DIR
+from core.history_compaction import compact_history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compaction lịch sử pipeline")
+    parser.add_argument("--hot-days", type=int, default=HISTORY_HOT_DAYS, help="Giữ nguyên bản ghi trong N ngày gần nhất")
+    parser.add_argument("--weekly-after-days", type=int, default=HISTORY_WEEKLY_AFTER_DAYS,
+                        help="Tổng kết ngày cũ hơn N ngày được gộp thành tuần")
+    parser.add_argument("--archive-dir", default=HISTORY_ARCHIVE_DIR, help="Thư mục kho lạnh")
+    args = parser.parse_args()
+
+    stats = compact_history(hot_days=args.hot_days, weekly_after_days=args.weekly_after_days,
+                            archive_dir=args.archive_dir)
+    print(f"✅ Compact {stats['compacted']} bản ghi (xoá khỏi store: {stats['removed']}, "
+          f"khỏi index embedding: {stats['embeddings_pruned']}), "
+          f"gộp {stats['days_rolled_into_weeks']} tổng kết ngày thành tuần")
+
+
+if __name__ == "__main__":
+    main()
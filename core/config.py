@@ -18,9 +18,112 @@ load_dotenv()
 # ✅ Sử dụng API mới (Sentiment V2 – model đã fine-tune)
 SENTIMENT_API_URL = "https://zonecb-my-sentiment-v2.hf.space/predict"
 
+# ✅ Endpoint batch: gửi nhiều chunk trong 1 request ({"texts": [...]})
+SENTIMENT_BATCH_API_URL = "https://zonecb-my-sentiment-v2.hf.space/predict_batch"
+SENTIMENT_BATCH_SIZE = 32  # số chunk tối đa mỗi request batch
+
+# Cách gửi các chunk của 1 nhật ký: "batch" (1 request) hoặc "concurrent" (song song từng chunk)
+SENTIMENT_DISPATCH_MODE = os.getenv("SENTIMENT_DISPATCH_MODE", "batch")
+SENTIMENT_MAX_CONCURRENCY = int(os.getenv("SENTIMENT_MAX_CONCURRENCY", "4"))  # số request song song tối đa / nhật ký
+
+# Cách gộp xác suất các chunk: "case" (aggregate_* theo case, xem core/utils.py) hoặc "mean" (trung bình thường)
+SENTIMENT_AGGREGATION = os.getenv("SENTIMENT_AGGREGATION", "case")
+
+# Micro-batching: gom chunk của nhiều user gửi cùng lúc thành 1 lô (tối đa N chunk hoặc chờ tối đa M ms)
+SENTIMENT_MICROBATCH_ENABLED = os.getenv("SENTIMENT_MICROBATCH_ENABLED", "false").lower() == "true"
+SENTIMENT_MICROBATCH_MAX_SIZE = int(os.getenv("SENTIMENT_MICROBATCH_MAX_SIZE", str(SENTIMENT_BATCH_SIZE)))
+SENTIMENT_MICROBATCH_MAX_WAIT_MS = float(os.getenv("SENTIMENT_MICROBATCH_MAX_WAIT_MS", "10"))
+
+# Cache kết quả sentiment theo nội dung chunk (xem core/sentiment_cache.py)
+SENTIMENT_CACHE_ENABLED = os.getenv("SENTIMENT_CACHE_ENABLED", "true").lower() == "true"
+SENTIMENT_CACHE_MAX_ITEMS = int(os.getenv("SENTIMENT_CACHE_MAX_ITEMS", "4096"))      # LRU trong RAM
+SENTIMENT_CACHE_TTL_SECONDS = float(os.getenv("SENTIMENT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SENTIMENT_CACHE_DB_PATH = os.getenv("SENTIMENT_CACHE_DB_PATH") or None  # vd "sentiment_cache.sqlite3" → bật tầng đĩa
+
 # ✅ Tên model sentiment đang dùng
 SENTIMENT_MODEL_NAME = "Zonecb/my-phobert-sentiment-v2"
-HISTORY_DB_PATH = "pipeline_history.json"
+
+# Backend sentiment: "remote" (gọi Space), "local" (PhoBERT chạy trong process, CPU)
+# hoặc "onnx" (bản ONNX int8 qua ONNX Runtime, tạo bằng export_sentiment_onnx.py)
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "remote")
+SENTIMENT_LOCAL_MODEL_PATH = os.getenv("SENTIMENT_LOCAL_MODEL_PATH", os.path.join("models", "my-phobert-sentiment-v2"))
+SENTIMENT_LOCAL_BATCH_SIZE = int(os.getenv("SENTIMENT_LOCAL_BATCH_SIZE", "16"))
+SENTIMENT_LOCAL_NUM_THREADS = int(os.getenv("SENTIMENT_LOCAL_NUM_THREADS", "0"))  # 0 = mặc định của torch
+SENTIMENT_ONNX_MODEL_DIR = os.getenv("SENTIMENT_ONNX_MODEL_DIR", os.path.join("models", "my-phobert-sentiment-v2-onnx"))
+SENTIMENT_ONNX_FILE = os.getenv("SENTIMENT_ONNX_FILE", "model.int8.onnx")
+SENTIMENT_ONNX_INTRA_OP_THREADS = int(os.getenv("SENTIMENT_ONNX_INTRA_OP_THREADS", "1"))  # thread / phiên ORT
+HISTORY_DB_PATH = "pipeline_history.json"  # file JSON (mảng) kiểu cũ – nguồn của migrate_history.py
+
+# Lưu lịch sử (xem core/history_store.py): "jsonl" (append 1 dòng / bản ghi),
+# "sqlite" (SQLite WAL, có index theo user / label / case / thời gian) hoặc "json" (file mảng cũ)
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "jsonl")
+HISTORY_JSONL_PATH = os.getenv("HISTORY_JSONL_PATH", "pipeline_history.jsonl")
+# jsonl: tách lịch sử mỗi user ra 1 file riêng trong HISTORY_USER_DIR (đọc context chỉ mở file của user đó)
+HISTORY_PARTITION_BY_USER = os.getenv("HISTORY_PARTITION_BY_USER", "true").lower() == "true"
+HISTORY_USER_DIR = os.getenv("HISTORY_USER_DIR", "pipeline_history_users")
+HISTORY_SQLITE_PATH = os.getenv("HISTORY_SQLITE_PATH", "pipeline_history.sqlite3")
+# fsync sau khi append: "always" (mọi bản ghi), "interval" (tối đa 1 lần / HISTORY_FSYNC_INTERVAL_SECONDS), "never" (để OS tự flush)
+HISTORY_FSYNC = os.getenv("HISTORY_FSYNC", "interval")
+HISTORY_FSYNC_INTERVAL_SECONDS = float(os.getenv("HISTORY_FSYNC_INTERVAL_SECONDS", "1.0"))
+# Group commit: gom bản ghi của các request ghi cùng lúc thành 1 lần write (+1 fsync / 1 transaction)
+HISTORY_GROUP_COMMIT = os.getenv("HISTORY_GROUP_COMMIT", "false").lower() == "true"
+HISTORY_GROUP_COMMIT_WINDOW_MS = float(os.getenv("HISTORY_GROUP_COMMIT_WINDOW_MS", "5"))  # chờ gom tối đa
+HISTORY_GROUP_COMMIT_MAX_BATCH = int(os.getenv("HISTORY_GROUP_COMMIT_MAX_BATCH", "256"))
+# Write-behind: pipeline chỉ đẩy bản ghi vào hàng đợi, thread nền ghi theo lô (xem core/history_writer.py)
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_WRITE_QUEUE_MAX = int(os.getenv("HISTORY_WRITE_QUEUE_MAX", "1000"))         # đầy → backpressure
+HISTORY_WRITE_BATCH_MAX = int(os.getenv("HISTORY_WRITE_BATCH_MAX", "100"))          # bản ghi / lần ghi
+HISTORY_WRITE_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_WRITE_FLUSH_INTERVAL_MS", "50"))
+HISTORY_WRITE_BLOCK_TIMEOUT_SECONDS = float(os.getenv("HISTORY_WRITE_BLOCK_TIMEOUT_SECONDS", "1.0"))  # chờ chỗ trống tối đa, quá thì ghi trực tiếp
+HISTORY_DEAD_LETTER_PATH = os.getenv("HISTORY_DEAD_LETTER_PATH", "pipeline_history_dead_letter.jsonl")  # lô ghi lỗi hết số lần thử
+
+# Compaction (xem core/history_compaction.py, chạy bằng compact_history.py):
+# bản ghi cũ hơn HISTORY_HOT_DAYS ngày → gộp thành tổng kết theo ngày + chuyển bản gốc vào kho lưu trữ;
+# tổng kết ngày cũ hơn HISTORY_WEEKLY_AFTER_DAYS ngày → gộp tiếp thành tổng kết theo tuần
+HISTORY_HOT_DAYS = int(os.getenv("HISTORY_HOT_DAYS", "30"))
+HISTORY_WEEKLY_AFTER_DAYS = int(os.getenv("HISTORY_WEEKLY_AFTER_DAYS", "90"))
+HISTORY_SUMMARY_PATH = os.getenv("HISTORY_SUMMARY_PATH", "pipeline_history_summaries.json")
+HISTORY_ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", "pipeline_history_archive")
+
+# Rollup mood theo (user, ngày), cập nhật mỗi lần ghi – nguồn cho mood trend / thông báo (core/history_rollups.py).
+# Lần đầu dùng tự dựng từ lịch sử 1 lần (dưới file lock); có thể dựng trước bằng migrate_history.py --backfill
+HISTORY_ROLLUPS_ENABLED = os.getenv("HISTORY_ROLLUPS_ENABLED", "true").lower() == "true"
+HISTORY_ROLLUP_PATH = os.getenv("HISTORY_ROLLUP_PATH", "pipeline_history_rollups.sqlite3")
+HISTORY_ROLLUP_WINDOW_DAYS = int(os.getenv("HISTORY_ROLLUP_WINDOW_DAYS", "60"))  # số ngày rollup sweep đọc / user
+
+# Context theo ngữ nghĩa (xem core/history_embeddings.py): lấy k entry cũ giống nhật ký hiện tại nhất.
+# Mặc định tắt: bật trên lịch sử sẵn có thì chạy `python migrate_history.py --backfill` trước,
+# nếu không request đầu tiên sẽ phải embed toàn bộ lịch sử
+HISTORY_SEMANTIC_CONTEXT = os.getenv("HISTORY_SEMANTIC_CONTEXT", "false").lower() == "true"
+# "hashing" (n-gram băm, numpy thuần, không cần model) hoặc "transformer" (model embedding chạy CPU)
+HISTORY_EMBED_BACKEND = os.getenv("HISTORY_EMBED_BACKEND", "hashing")
+HISTORY_EMBED_MODEL = os.getenv("HISTORY_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+HISTORY_EMBED_DIM = int(os.getenv("HISTORY_EMBED_DIM", "256"))            # số chiều của hashing embedder
+HISTORY_EMBED_DIR = os.getenv("HISTORY_EMBED_DIR", "pipeline_history_embeddings")
+HISTORY_EMBED_LSH_TABLES = int(os.getenv("HISTORY_EMBED_LSH_TABLES", "4"))  # ANN: số bảng LSH
+HISTORY_EMBED_LSH_BITS = int(os.getenv("HISTORY_EMBED_LSH_BITS", "12"))     # ANN: số bit / bảng
+HISTORY_EMBED_EXACT_MAX = int(os.getenv("HISTORY_EMBED_EXACT_MAX", "2000")) # user ít hơn N entry → tìm chính xác
+# Cosine tối thiểu để 1 entry được coi là "giống" (thấp hơn → không đưa vào context).
+# Phụ thuộc embedder: ~0.25 hợp với hashing; model transformer thường cần cao hơn (~0.5)
+HISTORY_EMBED_MIN_SCORE = float(os.getenv("HISTORY_EMBED_MIN_SCORE", "0.25"))
+
+# Index lịch sử trong RAM cho build_past_context (xem core/history_index.py)
+HISTORY_INDEX_ENABLED = os.getenv("HISTORY_INDEX_ENABLED", "true").lower() == "true"
+HISTORY_INDEX_MAX_PER_LABEL = int(os.getenv("HISTORY_INDEX_MAX_PER_LABEL", "20"))  # entry mới nhất giữ lại / (user, label)
+HISTORY_INDEX_MAX_USERS = int(os.getenv("HISTORY_INDEX_MAX_USERS", "10000"))        # số user giữ trong RAM (LRU)
+
+# Bộ rule trích nhiệm vụ của todo_engine (JSON: keywords → action), khớp 1 lượt bằng regex gộp
+TODO_RULES_PATH = os.getenv("TODO_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "todo_rules.json"))
+
+# Bảng nhiệm vụ đã trích (SQLite, index theo due_at) – xem core/task_store.py.
+# Lần đầu dùng tự backfill từ lịch sử 1 lần (dưới file lock); có thể dựng trước bằng migrate_history.py --backfill
+TASK_STORE_ENABLED = os.getenv("TASK_STORE_ENABLED", "true").lower() == "true"
+TASK_DB_PATH = os.getenv("TASK_DB_PATH", "pipeline_tasks.sqlite3")
+
+# Sweep thông báo cho mọi user (xem core/notification_engine.py / notification_sweep.py)
+NOTIFICATION_SWEEP_BUDGET_SECONDS = float(os.getenv("NOTIFICATION_SWEEP_BUDGET_SECONDS", "60"))  # hết giờ → user còn lại để lượt sau
+NOTIFICATION_STATE_PATH = os.getenv("NOTIFICATION_STATE_PATH", "notification_state.json")        # lần gửi gần nhất / (user, loại) + con trỏ vòng
+NOTIFICATION_OUTBOX_PATH = os.getenv("NOTIFICATION_OUTBOX_PATH", "notification_outbox.jsonl")    # thông báo đã tạo, chờ gửi
  
 # Giữ nguyên cấu hình các model khác (nếu có)
 HF_MODELS = {
@@ -43,6 +146,12 @@ API_TOKEN = os.getenv("HF_API_TOKEN", "")
 DEFAULT_TONE = "neutral"
 MAX_LEN = 512
 TIMEOUT = 30  # Cảnh báo: API có thể chậm ở lần gọi đầu
+
+# Connection pool dùng chung cho mọi request HTTP tới Space (keep-alive)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))   # số host được giữ pool
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))          # số kết nối tối đa / host
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"  # hết kết nối → chờ thay vì mở thêm
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "0"))             # retry ở tầng kết nối (urllib3)
 CONF_THRESHOLD = 0.6
 
 # =============================
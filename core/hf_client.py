@@ -1,45 +1,306 @@
 """
 core/hf_client.py (Giai đoạn 5 – Sentiment v2, không có 7 lớp)
+
+Import nhẹ: google.generativeai và aiohttp chỉ được import ở lần dùng đầu tiên
+(xem _get_gemini_model, _aiohttp); softmax 3 nhãn tính bằng Python thuần, không cần torch.
 """
 from dotenv import load_dotenv
 load_dotenv()
-import google.generativeai as genai
+import importlib.util
+import math
 import os
 from core.utils import clean_text, get_vn_timestamp
 from core.prompts import SYSTEM_PROMPT
+from core.sentiment_cache import get_sentiment_cache, make_cache_key
+from core.sentiment_backends import get_backend
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
-import torch
-import numpy as np
-import torch.nn.functional as F
+from requests.adapters import HTTPAdapter
+
 from core.config import (
     API_TOKEN,
     TIMEOUT,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_POOL_BLOCK,
+    HTTP_MAX_RETRIES,
     OPENAI_API_KEY,
     GPT_RESPONSE_MODEL_ID,
     GOOGLE_API_KEY,
     SENTIMENT_API_URL,
+    SENTIMENT_BATCH_API_URL,
+    SENTIMENT_BATCH_SIZE,
+    SENTIMENT_MAX_CONCURRENCY,
+    SENTIMENT_MICROBATCH_ENABLED,
+    SENTIMENT_MICROBATCH_MAX_SIZE,
+    SENTIMENT_MICROBATCH_MAX_WAIT_MS,
     SENTIMENT_MODEL_NAME,
+    SENTIMENT_BACKEND,
     LABELS,
     SOFTMAX_TEMPERATURE,
     ROUND_DECIMALS,
     EMOTION_MAP
 )
 
+# aiohttp là tuỳ chọn: có thì gọi HTTP async thật, không có thì chạy bản sync trong thread.
+# Chỉ kiểm tra có cài hay không, import thật khi tạo session async đầu tiên.
+_HAS_AIOHTTP = importlib.util.find_spec("aiohttp") is not None
+
+
+def _aiohttp():
+    import aiohttp
+    return aiohttp
+
 # Header xác thực (cho cả API Hugging Face Space nếu private)
 HEADERS = {"Authorization": f"Bearer {API_TOKEN}"}
 
-# === Cấu hình Gemini ===
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-gemini_model = genai.GenerativeModel(
-    'gemini-2.5-flash',
-    system_instruction=SYSTEM_PROMPT
-)
+# === HTTP session dùng chung (connection pool + keep-alive) ===
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Trả về requests.Session dùng chung cho toàn process (mọi pipeline, mọi thread).
+    Kết nối TCP/TLS tới Space được giữ lại (keep-alive) và tái sử dụng,
+    tránh handshake lại ở mỗi chunk.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    pool_block=HTTP_POOL_BLOCK,
+                    max_retries=HTTP_MAX_RETRIES,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(HEADERS)
+                session.headers["Connection"] = "keep-alive"
+                _session = session
+    return _session
+
+
+def close_http_session() -> None:
+    """Đóng session dùng chung (gọi khi shutdown worker)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# === aiohttp session cho bản async (mỗi event loop 1 session) ===
+_async_session = None
+_async_session_loop = None
+
+
+def _get_async_session():
+    """Trả về aiohttp.ClientSession gắn với event loop hiện tại (tạo lại nếu loop đổi)."""
+    global _async_session, _async_session_loop
+    loop = asyncio.get_running_loop()
+    if _async_session is None or _async_session.closed or _async_session_loop is not loop:
+        aiohttp = _aiohttp()
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+            limit_per_host=HTTP_POOL_MAXSIZE,
+        )
+        _async_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+        )
+        _async_session_loop = loop
+    return _async_session
+
+
+async def close_http_session_async() -> None:
+    """Đóng aiohttp session (gọi khi tắt event loop / worker async)."""
+    global _async_session, _async_session_loop
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+    _async_session_loop = None
+
+
+async def _post_json_async(url: str, payload: dict):
+    """POST JSON bằng aiohttp, trả về (status_code, data)."""
+    session = _get_async_session()
+    async with session.post(url, json=payload) as response:
+        if response.status in (404, 405):
+            return response.status, None
+        response.raise_for_status()
+        return response.status, await response.json(content_type=None)
+
+
+# === Cấu hình Gemini (khởi tạo lười ở lần gọi đầu) ===
+gemini_model = None
+_gemini_lock = threading.Lock()
+
+
+def _get_gemini_model():
+    """Import google.generativeai + tạo GenerativeModel ở lần dùng đầu tiên."""
+    global gemini_model
+    if gemini_model is None:
+        with _gemini_lock:
+            if gemini_model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                gemini_model = genai.GenerativeModel(
+                    'gemini-2.5-flash',
+                    system_instruction=SYSTEM_PROMPT
+                )
+    return gemini_model
+
+
+def _generation_config():
+    import google.generativeai as genai
+    return genai.types.GenerationConfig(temperature=0.7)
+
+
+def _flatten(values):
+    """Ép logits (có thể lồng nhau, vd [[a, b, c]]) thành list float 1D."""
+    if isinstance(values, (list, tuple)):
+        return [x for v in values for x in _flatten(v)]
+    return [float(values)]
+
+
+def _softmax(logits, temperature=1.0):
+    scaled = [x / temperature for x in logits]
+    peak = max(scaled)
+    exps = [math.exp(x - peak) for x in scaled]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+# === Hàm phụ: chuẩn hoá kết quả sentiment ===
+def _build_sentiment_result(text: str, data: dict, url: str = SENTIMENT_API_URL):
+    """
+    Chuyển payload thô của 1 câu (raw_logits / label) thành dict kết quả chuẩn.
+    Dùng chung cho query_model("sentiment") và query_sentiment_batch().
+    """
+    logits = data.get("raw_logits") or data.get("logits") or data.get("scores")
+    label = data.get("predicted_label") or data.get("label")
+
+    if logits:
+        # Ép logits thành mảng phẳng 1D, tránh lỗi nested list
+        try:
+            flat_logits = _flatten(logits)
+            probs = _softmax(flat_logits, SOFTMAX_TEMPERATURE)
+        except Exception as e:
+            return {"error": f"Lỗi parse dữ liệu từ sentiment: {e}"}
+
+        # Tính phần trăm mỗi nhãn
+        label_distribution = {
+            LABELS[i]: round(float(p) * 100, ROUND_DECIMALS)
+            for i, p in enumerate(probs)
+        }
+        # Đảm bảo tổng = 100%
+        total = sum(label_distribution.values())
+        if total != 100:
+            correction = 100 - total
+            largest_label = max(label_distribution, key=label_distribution.get)
+            label_distribution[largest_label] = round(label_distribution[largest_label] + correction, ROUND_DECIMALS)
+
+        predicted_label = max(label_distribution, key=label_distribution.get)
+        emotion_detail = EMOTION_MAP.get(predicted_label, "")
+
+        return {
+            "input": text,
+            "predicted_label": predicted_label,
+            "label_distribution": label_distribution,
+            "probs": probs,
+            "raw_logits": flat_logits,
+            "emotion_detail": emotion_detail,
+            "model": SENTIMENT_MODEL_NAME,
+            "timestamp": get_vn_timestamp(),
+        }
+
+    elif label:
+        emotion_detail = EMOTION_MAP.get(label, "")
+        print(f"[Sentiment] {label.upper()} (no logits) → 100%")
+        return {
+            "input": text,
+            "predicted_label": label,
+            "label_distribution": {label: 100.0},
+            "emotion_detail": emotion_detail,
+            "model": SENTIMENT_MODEL_NAME,
+            "timestamp": get_vn_timestamp()
+        }
+
+    else:
+        return {"error": f"Không tìm thấy logits hoặc label từ API {url}"}
+
+
+# === Backend in-process ("local" torch / "onnx", xem core/sentiment_backends.py) ===
+_IN_PROCESS_BACKENDS = ("local", "onnx")
+
+
+def _is_in_process_backend() -> bool:
+    return SENTIMENT_BACKEND in _IN_PROCESS_BACKENDS
+
+
+def _query_sentiment_local(texts):
+    """Suy luận batch bằng model trong process, trả list kết quả cùng dạng với bản gọi Space."""
+    try:
+        all_logits = get_backend(SENTIMENT_BACKEND).predict_logits(texts)
+    except Exception as e:
+        return [{"error": f"Lỗi backend sentiment {SENTIMENT_BACKEND}: {e}"} for _ in texts]
+    return [
+        _build_sentiment_result(text, {"raw_logits": logits}, f"backend:{SENTIMENT_BACKEND}")
+        for text, logits in zip(texts, all_logits)
+    ]
+
+
+# === Cache sentiment (xem core/sentiment_cache.py) ===
+def _lookup_cache(texts, use_cache=True):
+    """
+    Tra cache cho từng text (đã clean).
+    Returns:
+        (results, miss_indices) — results[i] là kết quả cache (cache_hit=True) hoặc None.
+    """
+    results = [None] * len(texts)
+    cache = get_sentiment_cache() if use_cache else None
+    if cache is None:
+        return results, list(range(len(texts)))
+
+    misses = []
+    for i, text in enumerate(texts):
+        cached = cache.get(make_cache_key(text))
+        if cached is None:
+            misses.append(i)
+        else:
+            cached["cache_hit"] = True
+            cached["timestamp"] = get_vn_timestamp()
+            results[i] = cached
+    return results, misses
+
+
+def _store_results(texts, results, use_cache=True):
+    """Đánh dấu cache_hit=False và lưu các kết quả không lỗi vào cache."""
+    cache = get_sentiment_cache() if use_cache else None
+    for text, result in zip(texts, results):
+        if result is None or "error" in result:
+            continue
+        result["cache_hit"] = False
+        if cache is not None:
+            cache.set(make_cache_key(text), result)
+    return results
+
 
 # === Hàm chính ===
-def query_model(model_name: str, text: str):
+def query_model(model_name: str, text: str, use_cache: bool = True):
     """
     Gọi model 'sentiment' hoặc 'response'.
-    - Sentiment: gọi Hugging Face Space, tính softmax, trả tỉ lệ % từng nhãn.
+    - Sentiment: gọi Hugging Face Space (hoặc model trong process nếu SENTIMENT_BACKEND = "local"/"onnx"),
+      tính softmax, trả tỉ lệ % từng nhãn.
+      Chunk đã gặp (cùng model + nhiệt độ) lấy từ cache, không gọi mạng ("cache_hit": True).
     - Response: gọi Gemini để sinh phản hồi.
     """
     text = clean_text(text)
@@ -47,69 +308,29 @@ def query_model(model_name: str, text: str):
     try:
         # --- Model 1: Sentiment ---
         if model_name == "sentiment":
+            cached, misses = _lookup_cache([text], use_cache)
+            if not misses:
+                return cached[0]
+
+            if _is_in_process_backend():
+                result = _query_sentiment_local([text])[0]
+                return _store_results([text], [result], use_cache)[0]
+
             url = SENTIMENT_API_URL
             payload = {"text": text}
 
-            response = requests.post(url, headers=HEADERS, json=payload, timeout=TIMEOUT)
+            response = get_http_session().post(url, json=payload, timeout=TIMEOUT)
             response.raise_for_status()
             data = response.json()
 
-            logits = data.get("raw_logits") or data.get("logits") or data.get("scores")
-            label = data.get("predicted_label") or data.get("label")
-
-            if logits:
-                # Ép logits thành mảng phẳng 1D, tránh lỗi nested list
-                try:
-                    logits_tensor = torch.tensor(logits, dtype=torch.float32).flatten()
-                    probs = F.softmax(logits_tensor / SOFTMAX_TEMPERATURE, dim=-1)
-                    probs = probs.detach().cpu().numpy()  # chuyển sang numpy để tính toán dễ
-                except Exception as e:
-                    return {"error": f"Lỗi parse dữ liệu từ sentiment: {e}"}
-
-                # Tính phần trăm mỗi nhãn
-                label_distribution = {
-                    LABELS[i]: round(float(p) * 100, ROUND_DECIMALS)
-                    for i, p in enumerate(probs)
-                }
-                # Đảm bảo tổng = 100%
-                total = sum(label_distribution.values())
-                if total != 100:
-                    correction = 100 - total
-                    largest_label = max(label_distribution, key=label_distribution.get)
-                    label_distribution[largest_label] = round(label_distribution[largest_label] + correction, ROUND_DECIMALS)
-
-                predicted_label = max(label_distribution, key=label_distribution.get)
-                emotion_detail = EMOTION_MAP.get(predicted_label, "")
-
-                return {
-                    "input": text,
-                    "predicted_label": predicted_label,
-                    "label_distribution": label_distribution,
-                    "emotion_detail": emotion_detail,
-                    "model": SENTIMENT_MODEL_NAME,
-                    "timestamp": get_vn_timestamp(),
-                }
-
-            elif label:
-                emotion_detail = EMOTION_MAP.get(label, "")
-                print(f"[Sentiment] {label.upper()} (no logits) → 100%")
-                return {
-                    "input": text,
-                    "predicted_label": label,
-                    "label_distribution": {label: 100.0},
-                    "emotion_detail": emotion_detail,
-                    "model": SENTIMENT_MODEL_NAME,
-                    "timestamp": get_vn_timestamp()
-                }
-
-            else:
-                return {"error": f"Không tìm thấy logits hoặc label từ API {url}"}
+            result = _build_sentiment_result(text, data, url)
+            return _store_results([text], [result], use_cache)[0]
 
         # --- Model 2: Response (Gemini) ---
         elif model_name == "response":
-            response = gemini_model.generate_content(
+            response = _get_gemini_model().generate_content(
                 text,
-                generation_config=genai.types.GenerationConfig(temperature=0.7),
+                generation_config=_generation_config(),
             )
             gemini_message = response.text
             return {
@@ -127,3 +348,430 @@ def query_model(model_name: str, text: str):
         return {"error": f"Lỗi khi gọi model {model_name}: {e}"}
     except Exception as e:
         return {"error": f"Lỗi parse dữ liệu từ {model_name}: {e}"}
+
+
+# === Response dạng stream (Gemini) ===
+def stream_model_response(text: str):
+    """
+    Gọi Gemini ở chế độ stream, yield từng đoạn text ngay khi model sinh ra.
+    Lỗi mạng / API được raise cho caller xử lý (pipeline sẽ fallback).
+    """
+    response = _get_gemini_model().generate_content(
+        clean_text(text),
+        generation_config=_generation_config(),
+        stream=True,
+    )
+    for chunk in response:
+        delta = getattr(chunk, "text", "")
+        if delta:
+            yield delta
+
+
+async def stream_model_response_async(text: str):
+    """Bản async-generator của stream_model_response()."""
+    response = await _get_gemini_model().generate_content_async(
+        clean_text(text),
+        generation_config=_generation_config(),
+        stream=True,
+    )
+    async for chunk in response:
+        delta = getattr(chunk, "text", "")
+        if delta:
+            yield delta
+
+
+def build_streamed_response(parts) -> dict:
+    """Ghép các đoạn đã stream thành dict giống query_model("response", ...)."""
+    return {
+        "text": "".join(parts).strip().replace("\\n", "\n"),
+        "source": "google_gemini_2.5_flash",
+        "timestamp": get_vn_timestamp()
+    }
+
+
+# === Sentiment theo lô (batch) ===
+def query_sentiment_batch(texts):
+    """
+    Phân tích sentiment cho nhiều đoạn text trong MỘT request tới Space.
+    - Gửi {"texts": [...]} tới SENTIMENT_BATCH_API_URL (tối đa SENTIMENT_BATCH_SIZE text/lần).
+    - Trả về list kết quả cùng thứ tự với `texts`, mỗi phần tử có dạng giống
+      query_model("sentiment", ...) (kèm "probs" và "raw_logits").
+    - Lỗi ở phần tử nào → phần tử đó là {"error": ...}.
+    - Nếu Space chưa hỗ trợ endpoint batch (404/405) → gọi song song từng text
+      (nhớ cho cả process, không gửi thử endpoint batch lại nữa).
+    - Chunk có trong cache không được gửi đi ("cache_hit": True).
+    """
+    cleaned = [clean_text(t) for t in texts]
+    results, misses = _lookup_cache(cleaned)
+    miss_texts = [cleaned[i] for i in misses]
+
+    if SENTIMENT_MICROBATCH_ENABLED and miss_texts:
+        # Gộp chung với chunk của các pipeline khác đang chạy đồng thời
+        futures = get_microbatcher().submit_many(miss_texts)
+        fetched = [_future_result(f) for f in futures]
+    else:
+        fetched = _fetch_sentiment_uncached(miss_texts)
+
+    for i, result in zip(misses, _store_results(miss_texts, fetched)):
+        results[i] = result
+    return results
+
+
+def _fetch_sentiment_uncached(texts):
+    """Gọi backend hiện tại (Space theo lô hoặc model trong process) cho các text chưa có trong cache."""
+    if not texts:
+        return []
+    if _is_in_process_backend():
+        return _query_sentiment_local(texts)
+
+    fetched = []
+    for start in range(0, len(texts), SENTIMENT_BATCH_SIZE):
+        batch = texts[start:start + SENTIMENT_BATCH_SIZE]
+        fetched.extend(_query_sentiment_batch_once(batch))
+    return fetched
+
+
+# Space trả 404/405 cho endpoint batch 1 lần → nhớ cho cả process, các lô sau gọi
+# thẳng từng chunk thay vì tốn thêm 1 round-trip hỏng cho mỗi nhật ký (restart để thử lại)
+_batch_endpoint_unsupported = False
+
+
+def _mark_batch_endpoint_unsupported(status) -> None:
+    global _batch_endpoint_unsupported
+    if not _batch_endpoint_unsupported:
+        print(f"[Sentiment] Endpoint batch chưa hỗ trợ ({status}) → từ giờ gọi song song từng chunk")
+    _batch_endpoint_unsupported = True
+
+
+def _query_sentiment_batch_once(texts):
+    """Gửi 1 lô text, trả về list kết quả (hoặc lỗi) cùng độ dài với `texts`."""
+    url = SENTIMENT_BATCH_API_URL
+    if _batch_endpoint_unsupported:
+        return query_sentiment_concurrent(texts, use_cache=False)
+
+    try:
+        response = get_http_session().post(url, json={"texts": texts}, timeout=TIMEOUT)
+        if response.status_code in (404, 405):
+            _mark_batch_endpoint_unsupported(response.status_code)
+            return query_sentiment_concurrent(texts, use_cache=False)
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.Timeout:
+        return [{"error": "Timeout khi gọi model sentiment (batch)."} for _ in texts]
+    except requests.exceptions.RequestException as e:
+        return [{"error": f"Lỗi khi gọi model sentiment (batch): {e}"} for _ in texts]
+    except Exception as e:
+        return [{"error": f"Lỗi parse dữ liệu từ sentiment (batch): {e}"} for _ in texts]
+
+    return _build_batch_results(texts, data, url)
+
+
+# === Sentiment song song (fan-out có giới hạn) ===
+def query_sentiment_concurrent(texts, max_concurrency: int = SENTIMENT_MAX_CONCURRENCY,
+                               use_cache: bool = True):
+    """
+    Gọi query_model("sentiment", ...) cho từng text, tối đa `max_concurrency` request cùng lúc.
+    - Kết quả giữ đúng thứ tự `texts`.
+    - Fail fast: chunk đầu tiên lỗi → huỷ các chunk chưa chạy; vị trí chưa có
+      kết quả là None, vị trí lỗi là {"error": ...}.
+    """
+    if _is_in_process_backend():
+        # Model local: 1 batch CPU nhanh hơn nhiều thread tranh nhau
+        return query_sentiment_batch(texts)
+
+    results = [None] * len(texts)
+    if not texts:
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(texts))))
+    try:
+        pending = {
+            executor.submit(query_model, "sentiment", t, use_cache=use_cache): i
+            for i, t in enumerate(texts)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            failed = False
+            for future in done:
+                i = pending.pop(future)
+                results[i] = future.result()
+                failed = failed or "error" in results[i]
+            if failed:
+                break
+    finally:
+        # Không chờ các request đang chạy khi đã fail fast
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+async def query_sentiment_concurrent_async(texts, max_concurrency: int = SENTIMENT_MAX_CONCURRENCY,
+                                           use_cache: bool = True):
+    """Bản async của query_sentiment_concurrent(), cùng input/output."""
+    if _is_in_process_backend():
+        return await asyncio.to_thread(query_sentiment_batch, texts)
+
+    results = [None] * len(texts)
+    if not texts:
+        return results
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_one(i, text):
+        async with semaphore:
+            return i, await query_model_async("sentiment", text, use_cache=use_cache)
+
+    tasks = [asyncio.ensure_future(run_one(i, t)) for i, t in enumerate(texts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            i, result = await next_done
+            results[i] = result
+            if "error" in result:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return results
+
+
+def _build_batch_results(texts, data, url):
+    """Ghép payload batch của API với từng text đầu vào (giữ nguyên thứ tự)."""
+    items = data if isinstance(data, list) else (data.get("results") or data.get("predictions") or [])
+    if len(items) != len(texts):
+        err = f"API batch trả về {len(items)} kết quả cho {len(texts)} text"
+        return [{"error": err} for _ in texts]
+
+    return [
+        _build_sentiment_result(text, item, url) if isinstance(item, dict)
+        else {"error": f"Kết quả batch không hợp lệ: {item!r}"}
+        for text, item in zip(texts, items)
+    ]
+
+
+# === Bản async (asyncio) ===
+async def query_model_async(model_name: str, text: str, use_cache: bool = True):
+    """
+    Bản async của query_model(), cùng input/output.
+    - Sentiment: aiohttp (nếu có cài), ngược lại chạy query_model trong thread.
+    - Response: Gemini generate_content_async.
+    """
+    if model_name == "sentiment" and (not _HAS_AIOHTTP or _is_in_process_backend()):
+        return await asyncio.to_thread(query_model, model_name, text, use_cache)
+
+    text = clean_text(text)
+
+    try:
+        # --- Model 1: Sentiment ---
+        if model_name == "sentiment":
+            cached, misses = _lookup_cache([text], use_cache)
+            if not misses:
+                return cached[0]
+
+            url = SENTIMENT_API_URL
+            _, data = await _post_json_async(url, {"text": text})
+            if data is None:
+                return {"error": f"Lỗi khi gọi model {model_name}: endpoint {url} không tồn tại"}
+            result = _build_sentiment_result(text, data, url)
+            return _store_results([text], [result], use_cache)[0]
+
+        # --- Model 2: Response (Gemini) ---
+        elif model_name == "response":
+            response = await _get_gemini_model().generate_content_async(
+                text,
+                generation_config=_generation_config(),
+            )
+            gemini_message = response.text
+            return {
+                "text": gemini_message.strip().replace("\\n", "\n"),
+                "source": "google_gemini_2.5_flash",
+                "timestamp": get_vn_timestamp()
+            }
+
+        else:
+            return {"error": f"Model '{model_name}' không được hỗ trợ."}
+
+    except asyncio.TimeoutError:
+        return {"error": f"Timeout khi gọi model {model_name}."}
+    except Exception as e:
+        if _HAS_AIOHTTP and isinstance(e, _aiohttp().ClientError):
+            return {"error": f"Lỗi khi gọi model {model_name}: {e}"}
+        return {"error": f"Lỗi parse dữ liệu từ {model_name}: {e}"}
+
+
+async def query_sentiment_batch_async(texts):
+    """Bản async của query_sentiment_batch(), cùng input/output."""
+    if not SENTIMENT_MICROBATCH_ENABLED and (not _HAS_AIOHTTP or _is_in_process_backend()):
+        return await asyncio.to_thread(query_sentiment_batch, texts)
+
+    cleaned = [clean_text(t) for t in texts]
+    results, misses = _lookup_cache(cleaned)
+    miss_texts = [cleaned[i] for i in misses]
+
+    fetched = []
+    if SENTIMENT_MICROBATCH_ENABLED:
+        futures = get_microbatcher().submit_many(miss_texts)
+        fetched = await _gather_microbatch(futures)
+    else:
+        for start in range(0, len(miss_texts), SENTIMENT_BATCH_SIZE):
+            batch = miss_texts[start:start + SENTIMENT_BATCH_SIZE]
+            fetched.extend(await _query_sentiment_batch_once_async(batch))
+
+    for i, result in zip(misses, _store_results(miss_texts, fetched)):
+        results[i] = result
+    return results
+
+
+async def _gather_microbatch(futures):
+    """Bản async của _future_result: cùng giới hạn thời gian chờ, lỗi / quá hạn → dict lỗi."""
+    waits = [asyncio.wrap_future(f) for f in futures]
+    try:
+        done = await asyncio.wait_for(asyncio.gather(*waits, return_exceptions=True),
+                                      timeout=_microbatch_timeout())
+    except asyncio.TimeoutError:
+        # wait_for đã huỷ các future chưa xong; giữ kết quả của những chunk đã có
+        done = [w.result() if w.done() and not w.cancelled() and w.exception() is None else None
+                for w in waits]
+    return [
+        r if isinstance(r, dict) else {"error": f"Timeout khi chờ micro-batch sentiment: {r or 'quá hạn'}"}
+        for r in done
+    ]
+
+
+async def _query_sentiment_batch_once_async(texts):
+    url = SENTIMENT_BATCH_API_URL
+    if _batch_endpoint_unsupported:
+        return await query_sentiment_concurrent_async(texts, use_cache=False)
+
+    try:
+        status, data = await _post_json_async(url, {"texts": texts})
+        if data is None:
+            _mark_batch_endpoint_unsupported(status)
+            return await query_sentiment_concurrent_async(texts, use_cache=False)
+    except asyncio.TimeoutError:
+        return [{"error": "Timeout khi gọi model sentiment (batch)."} for _ in texts]
+    except Exception as e:
+        if _HAS_AIOHTTP and isinstance(e, _aiohttp().ClientError):
+            return [{"error": f"Lỗi khi gọi model sentiment (batch): {e}"} for _ in texts]
+        return [{"error": f"Lỗi parse dữ liệu từ sentiment (batch): {e}"} for _ in texts]
+
+    return _build_batch_results(texts, data, url)
+
+
+# === Micro-batching giữa nhiều pipeline đồng thời ===
+class SentimentMicroBatcher:
+    """
+    Gom chunk từ nhiều pipeline chạy đồng thời thành 1 lô:
+    - Lô được gửi khi đủ `max_batch_size` chunk hoặc sau `max_wait_ms` kể từ chunk đầu tiên.
+    - Mỗi caller nhận Future riêng, kết quả được trả đúng về chunk của mình.
+    - Tối đa `max_inflight` lô được gửi song song.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = SENTIMENT_MICROBATCH_MAX_SIZE,
+                 max_wait_ms: float = SENTIMENT_MICROBATCH_MAX_WAIT_MS,
+                 max_inflight: int = SENTIMENT_MAX_CONCURRENCY):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_inflight))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sentiment-microbatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        if self._closed:
+            raise RuntimeError("SentimentMicroBatcher đã đóng.")
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def submit_many(self, texts):
+        return [self.submit(t) for t in texts]
+
+    def close(self) -> None:
+        """Dừng nhận chunk mới, gửi nốt các chunk đang chờ rồi dừng thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            self._executor.submit(self._dispatch, batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        # Nhận từng future trước khi gửi: caller đã bỏ chờ (future bị huỷ khi quá hạn)
+        # → bỏ chunk đó khỏi lô; future đã nhận thì không còn huỷ được nữa
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        try:
+            results = self.batch_fn(texts)
+        except Exception as e:
+            results = [{"error": f"Lỗi micro-batch sentiment: {e}"} for _ in texts]
+        if len(results) != len(texts):
+            results = [{"error": "Micro-batch trả về sai số lượng kết quả"} for _ in texts]
+        for (_, future), result in zip(batch, results):
+            try:
+                future.set_result(result)
+            except Exception as e:  # 1 future hỏng không được chặn các caller khác trong lô
+                print(f"⚠️ Không trả được kết quả micro-batch: {e}")
+
+
+_microbatcher = None
+_microbatcher_lock = threading.Lock()
+
+
+def get_microbatcher() -> SentimentMicroBatcher:
+    """Micro-batcher dùng chung cho toàn process (gửi qua backend hiện tại, không qua cache)."""
+    global _microbatcher
+    if _microbatcher is None:
+        with _microbatcher_lock:
+            if _microbatcher is None:
+                _microbatcher = SentimentMicroBatcher(_fetch_sentiment_uncached)
+    return _microbatcher
+
+
+def close_microbatcher() -> None:
+    global _microbatcher
+    with _microbatcher_lock:
+        if _microbatcher is not None:
+            _microbatcher.close()
+            _microbatcher = None
+
+
+def _microbatch_timeout() -> float:
+    return TIMEOUT + SENTIMENT_MICROBATCH_MAX_WAIT_MS / 1000.0
+
+
+def _future_result(future: Future):
+    """Chờ kết quả micro-batch, trả dict lỗi thay vì treo khi quá hạn."""
+    try:
+        return future.result(timeout=_microbatch_timeout())
+    except Exception as e:
+        return {"error": f"Timeout khi chờ micro-batch sentiment: {e}"}
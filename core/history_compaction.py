@@ -0,0 +1,360 @@
+"""
+core/history_compaction.py
+-----------------------------------------
+Compaction + các tầng lưu trữ lịch sử:
+
+    hot  : bản ghi đầy đủ trong history store (HISTORY_HOT_DAYS ngày gần nhất)
+    day  : tổng kết theo (user, ngày) cho phần cũ hơn  ┐ HISTORY_SUMMARY_PATH
+    week : tổng kết theo (user, tuần) khi ngày đã quá cũ ┘
+    cold : bản ghi gốc đã gộp, nén gzip theo tháng trong HISTORY_ARCHIVE_DIR
+
+Mỗi tổng kết gồm: count, label_counts, distribution_sum / mean_distribution,
+topics, case_types, first/last timestamp. Giữ tổng (không giữ trung bình)
+nên gộp ngày → tuần hay gộp thêm lần sau vẫn chính xác.
+
+Đọc: summarize_history() trả về tổng kết theo ngày/tuần cho 1 khoảng thời gian,
+tự lấy từ tầng tổng kết cho phần đã compact và tính từ bản ghi hot cho phần còn lại.
+
+Chạy lại an toàn: mỗi tầng (kho lạnh, tổng kết) ghi kèm danh sách id bản ghi của
+lô vừa xử lý; job dừng giữa chừng (chưa kịp xoá khỏi store) thì lần sau bỏ qua
+các bản ghi đó → không cộng 2 lần. Vector + text trong index embedding của bản
+ghi đã compact cũng bị xoá cùng lúc (prune_embeddings) để dung lượng có giới hạn.
+-----------------------------------------
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from core.config import (
+    LABELS,
+    HISTORY_HOT_DAYS,
+    HISTORY_WEEKLY_AFTER_DAYS,
+    HISTORY_SUMMARY_PATH,
+    HISTORY_ARCHIVE_DIR,
+    HISTORY_EMBED_DIR,
+)
+from core.history_embeddings import prune_embeddings
+from core.history_store import ALL_USERS, entry_key, entry_label, exclude_entries, get_history_store
+from core.utils import VN_TZ, atomic_write_json, file_lock
+
+
+def _vn_now() -> datetime:
+    return datetime.now(VN_TZ).replace(tzinfo=None)
+
+
+def _day(timestamp: str) -> str:
+    return timestamp[:10]
+
+
+def _week_start(day: str) -> str:
+    d = datetime.strptime(day, "%Y-%m-%d")
+    return (d - timedelta(days=d.weekday())).strftime("%Y-%m-%d")
+
+
+def _empty_summary(user_id: Optional[str], period: str, start: str) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "period": period,
+        "start": start,
+        "count": 0,
+        "label_counts": {label: 0 for label in LABELS},
+        "distribution_sum": {label: 0.0 for label in LABELS},
+        "topics": {},
+        "case_types": {},
+        "first_timestamp": None,
+        "last_timestamp": None,
+    }
+
+
+def _add_entry(summary: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    summary["count"] += 1
+    label = entry_label(entry)
+    if label in summary["label_counts"]:
+        summary["label_counts"][label] += 1
+    for name, value in (entry.get("label_distribution") or {}).items():
+        if name in summary["distribution_sum"]:
+            summary["distribution_sum"][name] += float(value)
+    for field, key in (("topics", "topic"), ("case_types", "case_type")):
+        value = entry.get(key)
+        if value:
+            summary[field][value] = summary[field].get(value, 0) + 1
+    ts = entry.get("timestamp", "")
+    if summary["first_timestamp"] is None or ts < summary["first_timestamp"]:
+        summary["first_timestamp"] = ts
+    if summary["last_timestamp"] is None or ts > summary["last_timestamp"]:
+        summary["last_timestamp"] = ts
+
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+    into["count"] += other["count"]
+    for field in ("label_counts", "distribution_sum", "topics", "case_types"):
+        counter = Counter(into[field])
+        counter.update(other[field])
+        into[field] = dict(counter)
+    for key, pick in (("first_timestamp", min), ("last_timestamp", max)):
+        values = [v for v in (into[key], other[key]) if v]
+        into[key] = pick(values) if values else None
+
+
+def _finalize(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Bản sao có thêm mean_distribution (%), dominant_label, top_topic."""
+    out = dict(summary)
+    count = summary["count"] or 1
+    out["mean_distribution"] = {k: round(v / count, 1) for k, v in summary["distribution_sum"].items()}
+    out["dominant_label"] = max(summary["label_counts"], key=summary["label_counts"].get) if summary["count"] else None
+    out["top_topic"] = max(summary["topics"], key=summary["topics"].get) if summary["topics"] else None
+    return out
+
+
+def summarize_entries(entries: Iterable[Dict[str, Any]], period: str = "day") -> List[Dict[str, Any]]:
+    """Gộp bản ghi thành tổng kết theo (user, ngày) hoặc (user, tuần)."""
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for entry in entries:
+        day = _day(entry.get("timestamp", ""))
+        if not day:
+            continue
+        start = day if period == "day" else _week_start(day)
+        key = (entry.get("user_id"), start)
+        if key not in groups:
+            groups[key] = _empty_summary(entry.get("user_id"), period, start)
+        _add_entry(groups[key], entry)
+    return [groups[k] for k in sorted(groups, key=lambda k: (str(k[0]), k[1]))]
+
+
+def _summary_key(summary: Dict[str, Any]) -> str:
+    return f"{summary['user_id']}|{summary['period']}|{summary['start']}"
+
+
+def _batch_id(entry: Dict[str, Any]) -> str:
+    """Id ngắn của 1 bản ghi trong lô compaction (theo entry_key)."""
+    return hashlib.sha1(json.dumps(entry_key(entry), ensure_ascii=False).encode("utf-8")).hexdigest()[:20]
+
+
+def _not_done(entries: List[Dict[str, Any]], done: List[str]) -> List[Dict[str, Any]]:
+    """Bỏ các bản ghi có id trong lô đã xử lý `done` (mỗi id bỏ đúng 1 lần)."""
+    skip = Counter(done)
+    kept = []
+    for entry in entries:
+        bid = _batch_id(entry)
+        if skip[bid] > 0:
+            skip[bid] -= 1
+            continue
+        kept.append(entry)
+    return kept
+
+
+# ============================================================
+# Tầng tổng kết (day / week)
+# ============================================================
+class HistorySummaryStore:
+    """
+    File JSON nhỏ {key: summary}; ghi dưới khoá file + ghi nguyên tử.
+    Khoá riêng META_KEY giữ id các bản ghi của lô compaction gần nhất.
+    """
+
+    META_KEY = "__compaction__"
+
+    def __init__(self, path: str = HISTORY_SUMMARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _summaries(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [v for k, v in data.items() if k != self.META_KEY]
+
+    def load(self) -> List[Dict[str, Any]]:
+        return self._summaries(self._read())
+
+    def last_batch(self) -> List[str]:
+        """Id bản ghi của lô compaction gần nhất đã cộng vào tổng kết."""
+        return self._read().get(self.META_KEY, {}).get("last_batch", [])
+
+    def merge(self, summaries: Iterable[Dict[str, Any]], batch: Optional[List[str]] = None) -> None:
+        """
+        Cộng dồn tổng kết mới vào tổng kết đã có cùng (user, period, start).
+        `batch`: id các bản ghi tạo ra tổng kết này – ghi cùng 1 lần (nguyên tử)
+        để lần compaction sau biết lô này đã được cộng.
+        """
+        with self._lock, file_lock(self.path):
+            data = self._read()
+            for summary in summaries:
+                key = _summary_key(summary)
+                if key in data:
+                    _merge(data[key], summary)
+                else:
+                    data[key] = summary
+            if batch is not None:
+                data[self.META_KEY] = {"last_batch": batch}
+            atomic_write_json(self.path, data, indent=None)
+
+    def roll_days_into_weeks(self, before_day: str) -> int:
+        """Gộp tổng kết ngày < before_day thành tổng kết tuần. Trả về số tổng kết ngày đã gộp."""
+        with self._lock, file_lock(self.path):
+            data = self._read()
+            old_days = [k for k, v in data.items()
+                        if k != self.META_KEY and v["period"] == "day" and v["start"] < before_day]
+            for key in old_days:
+                day = data.pop(key)
+                week = _empty_summary(day["user_id"], "week", _week_start(day["start"]))
+                _merge(week, day)
+                week_key = _summary_key(week)
+                if week_key in data:
+                    _merge(data[week_key], week)
+                else:
+                    data[week_key] = week
+            if old_days:
+                atomic_write_json(self.path, data, indent=None)
+            return len(old_days)
+
+    def query(self, user_id: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Tổng kết có start trong [since, until) (ngày "YYYY-MM-DD"), cũ nhất trước."""
+        def in_range(summary):
+            if user_id is not None and summary["user_id"] != user_id:
+                return False
+            if since is not None:
+                # Tuần chứa `since` vẫn tính (tuần bắt đầu trước since)
+                floor = _week_start(since) if summary["period"] == "week" else since
+                if summary["start"] < floor:
+                    return False
+            return until is None or summary["start"] < until
+
+        rows = [s for s in self.load() if in_range(s)]
+        return sorted(rows, key=lambda s: (s["start"], s["period"]))
+
+
+# ============================================================
+# Kho lưu trữ lạnh (bản ghi gốc, gzip theo tháng)
+# ============================================================
+def archive_entries(entries: List[Dict[str, Any]], archive_dir: str = HISTORY_ARCHIVE_DIR) -> int:
+    """Ghi thêm bản ghi gốc vào archive_dir/YYYY-MM.jsonl.gz (mỗi lần ghi là 1 gzip member)."""
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        by_month.setdefault(entry.get("timestamp", "unknown")[:7] or "unknown", []).append(entry)
+    os.makedirs(archive_dir, exist_ok=True)
+    for month, rows in by_month.items():
+        path = os.path.join(archive_dir, f"{month}.jsonl.gz")
+        with file_lock(path), gzip.open(path, "at", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return len(entries)
+
+
+def _archive_batch_path(archive_dir: str) -> str:
+    return os.path.join(archive_dir, "_last_batch.json")
+
+
+def _archived_batch(archive_dir: str) -> List[str]:
+    try:
+        with open(_archive_batch_path(archive_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def iter_archive(archive_dir: str = HISTORY_ARCHIVE_DIR, user_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Đọc lại bản ghi gốc đã lưu trữ (theo thứ tự tháng)."""
+    if not os.path.isdir(archive_dir):
+        return
+    for name in sorted(os.listdir(archive_dir)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        with gzip.open(os.path.join(archive_dir, name), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if user_id is None or entry.get("user_id") == user_id:
+                        yield entry
+
+
+# ============================================================
+# Compaction job
+# ============================================================
+def compact_history(store=None, summaries: Optional[HistorySummaryStore] = None,
+                    hot_days: int = HISTORY_HOT_DAYS, weekly_after_days: int = HISTORY_WEEKLY_AFTER_DAYS,
+                    archive_dir: str = HISTORY_ARCHIVE_DIR, now: Optional[datetime] = None,
+                    embed_dir: Optional[str] = HISTORY_EMBED_DIR) -> Dict[str, int]:
+    """
+    1) Bản ghi hot cũ hơn hot_days → ghi vào kho lạnh + cộng vào tổng kết ngày
+       (mỗi tầng bỏ qua bản ghi đã xử lý ở lần chạy trước bị dừng giữa chừng)
+    2) Xoá các bản ghi đó khỏi store (chỉ sau khi 1) đã ghi xong)
+       và khỏi index embedding trong embed_dir (None → bỏ qua)
+    3) Tổng kết ngày cũ hơn weekly_after_days → gộp thành tổng kết tuần
+    Cả job giữ file_lock(<file tổng kết> + ".compact") → không chạy chồng nhau.
+
+    Returns:
+        dict: số bản ghi đã compact / đã xoá / vector embedding đã xoá /
+              số tổng kết ngày đã gộp thành tuần.
+    """
+    store = store if store is not None else get_history_store()
+    summaries = summaries if summaries is not None else HistorySummaryStore()
+    now = now or _vn_now()
+    cutoff = (now - timedelta(days=hot_days)).strftime("%Y-%m-%d 00:00:00")
+
+    # Cả job giữ 1 khoá: 2 lần chạy chồng nhau (cron + worker) không compact cùng bản ghi 2 lần
+    with file_lock(summaries.path + ".compact"):
+        cold = [e for e in store.load_all() if e.get("timestamp", "") < cutoff]
+        if cold:
+            batch = [_batch_id(e) for e in cold]
+            # Mỗi tầng ghi xong mới đánh dấu lô → chạy lại sau khi dừng giữa chừng không ghi 2 lần
+            archive_entries(_not_done(cold, _archived_batch(archive_dir)), archive_dir)
+            atomic_write_json(_archive_batch_path(archive_dir), batch, indent=None)
+            summaries.merge(summarize_entries(_not_done(cold, summaries.last_batch()), "day"), batch=batch)
+        removed = store.remove_older_than(cutoff)
+        pruned = prune_embeddings(cutoff, embed_dir) if embed_dir else 0
+
+        week_cutoff = (now - timedelta(days=weekly_after_days)).strftime("%Y-%m-%d")
+        rolled = summaries.roll_days_into_weeks(week_cutoff)
+
+    return {"compacted": len(cold), "removed": removed, "embeddings_pruned": pruned,
+            "days_rolled_into_weeks": rolled}
+
+
+def summarize_history(user_id: Optional[str] = None, since: Optional[str] = None,
+                      until: Optional[str] = None, store=None,
+                      summaries: Optional[HistorySummaryStore] = None,
+                      exclude: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Tổng kết theo ngày (và theo tuần với phần đã gộp tuần) cho [since, until),
+    cũ nhất trước. Phần đã compact lấy từ tầng tổng kết, phần hot tính từ bản ghi gốc
+    → caller không cần biết dữ liệu đang nằm ở tầng nào.
+
+    Args:
+        user_id: None → mọi user (mỗi user 1 dòng / ngày)
+        since, until: ngày "YYYY-MM-DD"
+        exclude: bản ghi hot không tính vào (vd entry vừa ghi, caller tự cộng riêng)
+    """
+    store = store if store is not None else get_history_store()
+    summaries = summaries if summaries is not None else HistorySummaryStore()
+
+    compacted = summaries.query(user_id=user_id, since=since, until=until)
+    hot = store.query(user_id=ALL_USERS if user_id is None else user_id,
+                      since=f"{since} 00:00:00" if since else None)
+    if until:
+        hot = [e for e in hot if _day(e.get("timestamp", "")) < until]
+    if exclude:
+        hot = exclude_entries(hot, exclude)
+
+    merged: Dict[str, Dict[str, Any]] = {}
+    for summary in [*compacted, *summarize_entries(hot, "day")]:
+        key = _summary_key(summary)
+        if key in merged:
+            _merge(merged[key], summary)
+        else:
+            merged[key] = json.loads(json.dumps(summary))  # bản sao, không sửa dữ liệu gốc
+    rows = sorted(merged.values(), key=lambda s: (s["start"], s["period"], str(s["user_id"])))
+    return [_finalize(s) for s in rows]
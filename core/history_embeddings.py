@@ -0,0 +1,375 @@
+"""
+core/history_embeddings.py
+-----------------------------------------
+Tìm ký ức theo ngữ nghĩa cho build_past_context.
+
+- Embedder chạy CPU:
+    + HashingEmbedder (mặc định): n-gram từ / ký tự băm vào HISTORY_EMBED_DIM chiều,
+      numpy thuần, không cần tải model.
+    + TransformerEmbedder: model embedding (HISTORY_EMBED_MODEL) qua transformers + torch,
+      mean pooling; chỉ import khi HISTORY_EMBED_BACKEND = "transformer".
+- EmbeddingIndex (thư mục HISTORY_EMBED_DIR):
+    vectors.f32  – np.memmap float32 (n, dim), vector đã chuẩn hoá L2
+    meta.jsonl   – 1 dòng / vector: user_id, timestamp, text, nhãn, topic
+    lsh_planes.npy – siêu phẳng ngẫu nhiên cho ANN (random-hyperplane LSH)
+  Thêm tăng dần (add_many) khi pipeline lưu lịch sử; process khác đọc thêm phần mới
+  từ meta.jsonl. Tìm kiếm chỉ trong các entry của user (user_id=None → user ẩn danh,
+  không bao giờ lẫn user khác): ít entry → cosine chính xác (1 phép nhân ma trận),
+  nhiều entry → lấy ứng viên từ các bucket LSH (+ lệch 1 bit). Chỉ trả entry có
+  cosine >= HISTORY_EMBED_MIN_SCORE, không nhét entry chẳng liên quan vào context.
+- prune_embeddings(): compaction xoá vector + meta (kèm text) của entry đã compact,
+  ghi lại 2 file rồi os.replace; index đang mở nhận ra file mới và đọc lại từ đầu.
+-----------------------------------------
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.config import (
+    HISTORY_EMBED_BACKEND,
+    HISTORY_EMBED_MODEL,
+    HISTORY_EMBED_DIM,
+    HISTORY_EMBED_DIR,
+    HISTORY_EMBED_LSH_TABLES,
+    HISTORY_EMBED_LSH_BITS,
+    HISTORY_EMBED_EXACT_MAX,
+    HISTORY_EMBED_MIN_SCORE,
+)
+from core.history_store import entry_label, exclude_entries, get_history_store
+from core.utils import clean_text, file_lock
+
+META_FIELDS = ("user_id", "timestamp", "text", "predicted_label", "topic")
+
+
+# ============================================================
+# Embedder
+# ============================================================
+class HashingEmbedder:
+    """Bag of n-gram (từ, cặp từ, 3-gram ký tự) băm có dấu → vector L2 = 1."""
+
+    def __init__(self, dim: int = HISTORY_EMBED_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Dict[int, float]:
+        words = re.findall(r"\w+", clean_text(text).lower())
+        grams = list(words)
+        grams += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f"<{w}>"
+            grams += [padded[i:i + 3] for i in range(len(padded) - 2)]
+        counts: Dict[str, int] = {}
+        for g in grams:
+            counts[g] = counts.get(g, 0) + 1
+        features: Dict[int, float] = {}
+        for g, c in counts.items():
+            h = zlib.crc32(g.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            idx = h % self.dim
+            features[idx] = features.get(idx, 0.0) + sign * (1.0 + math.log(c))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for idx, value in self._features(text).items():
+                out[row, idx] = value
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+class TransformerEmbedder:
+    """Model embedding câu (mean pooling), load lười, chạy CPU."""
+
+    def __init__(self, model_name: str = HISTORY_EMBED_MODEL, batch_size: int = 32):
+        self.model_name = model_name
+        self.name = model_name
+        self.batch_size = batch_size
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+        self.dim = self._load().config.hidden_size
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from transformers import AutoTokenizer, AutoModel
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                    model = AutoModel.from_pretrained(self.model_name)
+                    model.eval()
+                    self._model = model
+        return self._model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        model = self._load()
+        out = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [clean_text(t) for t in texts[start:start + self.batch_size]]
+            encoded = self._tokenizer(batch, padding=True, truncation=True, return_tensors="pt")
+            with torch.inference_mode():
+                hidden = model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            out.append(torch.nn.functional.normalize(pooled, dim=-1).numpy())
+        return np.concatenate(out).astype(np.float32) if out else np.zeros((0, self.dim), np.float32)
+
+
+def get_embedder(backend: str = HISTORY_EMBED_BACKEND):
+    if backend == "hashing":
+        return HashingEmbedder()
+    if backend == "transformer":
+        return TransformerEmbedder()
+    raise ValueError(f"HISTORY_EMBED_BACKEND '{backend}' không được hỗ trợ.")
+
+
+# ============================================================
+# Index vector (memmap + LSH)
+# ============================================================
+class EmbeddingIndex:
+    """Vector của các entry lịch sử, tìm top-k giống nhất theo user."""
+
+    def __init__(self, root: str = HISTORY_EMBED_DIR, embedder=None,
+                 n_tables: int = HISTORY_EMBED_LSH_TABLES, n_bits: int = HISTORY_EMBED_LSH_BITS,
+                 exact_max: int = HISTORY_EMBED_EXACT_MAX,
+                 min_score: float = HISTORY_EMBED_MIN_SCORE):
+        self.root = root
+        self.embedder = embedder if embedder is not None else get_embedder()
+        self.dim = self.embedder.dim
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.exact_max = exact_max
+        self.min_score = min_score
+        self.vectors_path = os.path.join(root, "vectors.f32")
+        self.meta_path = os.path.join(root, "meta.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._check_info()
+
+        planes_path = os.path.join(root, "lsh_planes.npy")
+        planes = np.load(planes_path) if os.path.exists(planes_path) else None
+        if planes is None or planes.shape != (n_tables, n_bits, self.dim):
+            planes = np.random.RandomState(0).standard_normal((n_tables, n_bits, self.dim)).astype(np.float32)
+            np.save(planes_path, planes)
+        self._planes = planes
+        self._powers = (1 << np.arange(n_bits)).astype(np.int64)
+
+        self._reset()
+
+    def _reset(self) -> None:
+        self._meta: List[Dict[str, Any]] = []
+        self._meta_offset = 0
+        self._meta_ino: Optional[int] = None
+        self._user_rows: Dict[Optional[str], List[int]] = {}
+        self._buckets = [dict() for _ in range(self.n_tables)]
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+
+    def _check_info(self) -> None:
+        """Đổi embedder / số chiều → vector cũ không dùng được nữa, xoá để build lại."""
+        info_path = os.path.join(self.root, "info.json")
+        info = {"embedder": self.embedder.name, "dim": self.dim}
+        try:
+            with open(info_path, "r", encoding="utf-8") as f:
+                current = json.load(f)
+        except FileNotFoundError:
+            current = None
+        if current != info:
+            if current is not None:
+                print(f"⚠️ Embedder đổi ({current} → {info}) → xoá index embedding cũ")
+            for path in (self.vectors_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            with open(info_path, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+
+    # ---------- Lưu trữ ----------
+    def _map(self) -> None:
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        capacity = size // (4 * self.dim)
+        if capacity != self._capacity:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                      shape=(capacity, self.dim)) if capacity else None
+            self._capacity = capacity
+
+    def _ensure_capacity(self, n_rows: int) -> None:
+        if n_rows <= self._capacity:
+            return
+        new_capacity = max(n_rows, 2 * self._capacity, 1024)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * 4 * self.dim)
+        self._map()
+
+    def _signatures(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) → (n, n_tables) mã bucket."""
+        bits = np.einsum("tbd,nd->ntb", self._planes, vectors) > 0
+        return bits.astype(np.int64) @ self._powers
+
+    def _refresh(self) -> None:
+        """Đọc thêm các dòng meta mới (do process này hoặc process khác ghi)."""
+        try:
+            st = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return
+        if self._meta_ino is not None and (st.st_ino != self._meta_ino or st.st_size < self._meta_offset):
+            # File đã được prune_embeddings ghi lại (hàng bị dời) → đọc lại từ đầu
+            self._reset()
+        self._meta_ino = st.st_ino
+        with open(self.meta_path, "rb") as f:
+            f.seek(self._meta_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return
+        new_meta = [json.loads(line) for line in data[:end].decode("utf-8").splitlines() if line.strip()]
+        self._meta_offset += end
+        self._map()
+
+        start = len(self._meta)
+        rows = np.arange(start, start + len(new_meta))
+        signatures = self._signatures(np.asarray(self._vectors[rows])) if len(rows) else []
+        for row, meta, sig in zip(rows, new_meta, signatures):
+            row = int(row)
+            self._meta.append(meta)
+            user_id = meta.get("user_id")
+            self._user_rows.setdefault(user_id, []).append(row)
+            for table, code in enumerate(sig):
+                self._buckets[table].setdefault((user_id, int(code)), []).append(row)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._meta)
+
+    # ---------- API ----------
+    def add_many(self, entries: List[Dict[str, Any]]) -> int:
+        """Embed + thêm entry (bỏ qua entry không có text). Trả về số vector đã thêm."""
+        entries = [e for e in entries if e.get("text")]
+        if not entries:
+            return 0
+        vectors = self.embedder.embed([e["text"] for e in entries])
+
+        with self._lock, file_lock(self.meta_path):
+            self._refresh()
+            start = len(self._meta)
+            self._ensure_capacity(start + len(entries))
+            self._vectors[start:start + len(entries)] = vectors
+            self._vectors.flush()
+            lines = []
+            for entry in entries:
+                meta = {k: entry.get(k) for k in META_FIELDS}
+                meta["predicted_label"] = entry_label(entry)
+                lines.append(json.dumps(meta, ensure_ascii=False) + "\n")
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            self._refresh()
+        return len(entries)
+
+    def _candidates(self, user_id: Optional[str], query_sig: np.ndarray, k: int) -> List[int]:
+        # Cả 2 đường (chính xác / LSH) cùng phạm vi: chỉ các dòng của user_id (None = ẩn danh)
+        rows = self._user_rows.get(user_id, [])
+        if len(rows) <= self.exact_max:
+            return list(rows)
+        found = set()
+        for table, code in enumerate(query_sig):
+            code = int(code)
+            # Multi-probe: bucket của query + các bucket lệch 1 bit
+            for probe in [code] + [code ^ (1 << b) for b in range(self.n_bits)]:
+                found.update(self._buckets[table].get((user_id, probe), ()))
+        return sorted(found) if len(found) >= k else list(rows)
+
+    def search(self, text: str, user_id: Optional[str] = None, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        k entry giống `text` nhất của user (giống nhất trước, score >= min_score),
+        có thêm trường "score". Không entry nào đủ giống → [].
+        """
+        query = self.embedder.embed([text])[0]
+        query_sig = self._signatures(query[None, :])[0]
+        with self._lock:
+            self._refresh()
+            rows = self._candidates(user_id, query_sig, k)
+            if not rows:
+                return []
+            rows = np.asarray(rows)
+            scores = np.asarray(self._vectors[rows]) @ query
+            top = np.argsort(-scores)[:k] if len(rows) <= k else np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                dict(self._meta[int(rows[i])], score=round(float(scores[i]), 4))
+                for i in top if scores[i] >= self.min_score
+            ]
+
+
+def prune_embeddings(cutoff: str, root: str = HISTORY_EMBED_DIR) -> int:
+    """
+    Xoá vector + meta của entry có timestamp < cutoff ("YYYY-MM-DD HH:MM:SS"),
+    dùng khi compaction đã chuyển các entry đó ra khỏi lịch sử hot.
+    Không cần embedder (số chiều đọc từ info.json). Trả về số dòng đã xoá.
+    """
+    meta_path = os.path.join(root, "meta.jsonl")
+    vectors_path = os.path.join(root, "vectors.f32")
+    if not os.path.exists(meta_path):
+        return 0
+    with open(os.path.join(root, "info.json"), "r", encoding="utf-8") as f:
+        dim = json.load(f)["dim"]
+
+    with file_lock(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        keep = [i for i, line in enumerate(lines) if json.loads(line).get("timestamp", "") >= cutoff]
+        if len(keep) == len(lines):
+            return 0
+
+        capacity = os.path.getsize(vectors_path) // (4 * dim) if os.path.exists(vectors_path) else 0
+        kept = np.zeros((len(keep), dim), dtype=np.float32)
+        if keep and capacity:
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(capacity, dim))
+            kept = np.asarray(vectors[keep])
+            del vectors
+        kept.tofile(vectors_path + ".tmp")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("".join(lines[i] for i in keep))
+        # Vector trước, meta sau: index đang mở chỉ đọc lại (và map lại vector) khi thấy
+        # file meta mới, lúc đó file vector mới đã sẵn sàng
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(meta_path + ".tmp", meta_path)
+    return len(lines) - len(keep)
+
+
+# ============================================================
+# Index dùng chung cho toàn process
+# ============================================================
+_index: Optional[EmbeddingIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_embedding_index(exclude: Optional[List[Dict[str, Any]]] = None) -> EmbeddingIndex:
+    """
+    Index embedding dùng chung; lần đầu (index rỗng) tự embed lịch sử đang có trong store.
+
+    Args:
+        exclude: entry vừa ghi xuống store mà caller sẽ tự add_many → không embed lúc dựng lại
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = EmbeddingIndex()
+                if len(index) == 0:
+                    count = index.add_many(exclude_entries(get_history_store().load_all(), exclude))
+                    if count:
+                        print(f"🧭 Đã embed {count} entry lịch sử vào {index.root}/")
+                _index = index
+    return _index
@@ -3,36 +3,85 @@ history_engine.py
 --------------------
 Nhiệm vụ:
 - Đây là “bộ não ghi nhớ lịch sử” của hệ thống.
-- Trích xuất dữ liệu từ pipeline_history.json (HISTORY_DB_PATH)
+- Trích xuất dữ liệu lịch sử qua core/history_store.py (mặc định pipeline_history.jsonl)
 - Lọc và tạo một đoạn context ngắn gọn cho LLM, để phục vụ:
     + Gợi ý hành động
     + Gợi ý thói quen
     + Phân tích lại ký ức tích cực/tiêu cực
 """
 
-import json
-from datetime import datetime
-from core.config import HISTORY_DB_PATH
+from datetime import datetime, timedelta
+from core.config import HISTORY_WRITE_BEHIND, HISTORY_SEMANTIC_CONTEXT, HISTORY_ROLLUP_WINDOW_DAYS
+from core.history_store import ALL_USERS, get_history_store, entry_label
+from core.history_index import get_history_index
+from core.history_writer import get_history_writer, write_entries
+from core.history_compaction import summarize_history
+from core.history_rollups import get_mood_rollups, rollup_from_entries
+from core.history_embeddings import get_embedding_index
+from core.utils import VN_TZ, parse_vn_timestamp
 
 
 # ============================================================
-# 1. Load toàn bộ lịch sử từ JSON
+# 1. Load toàn bộ lịch sử từ history store
 # ============================================================
 
 def load_full_history():
     """
-    Mở file pipeline_history.json và trả về dạng list.
-    Nếu file chưa tồn tại → trả về list rỗng để không lỗi chương trình.
+    Đọc toàn bộ lịch sử từ store (HISTORY_BACKEND) và trả về dạng list.
+    Nếu chưa có dữ liệu → trả về list rỗng để không lỗi chương trình.
 
     Returns:
         list[dict]: danh sách các entry lịch sử mood.
     """
-    try:
-        with open(HISTORY_DB_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Khi chưa có dữ liệu — tránh crash
-        return []
+    return get_history_store().load_all()
+
+
+def save_history_entry(entry):
+    """
+    Ghi thêm 1 entry vào store (append, không ghi lại toàn bộ lịch sử) và cập nhật index RAM.
+    HISTORY_WRITE_BEHIND=True → chỉ đưa vào hàng đợi, thread nền ghi theo lô (core/history_writer.py).
+    """
+    if HISTORY_WRITE_BEHIND:
+        get_history_writer().submit(entry)
+    else:
+        write_entries([entry])
+
+
+def query_history(label=None, user_id=ALL_USERS, case_type=None, since=None, limit=None):
+    """
+    Lấy các entry khớp điều kiện, mới nhất trước.
+    Với HISTORY_BACKEND=sqlite đây là index lookup (không parse toàn bộ lịch sử).
+
+    Args:
+        label (str): "positive" / "neutral" / "negative"
+        user_id: chỉ lấy entry của user này (None → user ẩn danh; mặc định ALL_USERS → mọi user)
+        case_type (str): vd "consistent", "mixed"...
+        since (str): timestamp "YYYY-MM-DD HH:MM:SS" – chỉ lấy entry từ mốc này
+        limit (int): số entry tối đa
+
+    Returns:
+        list[dict]
+    """
+    return get_history_store().query(
+        label=label, user_id=user_id, case_type=case_type, since=since, limit=limit
+    )
+
+
+def load_mood_summaries(user_id=None, since=None, until=None):
+    """
+    Tổng kết mood theo ngày (phần đã compact lâu có thể là theo tuần) trong [since, until).
+    Tự đọc tầng tổng kết cho dữ liệu cũ và bản ghi hot cho dữ liệu mới
+    (xem core/history_compaction.py) → dùng cho thống kê dài hạn thay vì load_full_history.
+
+    Args:
+        user_id: None → mọi user
+        since, until (str): ngày "YYYY-MM-DD"
+
+    Returns:
+        list[dict]: mỗi dict có period, start, count, label_counts, mean_distribution,
+                    dominant_label, topics, top_topic, case_types...
+    """
+    return summarize_history(user_id=user_id, since=since, until=until)
 
 
 # ============================================================
@@ -50,7 +99,7 @@ def filter_history_by_label(history, label):
     Returns:
         list: các entry phù hợp
     """
-    return [item for item in history if item.get("label") == label]
+    return [item for item in history if entry_label(item) == label]
 
 
 # ============================================================
@@ -108,31 +157,161 @@ def format_context(examples):
 # 5. Hàm chính build context — Hệ thống sẽ gọi hàm này
 # ============================================================
 
-def build_past_context(current_label, case_type, user_id=None, max_examples=3):
+def build_past_context(current_label, case_type, user_id=None, max_examples=3, text=None):
     """
     Đây là hàm cốt lõi.
-    Dùng để lấy ra “kí ức gần nhất” theo cảm xúc user đang có.
+    Dùng để lấy ra “kí ức gần nhất” theo cảm xúc user đang có,
+    hoặc (khi có `text` và HISTORY_SEMANTIC_CONTEXT) các ký ức giống nhật ký hiện tại nhất.
 
     Args:
         current_label (str): cảm xúc người dùng hiện tại
         case_type (str): để mở rộng trong tương lai (vd: case stress, case success…)
-        user_id: khi bạn làm multi-user
+        user_id: chỉ lấy ký ức của user này (None → user ẩn danh, không bao giờ lấy của user khác)
         max_examples: lấy bao nhiêu ví dụ
+        text (str): nhật ký hiện tại → tìm theo ngữ nghĩa (core/history_embeddings.py)
 
     Returns:
         str: đoạn context ngắn gọn đưa vào prompt LLM
     """
 
-    # 1) Load toàn bộ lịch sử
-    history = load_full_history()
-
-    # 2) Lọc theo cảm xúc cần tìm
-    filtered = filter_history_by_label(history, current_label)
-
-    # 3) Chọn n entry gần nhất
-    picked = pick_recent_examples(filtered, max_examples)
+    picked = []
+
+    # 0) Có nhật ký hiện tại → top-k entry giống nhất của user (vector + ANN)
+    if text and HISTORY_SEMANTIC_CONTEXT:
+        try:
+            picked = get_embedding_index().search(text, user_id=user_id, k=max_examples)
+        except Exception as e:
+            print(f"⚠️ Lỗi tìm context theo ngữ nghĩa: {e}")
+
+    # 1) + 2) + 3) Lọc theo user + cảm xúc cần tìm và chọn n entry gần nhất
+    #    - Có index RAM: lấy thẳng từ deque của (user, label) → O(k)
+    #    - Không có: store lo phần lọc / sắp xếp, chỉ đọc phần lịch sử của user này
+    #      (file riêng của user với JSONL chia theo user, index user_id với SQLite)
+    if not picked:
+        index = get_history_index()
+        if index is not None and max_examples <= index.max_per_label:
+            picked = index.recent(current_label, user_id=user_id, k=max_examples)
+        else:
+            picked = query_history(label=current_label, user_id=user_id, limit=max_examples)
 
     # 4) Format lại thành đoạn text
     context = format_context(picked)
 
     return context
+
+
+# ============================================================
+# 6. Phân tích lịch sử cho Notification Engine
+# ------------------------------------------------------------
+# Dựa trên rollup mood theo (user, ngày) được cập nhật mỗi lần ghi
+# (core/history_rollups.py): mỗi hàm chỉ đọc vài ngày gần nhất của 1 user
+# → O(số ngày), không quét lịch sử. Rollup 1 user có dạng
+#     {"user_id", "last_timestamp", "days": [{"day", "count", "label_counts",
+#                                             "dominant_label", "top_topic"}, ...]}
+# (ngày cũ nhất trước). Truyền sẵn `rollup` (sweep đọc cho mọi user 1 lượt)
+# hoặc `history` (list entry – tính thẳng, dùng khi test / tắt rollup).
+# ============================================================
+
+def _user_entries(history, user_id=None):
+    if history is None:
+        return query_history(user_id=user_id)
+    if user_id is None:
+        return history
+    return [e for e in history if e.get("user_id") == user_id]
+
+
+def get_user_rollup(user_id=None, history=None, max_days=None):
+    """
+    Rollup mood của 1 user: lấy từ store rollup (HISTORY_ROLLUPS_ENABLED),
+    hoặc tính từ `history` / lịch sử của user nếu không có store.
+
+    Args:
+        max_days: chỉ lấy N ngày có ghi nhật ký gần nhất (None → tất cả)
+    """
+    rollups = get_mood_rollups() if history is None else None
+    if rollups is not None:
+        return rollups.user_rollup(user_id, max_days=max_days)
+    rollup = rollup_from_entries(_user_entries(history, user_id), user_id)
+    if max_days is not None:
+        rollup["days"] = rollup["days"][-max_days:] if max_days > 0 else []
+    return rollup
+
+
+def load_user_rollups(since_day=None, history=None):
+    """
+    Rollup của MỌI user (chỉ các ngày >= since_day) – cho sweep thông báo.
+    Store rollup: 2 query; không có store / truyền `history` → 1 lượt qua lịch sử.
+
+    Returns:
+        dict: user_id → rollup
+    """
+    if since_day is None:
+        since_day = (datetime.now(VN_TZ).date() - timedelta(days=HISTORY_ROLLUP_WINDOW_DAYS)).isoformat()
+    rollups = get_mood_rollups() if history is None else None
+    if rollups is not None:
+        return rollups.load_since(since_day)
+
+    by_user = {}
+    for entry in (load_full_history() if history is None else history):
+        by_user.setdefault(entry.get("user_id"), []).append(entry)
+    out = {}
+    for user_id, entries in by_user.items():
+        rollup = rollup_from_entries(entries, user_id)
+        rollup["days"] = [d for d in rollup["days"] if d["day"] >= since_day]
+        out[user_id] = rollup
+    return out
+
+
+def get_last_entry_time(history=None, user_id=None, rollup=None):
+    """
+    Thời điểm entry gần nhất (datetime giờ VN), hoặc None nếu chưa có entry.
+    """
+    if rollup is None:
+        rollup = get_user_rollup(user_id, history, max_days=0)
+    if not rollup["last_timestamp"]:
+        return None
+    return parse_vn_timestamp(rollup["last_timestamp"])
+
+
+def get_recent_mood_trend(history=None, days=3, user_id=None, rollup=None):
+    """
+    Nhãn chủ đạo của `days` ngày có ghi nhật ký gần nhất, cũ nhất trước.
+    VD: ["neutral", "negative", "negative"] → mood đang đi xuống.
+    """
+    if rollup is None:
+        rollup = get_user_rollup(user_id, history, max_days=days)
+    return [d["dominant_label"] for d in rollup["days"][-days:]]
+
+
+def get_success_patterns(days=7, history=None, user_id=None, today=None, rollup=None):
+    """
+    Thói quen (topic) từng đi kèm mood cải thiện: ngày trước tiêu cực / bình thường
+    → ngày sau tích cực, topic chủ đạo của ngày tích cực được tính là "activity".
+    Chỉ xét HISTORY_ROLLUP_WINDOW_DAYS ngày ghi gần nhất, chỉ trả thói quen chưa
+    lặp lại trong `days` ngày gần đây (đáng để nhắc lại), hiệu quả nhất trước.
+
+    Returns:
+        list[dict]: {"activity", "count", "last_day"}
+    """
+    if rollup is None:
+        rollup = get_user_rollup(user_id, history, max_days=HISTORY_ROLLUP_WINDOW_DAYS)
+    today = today or datetime.now(VN_TZ).date()
+    cutoff = (today - timedelta(days=days)).isoformat()
+    moods = rollup["days"]
+
+    patterns = {}
+    last_seen = {}
+    for d in moods:
+        if d["top_topic"]:
+            last_seen[d["top_topic"]] = d["day"]
+    for prev, cur in zip(moods, moods[1:]):
+        topic = cur["top_topic"]
+        if topic and cur["dominant_label"] == "positive" and prev["dominant_label"] != "positive":
+            p = patterns.setdefault(topic, {"activity": topic, "count": 0, "last_day": cur["day"]})
+            p["count"] += 1
+            p["last_day"] = max(p["last_day"], cur["day"])
+
+    due = [p for p in patterns.values() if last_seen.get(p["activity"], "") <= cutoff]
+    due.sort(key=lambda p: p["last_day"], reverse=True)
+    due.sort(key=lambda p: p["count"], reverse=True)   # nhiều lần nhất trước, cùng số lần → gần nhất trước
+    return due
@@ -0,0 +1,144 @@
+"""
+core/history_index.py
+-----------------------------------------
+Index lịch sử trong RAM cho build_past_context.
+
+- Mỗi user có 1 deque giới hạn / label, giữ HISTORY_INDEX_MAX_PER_LABEL entry
+  mới nhất theo timestamp. user_id=None là user ẩn danh (entry không có
+  user_id), không phải "mọi user" → không lẫn nhật ký của người khác.
+- Load 1 lần từ history store ở lần hỏi đầu tiên của user đó,
+  sau đó cập nhật tăng dần khi pipeline ghi thêm qua index (append()).
+- Multi-process: trước mỗi lần đọc so version (mtime, size) file của store;
+  process khác ghi thêm → load lại phần của user đó.
+→ Lấy k ký ức gần nhất là O(k), không đọc / sắp xếp lại lịch sử mỗi request.
+-----------------------------------------
+"""
+
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+from core.config import (
+    HISTORY_INDEX_ENABLED,
+    HISTORY_INDEX_MAX_PER_LABEL,
+    HISTORY_INDEX_MAX_USERS,
+)
+from core.history_store import entry_label, get_history_store
+
+
+def _timestamp(entry: Dict[str, Any]) -> str:
+    return entry.get("timestamp", "")
+
+
+class _UserBucket:
+    """Entry gần nhất của 1 user, chia theo label (tăng dần theo timestamp)."""
+
+    def __init__(self, entries: List[Dict[str, Any]], version: tuple, max_per_label: int):
+        self.version = version
+        self.max_per_label = max_per_label
+        self.labels: Dict[str, deque] = {}
+        for entry in sorted(entries, key=_timestamp):
+            self.push(entry)
+
+    def push(self, entry: Dict[str, Any]) -> None:
+        bucket = self.labels.get(entry_label(entry))
+        if bucket is None:
+            bucket = self.labels[entry_label(entry)] = deque(maxlen=self.max_per_label)
+        if bucket and _timestamp(entry) < _timestamp(bucket[-1]):
+            # Hiếm: entry đến trễ (timestamp cũ hơn) → chèn lại đúng thứ tự
+            items = sorted([*bucket, entry], key=_timestamp)
+            bucket.clear()
+            bucket.extend(items)
+        else:
+            bucket.append(entry)
+
+
+class HistoryIndex:
+    """Index theo (user, label) trên một history store."""
+
+    def __init__(self, store=None, max_per_label: int = HISTORY_INDEX_MAX_PER_LABEL,
+                 max_users: int = HISTORY_INDEX_MAX_USERS):
+        self.store = store if store is not None else get_history_store()
+        self.max_per_label = max_per_label
+        self.max_users = max_users
+        self._users: "OrderedDict[Optional[str], _UserBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: Optional[str]) -> _UserBucket:
+        version = self.store.version(user_id)
+        return _UserBucket(self.store.query(user_id=user_id), version, self.max_per_label)
+
+    def _bucket(self, user_id: Optional[str]) -> _UserBucket:
+        bucket = self._users.get(user_id)
+        if bucket is None or bucket.version != self.store.version(user_id):
+            bucket = self._load(user_id)
+            self._users[user_id] = bucket
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        self._users.move_to_end(user_id)
+        return bucket
+
+    def recent(self, label: str, user_id: Optional[str] = None, k: int = 3) -> List[Dict[str, Any]]:
+        """k entry mới nhất có label này của user (mới nhất trước)."""
+        with self._lock:
+            bucket = self._bucket(user_id).labels.get(label)
+            return list(islice(reversed(bucket), k)) if bucket else []
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Ghi entries xuống store rồi cập nhật các phần đang có trong RAM
+        của từng user liên quan. Nếu file đã bị process khác
+        ghi thêm từ lần đọc trước thì bỏ phần đó để lần đọc sau load lại.
+        """
+        if not entries:
+            return
+        with self._lock:
+            keys = [k for k in {e.get("user_id") for e in entries} if k in self._users]
+            before = {k: self.store.version(k) for k in keys}
+
+        # Ghi ngoài khoá index → các request ghi cùng lúc vẫn được group commit gom chung
+        if len(entries) == 1:
+            self.store.append(entries[0])
+        else:
+            self.store.append_many(entries)
+
+        with self._lock:
+            for user_id in keys:
+                bucket = self._users.get(user_id)
+                if bucket is None:
+                    continue
+                if bucket.version != before[user_id]:
+                    # File đã đổi ngoài lần ghi này (worker khác / request khác) → load lại khi cần
+                    del self._users[user_id]
+                    continue
+                for entry in entries:
+                    if entry.get("user_id") == user_id:
+                        bucket.push(entry)
+                bucket.version = self.store.version(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+# ============================================================
+# Index dùng chung cho toàn process
+# ============================================================
+_index: Optional[HistoryIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_history_index() -> Optional[HistoryIndex]:
+    """Trả về index dùng chung, hoặc None nếu HISTORY_INDEX_ENABLED = False."""
+    global _index
+    if not HISTORY_INDEX_ENABLED:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = HistoryIndex()
+    return _index
@@ -0,0 +1,237 @@
+"""
+core/history_rollups.py
+-----------------------------------------
+Rollup mood theo (user, ngày), cập nhật tăng dần mỗi lần ghi lịch sử
+(xem core/history_writer.py), lưu trong SQLite (HISTORY_ROLLUP_PATH):
+
+- mood_days:  (user_id, day) → count, số entry mỗi nhãn, topic → số lần
+- mood_users: user_id → last_timestamp (entry gần nhất)
+
+Các phân tích cho Notification Engine (mood trend, lần ghi cuối, thói quen
+giúp mood tốt lên – xem core/history_engine.py) đọc rollup: O(số ngày) thay
+vì quét toàn bộ lịch sử; sweep mọi user = 2 query (range theo day + bảng user).
+
+Ghi 1 lô entry = gộp theo (user, ngày) bằng summarize_entries() rồi cộng dồn
+(UPSERT) → chi phí theo số (user, ngày) trong lô, không theo độ dài lịch sử.
+Rollup không bị compaction xoá; lần đầu dùng được dựng lại từ
+summarize_history() (tầng tổng kết + bản ghi hot) dưới file_lock, đánh dấu
+"đã dựng" trong bảng rollup_meta cùng transaction → nhiều worker khởi động
+cùng lúc chỉ dựng 1 lần, dựng dở (crash) thì lần sau dựng lại.
+-----------------------------------------
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.config import LABELS, HISTORY_ROLLUPS_ENABLED, HISTORY_ROLLUP_PATH
+from core.history_compaction import summarize_entries, summarize_history
+from core.utils import file_lock
+
+
+def dominant_label(label_counts: Dict[str, int]) -> Optional[str]:
+    """Nhãn nhiều entry nhất trong ngày (hoà → theo thứ tự LABELS, như _finalize)."""
+    if not any(label_counts.values()):
+        return None
+    return max(LABELS, key=lambda label: label_counts.get(label, 0))
+
+
+def make_day(day: str, count: int, label_counts: Dict[str, int], topics: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "day": day,
+        "count": count,
+        "label_counts": label_counts,
+        "dominant_label": dominant_label(label_counts),
+        "top_topic": max(topics, key=topics.get) if topics else None,
+    }
+
+
+def rollup_from_entries(entries: Iterable[Dict[str, Any]], user_id: Optional[str] = None) -> Dict[str, Any]:
+    """Rollup của 1 user tính thẳng từ list entry (khi không dùng store rollup)."""
+    days, last = [], None
+    for s in summarize_entries(entries, "day"):
+        if s["count"]:
+            days.append(make_day(s["start"], s["count"], s["label_counts"], s["topics"]))
+            last = max(filter(None, (last, s["last_timestamp"])), default=None)
+    days.sort(key=lambda d: d["day"])
+    return {"user_id": user_id, "last_timestamp": last, "days": days}
+
+
+class MoodRollupStore:
+    """Rollup mood theo ngày trong SQLite (WAL)."""
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS mood_days ("
+        " user_id TEXT NOT NULL,"
+        " day TEXT NOT NULL,"
+        " count INTEGER NOT NULL DEFAULT 0,"
+        " negative INTEGER NOT NULL DEFAULT 0,"
+        " neutral INTEGER NOT NULL DEFAULT 0,"
+        " positive INTEGER NOT NULL DEFAULT 0,"
+        " topics TEXT NOT NULL DEFAULT '{}',"
+        " PRIMARY KEY (user_id, day)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_mood_days_day ON mood_days (day)",
+        "CREATE TABLE IF NOT EXISTS mood_users ("
+        " user_id TEXT PRIMARY KEY,"
+        " last_timestamp TEXT)",
+        "CREATE TABLE IF NOT EXISTS rollup_meta ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT)",
+    )
+
+    def __init__(self, path: str = HISTORY_ROLLUP_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self._SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    # ---------- ghi ----------
+    def add_entries(self, entries: List[Dict[str, Any]]) -> int:
+        """Cộng dồn 1 lô entry vào rollup. Trả về số (user, ngày) được cập nhật."""
+        return self.add_summaries(summarize_entries(entries, "day"))
+
+    def add_summaries(self, summaries: Iterable[Dict[str, Any]], mark_built: bool = False) -> int:
+        """
+        Cộng dồn tổng kết (định dạng summarize_entries / summarize_history) vào rollup.
+        mark_built=True: đánh dấu rollup đã dựng xong trong cùng transaction (xem built()).
+        """
+        rows = [s for s in summaries if s["count"]]
+        if not rows and not mark_built:
+            return 0
+        with self._lock:
+            # 1 transaction cho cả lô; IMMEDIATE: giữ khoá ghi ngay từ lúc đọc topics cũ
+            # → worker khác không chen vào giữa đọc – cộng – ghi
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for s in rows:
+                    user = s["user_id"] or ""
+                    counts = s["label_counts"]
+                    old = self._db.execute(
+                        "SELECT topics FROM mood_days WHERE user_id = ? AND day = ?", (user, s["start"])
+                    ).fetchone()
+                    topics = json.loads(old[0]) if old else {}
+                    for topic, n in s["topics"].items():
+                        topics[topic] = topics.get(topic, 0) + n
+                    self._db.execute(
+                        "INSERT INTO mood_days (user_id, day, count, negative, neutral, positive, topics)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                        " ON CONFLICT (user_id, day) DO UPDATE SET"
+                        " count = count + excluded.count,"
+                        " negative = negative + excluded.negative,"
+                        " neutral = neutral + excluded.neutral,"
+                        " positive = positive + excluded.positive,"
+                        " topics = excluded.topics",
+                        (user, s["start"], s["count"], counts.get("negative", 0), counts.get("neutral", 0),
+                         counts.get("positive", 0), json.dumps(topics, ensure_ascii=False)),
+                    )
+                    if s.get("last_timestamp"):
+                        self._db.execute(
+                            "INSERT INTO mood_users (user_id, last_timestamp) VALUES (?, ?)"
+                            " ON CONFLICT (user_id) DO UPDATE SET"
+                            " last_timestamp = max(last_timestamp, excluded.last_timestamp)",
+                            (user, s["last_timestamp"]),
+                        )
+                if mark_built:
+                    self._db.execute("INSERT OR REPLACE INTO rollup_meta (key, value) VALUES ('built', '1')")
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+        return len(rows)
+
+    # ---------- đọc ----------
+    def built(self) -> bool:
+        """Rollup đã được dựng từ lịch sử chưa (file tạo bởi bản cũ, đã có dữ liệu → coi như rồi)."""
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM rollup_meta WHERE key = 'built'").fetchone():
+                return True
+            return self._db.execute("SELECT 1 FROM mood_days LIMIT 1").fetchone() is not None
+
+    @staticmethod
+    def _day(row: tuple) -> Dict[str, Any]:
+        day, count, neg, neu, pos, topics = row
+        return make_day(day, count, {"negative": neg, "neutral": neu, "positive": pos}, json.loads(topics))
+
+    def user_rollup(self, user_id: Optional[str] = None, max_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Rollup của 1 user: last_timestamp + `max_days` ngày có ghi nhật ký gần nhất
+        (cũ nhất trước). Đọc qua khoá chính (user_id, day) → O(max_days).
+        """
+        user = user_id or ""
+        sql = ("SELECT day, count, negative, neutral, positive, topics FROM mood_days"
+               " WHERE user_id = ? ORDER BY day DESC")
+        params: list = [user]
+        if max_days is not None:
+            sql += " LIMIT ?"
+            params.append(int(max_days))
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            last = self._db.execute("SELECT last_timestamp FROM mood_users WHERE user_id = ?", (user,)).fetchone()
+        return {
+            "user_id": user_id,
+            "last_timestamp": last[0] if last else None,
+            "days": [self._day(r) for r in reversed(rows)],
+        }
+
+    def load_since(self, since_day: str) -> Dict[Optional[str], Dict[str, Any]]:
+        """Rollup mọi user (ngày >= since_day) trong 2 query – dùng cho sweep thông báo."""
+        with self._lock:
+            users = self._db.execute("SELECT user_id, last_timestamp FROM mood_users").fetchall()
+            rows = self._db.execute(
+                "SELECT user_id, day, count, negative, neutral, positive, topics FROM mood_days"
+                " WHERE day >= ? ORDER BY user_id, day", (since_day,)
+            ).fetchall()
+        out: Dict[Optional[str], Dict[str, Any]] = {}
+        for user, last in users:
+            uid = user or None
+            out[uid] = {"user_id": uid, "last_timestamp": last, "days": []}
+        for row in rows:
+            uid = row[0] or None
+            out.setdefault(uid, {"user_id": uid, "last_timestamp": None, "days": []})["days"].append(self._day(row[1:]))
+        return out
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM mood_days").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# ============================================================
+# Store dùng chung cho toàn process
+# ============================================================
+_store: Optional[MoodRollupStore] = None
+_store_lock = threading.Lock()
+
+
+def get_mood_rollups(exclude: Optional[List[Dict[str, Any]]] = None) -> Optional[MoodRollupStore]:
+    """
+    Rollup dùng chung, hoặc None nếu HISTORY_ROLLUPS_ENABLED = False.
+    Chưa dựng → dựng lại từ tổng kết lịch sử đang có (kể cả phần đã compact;
+    phần đã gộp tuần thành 1 dòng ở ngày đầu tuần). Kiểm tra + dựng nằm trong
+    file_lock(HISTORY_ROLLUP_PATH): worker khác chờ rồi dùng luôn bản đã dựng.
+
+    Args:
+        exclude: entry vừa ghi xuống store mà caller sẽ tự add_entries → không tính lúc dựng lại
+    """
+    global _store
+    if not HISTORY_ROLLUPS_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                with file_lock(HISTORY_ROLLUP_PATH):
+                    store = MoodRollupStore(HISTORY_ROLLUP_PATH)
+                    if not store.built():
+                        count = store.add_summaries(summarize_history(exclude=exclude), mark_built=True)
+                        if count:
+                            print(f"📊 Đã dựng rollup mood cho {count} (user, ngày) vào {HISTORY_ROLLUP_PATH}")
+                _store = store
+    return _store
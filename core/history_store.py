@@ -0,0 +1,681 @@
+"""
+core/history_store.py
+-----------------------------------------
+Nơi lưu lịch sử pipeline (mỗi lần chạy = 1 bản ghi).
+
+- JsonlHistoryStore (mặc định): append 1 dòng JSON / bản ghi vào HISTORY_JSONL_PATH
+  → chi phí ghi cố định, không phụ thuộc lịch sử đã dài bao nhiêu.
+  fsync theo HISTORY_FSYNC: "always" | "interval" | "never".
+- UserPartitionedHistoryStore: mỗi user 1 file JSONL trong HISTORY_USER_DIR
+  (HISTORY_PARTITION_BY_USER) → query theo user chỉ đọc file của user đó.
+- SqliteHistoryStore: SQLite (WAL) tại HISTORY_SQLITE_PATH, có index theo
+  user_id / predicted_label / case_type / timestamp → query() là index lookup.
+- JsonHistoryStore: file mảng JSON kiểu cũ (HISTORY_DB_PATH), đọc – sửa – ghi lại toàn bộ.
+  Chỉ giữ để tương thích; chuyển dữ liệu sang JSONL / SQLite bằng migrate_history.py.
+
+GroupCommitWriter (HISTORY_GROUP_COMMIT) bọc ngoài store: các append đến cùng lúc
+được gom thành 1 lần append_many (1 write + 1 fsync, hoặc 1 transaction SQLite).
+
+Mọi store có chung API: append(entry), append_many(entries), load_all(), query(...),
+remove_older_than(cutoff) (dùng cho compaction, xem core/history_compaction.py)
+và version(user_id) – (mtime, size) của file liên quan, để cache / index trong RAM
+biết khi nào process khác đã ghi thêm.
+
+user_id trong query() / version(): None = user ẩn danh (entry không có user_id,
+đúng như lúc ghi), ALL_USERS (mặc định của query) = không lọc theo user – chỉ
+dùng cho báo cáo / migrate / backfill, không dùng khi chạy pipeline cho 1 user.
+-----------------------------------------
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.config import (
+    HISTORY_BACKEND,
+    HISTORY_DB_PATH,
+    HISTORY_JSONL_PATH,
+    HISTORY_PARTITION_BY_USER,
+    HISTORY_USER_DIR,
+    HISTORY_SQLITE_PATH,
+    HISTORY_FSYNC,
+    HISTORY_FSYNC_INTERVAL_SECONDS,
+    HISTORY_GROUP_COMMIT,
+    HISTORY_GROUP_COMMIT_WINDOW_MS,
+    HISTORY_GROUP_COMMIT_MAX_BATCH,
+)
+from core.utils import append_jsonl, read_jsonl, file_lock, atomic_write_json
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+# user_id=ALL_USERS → mọi user; user_id=None → chỉ user ẩn danh
+ALL_USERS = object()
+
+
+def entry_label(entry: Dict[str, Any]) -> Optional[str]:
+    """Nhãn cảm xúc của 1 bản ghi (pipeline ghi "predicted_label", dữ liệu cũ có thể là "label")."""
+    return entry.get("predicted_label") or entry.get("label")
+
+
+def entry_key(entry: Dict[str, Any]) -> tuple:
+    """Khoá nhận diện 1 bản ghi (bản ghi lịch sử không có id riêng)."""
+    return (entry.get("user_id"), entry.get("timestamp"), entry.get("text"))
+
+
+def exclude_entries(entries: Iterable[Dict[str, Any]],
+                    exclude: Optional[Iterable[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Bỏ các bản ghi trong `exclude` khỏi `entries` (mỗi bản trong exclude bỏ đúng 1 lần).
+    Dùng khi dựng lại index / rollup từ lịch sử ngay sau 1 lần ghi: các entry vừa ghi
+    sẽ được cộng riêng, không được tính 2 lần.
+    """
+    skip = Counter(entry_key(e) for e in exclude or ())
+    if not skip:
+        return list(entries)
+    kept = []
+    for entry in entries:
+        key = entry_key(entry)
+        if skip[key] > 0:
+            skip[key] -= 1
+            continue
+        kept.append(entry)
+    return kept
+
+
+def file_version(*paths: str) -> tuple:
+    """(mtime_ns, size) của từng file; file chưa tồn tại → None."""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            version.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def filter_entries(entries: Iterable[Dict[str, Any]], label: Optional[str] = None,
+                   user_id: Any = ALL_USERS, case_type: Optional[str] = None,
+                   since: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Lọc + sắp xếp mới nhất trước (theo timestamp) trên list trong RAM.
+    Dùng cho các store dạng file; SqliteHistoryStore làm việc này bằng SQL.
+    """
+    matched = [
+        e for e in entries
+        if (label is None or entry_label(e) == label)
+        and (user_id is ALL_USERS or e.get("user_id") == user_id)
+        and (case_type is None or e.get("case_type") == case_type)
+        and (since is None or e.get("timestamp", "") >= since)
+    ]
+    # sorted() ổn định → cùng timestamp thì bản ghi ghi sau đứng trước nhờ reversed()
+    matched = sorted(reversed(matched), key=lambda e: e.get("timestamp", ""), reverse=True)
+    return matched[:limit] if limit is not None else matched
+
+
+class JsonlHistoryStore:
+    """Lịch sử dạng JSON Lines, chỉ append."""
+
+    def __init__(self, path: str = HISTORY_JSONL_PATH, fsync: str = HISTORY_FSYNC,
+                 fsync_interval: float = HISTORY_FSYNC_INTERVAL_SECONDS):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"HISTORY_FSYNC '{fsync}' không hợp lệ, chọn một trong {FSYNC_POLICIES}.")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._last_fsync = 0.0
+        self._lock = threading.Lock()
+
+    def _should_fsync(self) -> bool:
+        if self.fsync == "always":
+            return True
+        if self.fsync == "interval":
+            # Giống appendfsync everysec: fsync khi lần fsync trước đã quá interval
+            return time.monotonic() - self._last_fsync >= self.fsync_interval
+        return False
+
+    @contextmanager
+    def _locked(self):
+        """
+        Khoá thread + khoá file. Compaction có thể thay file bằng os.replace trong lúc
+        ta đang chờ khoá → sau khi lấy khoá kiểm tra inode, khác thì khoá lại file mới.
+        """
+        with self._lock:
+            while True:
+                with file_lock(self.path, sidecar=False) as lock_file:
+                    try:
+                        same_file = os.path.samestat(os.fstat(lock_file.fileno()), os.stat(self.path))
+                    except FileNotFoundError:
+                        same_file = False
+                    if same_file or lock_file.name != self.path:
+                        yield
+                        return
+
+    def _repair_torn_tail(self) -> None:
+        """Dòng cuối ghi dở (process bị kill) → xuống dòng để bản ghi mới không dính vào nó."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        except (FileNotFoundError, OSError):
+            return
+        if torn:
+            with open(self.path, "ab") as f:
+                f.write(b"\n")
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        # Khoá thread (trong process) + khoá file (giữa các worker)
+        with self._locked():
+            self._repair_torn_tail()
+            do_fsync = self._should_fsync()
+            append_jsonl(self.path, entry, fsync=do_fsync)
+            if do_fsync:
+                self._last_fsync = time.monotonic()
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        """Ghi nhiều bản ghi bằng 1 lần write + tối đa 1 lần fsync (dùng cho group commit)."""
+        if not entries:
+            return
+        lines = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+        with self._locked():
+            self._repair_torn_tail()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                if self.fsync != "never":
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._last_fsync = time.monotonic()
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        try:
+            return read_jsonl(self.path, strict=False)
+        except FileNotFoundError:
+            return []
+
+    def remove_older_than(self, cutoff: str) -> int:
+        """Bỏ các bản ghi có timestamp < cutoff (ghi file mới rồi os.replace). Trả về số bản ghi đã bỏ."""
+        with self._locked():
+            entries = self.load_all()
+            keep = [e for e in entries if e.get("timestamp", "") >= cutoff]
+            removed = len(entries) - len(keep)
+            if removed:
+                tmp_path = self.path + ".compact.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in keep))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            return removed
+
+    def query(self, **filters) -> List[Dict[str, Any]]:
+        return filter_entries(self.load_all(), **filters)
+
+    def version(self, user_id: Any = ALL_USERS) -> tuple:
+        return file_version(self.path)
+
+
+class UserPartitionedHistoryStore:
+    """
+    Lịch sử chia theo user: HISTORY_USER_DIR/<sha1(user_id)>.jsonl,
+    entry không có user_id nằm ở _anonymous.jsonl.
+    Ghi / đọc theo 1 user chỉ chạm vào file của user đó.
+    """
+
+    ANONYMOUS = "_anonymous"
+
+    def __init__(self, root: str = HISTORY_USER_DIR, fsync: str = HISTORY_FSYNC,
+                 fsync_interval: float = HISTORY_FSYNC_INTERVAL_SECONDS):
+        self.root = root
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._shards: Dict[str, JsonlHistoryStore] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def shard_path(self, user_id: Optional[str]) -> str:
+        if user_id is None:
+            name = self.ANONYMOUS
+        else:
+            # Hash → tên file an toàn với mọi user_id (ký tự đặc biệt, hoa/thường, độ dài)
+            name = hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, name + ".jsonl")
+
+    def _shard(self, user_id: Optional[str]) -> JsonlHistoryStore:
+        return self._shard_at(self.shard_path(user_id))
+
+    def _shard_at(self, path: str) -> JsonlHistoryStore:
+        shard = self._shards.get(path)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.get(path)
+                if shard is None:
+                    shard = JsonlHistoryStore(path, self.fsync, self.fsync_interval)
+                    self._shards[path] = shard
+        return shard
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self._shard(entry.get("user_id")).append(entry)
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        groups: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for entry in entries:
+            groups.setdefault(entry.get("user_id"), []).append(entry)
+        for user_id, group in groups.items():
+            self._shard(user_id).append_many(group)
+
+    def load_user(self, user_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Toàn bộ lịch sử của 1 user (theo thứ tự ghi)."""
+        return self._shard(user_id).load_all()
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        """Gộp mọi shard, sắp theo timestamp (dùng cho báo cáo / migrate, không dùng khi chạy pipeline)."""
+        entries: List[Dict[str, Any]] = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".jsonl"):
+                try:
+                    entries.extend(read_jsonl(os.path.join(self.root, name), strict=False))
+                except FileNotFoundError:
+                    continue
+        return sorted(entries, key=lambda e: e.get("timestamp", ""))
+
+    def remove_older_than(self, cutoff: str) -> int:
+        removed = 0
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".jsonl"):
+                removed += self._shard_at(os.path.join(self.root, name)).remove_older_than(cutoff)
+        return removed
+
+    def query(self, user_id: Any = ALL_USERS, **filters) -> List[Dict[str, Any]]:
+        if user_id is ALL_USERS:
+            return filter_entries(self.load_all(), **filters)
+        # None → shard _anonymous, cùng chỗ với lúc ghi
+        return filter_entries(self.load_user(user_id), user_id=user_id, **filters)
+
+    def version(self, user_id: Any = ALL_USERS) -> tuple:
+        if user_id is not ALL_USERS:
+            return file_version(self.shard_path(user_id))
+        names = sorted(n for n in os.listdir(self.root) if n.endswith(".jsonl"))
+        return file_version(*(os.path.join(self.root, n) for n in names))
+
+
+class SqliteHistoryStore:
+    """
+    Lịch sử trong SQLite (WAL: nhiều process đọc song song khi đang ghi).
+    Cột được index tách riêng, bản ghi đầy đủ giữ nguyên dạng JSON ở cột data.
+    Khoá theo user_id: mọi index bắt đầu bằng user_id → query 1 user chỉ quét bản ghi của user đó.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS history ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " user_id TEXT,"
+        " predicted_label TEXT,"
+        " case_type TEXT,"
+        " timestamp TEXT,"
+        " data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_history_user_ts ON history (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_history_user_label_ts ON history (user_id, predicted_label, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_history_label_ts ON history (predicted_label, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_history_case_ts ON history (case_type, timestamp)",
+    )
+
+    def __init__(self, path: str = HISTORY_SQLITE_PATH, fsync: str = HISTORY_FSYNC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"HISTORY_FSYNC '{fsync}' không hợp lệ, chọn một trong {FSYNC_POLICIES}.")
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: chỉ fsync lúc checkpoint; "always" → FULL (fsync mỗi commit)
+        self._db.execute(f"PRAGMA synchronous={'FULL' if fsync == 'always' else 'NORMAL'}")
+        for statement in self._SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    @staticmethod
+    def _row(entry: Dict[str, Any]) -> tuple:
+        return (
+            entry.get("user_id"),
+            entry_label(entry),
+            entry.get("case_type"),
+            entry.get("timestamp"),
+            json.dumps(entry, ensure_ascii=False),
+        )
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO history (user_id, predicted_label, case_type, timestamp, data)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [self._row(e) for e in entries],
+            )
+            self._db.commit()
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM history ORDER BY id").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def query(self, label: Optional[str] = None, user_id: Any = ALL_USERS,
+              case_type: Optional[str] = None, since: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Bản ghi khớp điều kiện, mới nhất trước (dùng index, không đọc toàn bộ bảng)."""
+        where, params = [], []
+        if user_id is not ALL_USERS:
+            # "IS ?" khớp cả NULL → user_id=None lấy đúng entry ẩn danh
+            where.append("user_id IS ?")
+            params.append(user_id)
+        for column, value in (("predicted_label", label), ("case_type", case_type)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+
+        sql = "SELECT data FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def remove_older_than(self, cutoff: str) -> int:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM history WHERE timestamp < ?", (cutoff,))
+            self._db.commit()
+            return cursor.rowcount
+
+    def version(self, user_id: Any = ALL_USERS) -> tuple:
+        # Ở chế độ WAL, commit mới nằm trong file -wal trước khi checkpoint
+        return file_version(self.path, self.path + "-wal")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class JsonHistoryStore:
+    """
+    File mảng JSON kiểu cũ: mỗi lần ghi = đọc toàn bộ + ghi lại toàn bộ (O(lịch sử)).
+    Đọc – sửa – ghi nằm trong khoá file (an toàn với nhiều worker) và ghi kiểu
+    file tạm → os.replace, nên file không bao giờ bị cắt cụt giữa chừng.
+    """
+
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load_for_write(self) -> List[Dict[str, Any]]:
+        # Khác load_all: file hỏng thì báo lỗi, KHÔNG coi là [] rồi ghi đè mất dữ liệu
+        try:
+            return _read_json_array(self.path)
+        except FileNotFoundError:
+            return []
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, file_lock(self.path):
+            data = self._load_for_write() + list(entries)
+            atomic_write_json(self.path, data)
+
+    def remove_older_than(self, cutoff: str) -> int:
+        with self._lock, file_lock(self.path):
+            data = self._load_for_write()
+            keep = [e for e in data if e.get("timestamp", "") >= cutoff]
+            if len(keep) != len(data):
+                atomic_write_json(self.path, keep)
+            return len(data) - len(keep)
+
+    def load_all(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+        return data if isinstance(data, list) else []
+
+    def query(self, **filters) -> List[Dict[str, Any]]:
+        return filter_entries(self.load_all(), **filters)
+
+    def version(self, user_id: Any = ALL_USERS) -> tuple:
+        return file_version(self.path)
+
+
+# ============================================================
+# Group commit
+# ============================================================
+class GroupCommitWriter:
+    """
+    Bọc 1 store: append() của nhiều thread đến gần nhau được ghi chung 1 lần.
+
+    Thread đầu tiên thấy hàng đợi rỗng làm "leader": chờ tối đa window_ms để
+    gom thêm, rồi ghi cả lô bằng store.append_many(). Các thread còn lại chờ
+    đến khi lô chứa bản ghi của mình đã ghi xong (hoặc nhận lại lỗi) mới trả về.
+    Các hàm đọc (load_all, query, version, ...) chuyển thẳng xuống store.
+    """
+
+    def __init__(self, store, window_ms: float = HISTORY_GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = HISTORY_GROUP_COMMIT_MAX_BATCH):
+        self.store = store
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending: List[list] = []
+        self._leader_active = False
+        self._cond = threading.Condition()
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        item = [entry, threading.Event(), None]   # [entry, done, error]
+        with self._cond:
+            self._pending.append(item)
+            is_leader = not self._leader_active
+            if is_leader:
+                self._leader_active = True
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+        if is_leader:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+            self._flush_pending()
+
+        item[1].wait()
+        if item[2] is not None:
+            raise item[2]
+
+    def append_many(self, entries: List[Dict[str, Any]]) -> None:
+        self.store.append_many(entries)
+
+    def _flush_pending(self) -> None:
+        """Leader ghi lần lượt các lô cho đến khi hàng đợi rỗng (bản ghi đến trong lúc ghi vào lô sau)."""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._leader_active = False
+                    return
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            error = None
+            try:
+                self.store.append_many([b[0] for b in batch])
+            except Exception as e:
+                error = e
+            for b in batch:
+                b[2] = error
+                b[1].set()
+
+
+# ============================================================
+# Migrate JSON (mảng) → JSONL / SQLite
+# ============================================================
+def _read_json_array(source: str) -> List[Dict[str, Any]]:
+    with open(source, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError(f"{source} không phải mảng JSON.")
+    return data
+
+
+def migrate_json_to_jsonl(source: str = HISTORY_DB_PATH, dest: str = HISTORY_JSONL_PATH,
+                          overwrite: bool = False) -> int:
+    """
+    Chép toàn bộ bản ghi từ file mảng JSON sang JSONL (giữ nguyên thứ tự).
+    Ghi ra file tạm rồi os.replace → không để lại file JSONL dở dang.
+
+    Returns:
+        int: số bản ghi đã chép.
+    """
+    if os.path.exists(dest) and not overwrite:
+        raise FileExistsError(f"{dest} đã tồn tại (dùng overwrite=True / --force để ghi đè).")
+
+    data = _read_json_array(source)
+
+    # File tạm riêng cho mỗi lần chạy, cùng thư mục với dest (để os.replace là rename nguyên tử)
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(dest) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(dest)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for entry in data:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(data)
+
+
+def migrate_to_sqlite(source: str, dest: str = HISTORY_SQLITE_PATH, overwrite: bool = False) -> int:
+    """
+    Nạp lịch sử từ file JSON (mảng) hoặc JSONL (theo đuôi .jsonl) vào SQLite.
+    Ghi vào file tạm trong 1 transaction rồi os.replace.
+
+    Returns:
+        int: số bản ghi đã nạp.
+    """
+    if os.path.exists(dest) and not overwrite:
+        raise FileExistsError(f"{dest} đã tồn tại (dùng overwrite=True / --force để ghi đè).")
+
+    data = load_history_file(source)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(dest) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(dest)))
+    os.close(fd)
+    try:
+        store = SqliteHistoryStore(tmp_path, fsync="always")
+        store.append_many(data)
+        store._db.execute("PRAGMA journal_mode=DELETE")  # gộp WAL vào file chính trước khi đổi tên
+        store.close()
+        os.replace(tmp_path, dest)
+    except BaseException:
+        for path in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return len(data)
+
+
+# ============================================================
+# Store dùng chung cho toàn process
+# ============================================================
+_store = None
+_store_lock = threading.Lock()
+
+
+def load_history_file(path: str) -> List[Dict[str, Any]]:
+    """Đọc lịch sử từ file .jsonl hoặc file mảng JSON."""
+    return read_jsonl(path, strict=False) if path.endswith(".jsonl") else _read_json_array(path)
+
+
+def migrate_to_user_partitions(source: str, dest: str = HISTORY_USER_DIR) -> int:
+    """
+    Chia lịch sử từ 1 file (.json / .jsonl) ra từng file theo user trong `dest`.
+    `dest` chưa có → chia vào thư mục tạm cạnh đó rồi đổi tên 1 lần, nên không bao giờ
+    để lại `dest` dở dang; `dest` đã có → ghi thêm vào (migrate_history.py --force).
+    """
+    data = load_history_file(source)
+    if os.path.isdir(dest):
+        UserPartitionedHistoryStore(dest, fsync="always").append_many(data)
+        return len(data)
+
+    parent = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(dest) + ".", suffix=".tmp", dir=parent)
+    try:
+        UserPartitionedHistoryStore(tmp_dir, fsync="always").append_many(data)
+        os.replace(tmp_dir, dest)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return len(data)
+
+
+def _create_store(backend: str):
+    # Tự mang lịch sử cũ sang backend mới ở lần đầu: kiểm tra + chuyển nằm trong
+    # file_lock của đích → nhiều worker khởi động cùng lúc chỉ 1 worker chuyển,
+    # worker còn lại chờ rồi thấy đích đã có. Đích chỉ xuất hiện khi đã chuyển xong.
+    if backend == "jsonl" and HISTORY_PARTITION_BY_USER:
+        if not os.path.isdir(HISTORY_USER_DIR):
+            with file_lock(HISTORY_USER_DIR):
+                source = next((p for p in (HISTORY_JSONL_PATH, HISTORY_DB_PATH) if os.path.exists(p)), None)
+                if source and not os.path.isdir(HISTORY_USER_DIR):
+                    count = migrate_to_user_partitions(source, HISTORY_USER_DIR)
+                    print(f"🔄 Đã chia {count} bản ghi từ {source} theo user vào {HISTORY_USER_DIR}/")
+        return UserPartitionedHistoryStore(HISTORY_USER_DIR)
+    if backend == "jsonl":
+        if not os.path.exists(HISTORY_JSONL_PATH) and os.path.exists(HISTORY_DB_PATH):
+            # Lần đầu chuyển sang JSONL: tự mang theo lịch sử cũ (file JSON giữ nguyên)
+            with file_lock(HISTORY_JSONL_PATH):
+                if not os.path.exists(HISTORY_JSONL_PATH):
+                    count = migrate_json_to_jsonl(HISTORY_DB_PATH, HISTORY_JSONL_PATH)
+                    print(f"🔄 Đã chuyển {count} bản ghi từ {HISTORY_DB_PATH} sang {HISTORY_JSONL_PATH}")
+        return JsonlHistoryStore(HISTORY_JSONL_PATH)
+    if backend == "sqlite":
+        if not os.path.exists(HISTORY_SQLITE_PATH):
+            with file_lock(HISTORY_SQLITE_PATH):
+                source = next((p for p in (HISTORY_JSONL_PATH, HISTORY_DB_PATH) if os.path.exists(p)), None)
+                if source and not os.path.exists(HISTORY_SQLITE_PATH):
+                    count = migrate_to_sqlite(source, HISTORY_SQLITE_PATH)
+                    print(f"🔄 Đã chuyển {count} bản ghi từ {source} sang {HISTORY_SQLITE_PATH}")
+        return SqliteHistoryStore(HISTORY_SQLITE_PATH)
+    if backend == "json":
+        return JsonHistoryStore()
+    raise ValueError(f"HISTORY_BACKEND '{backend}' không được hỗ trợ.")
+
+
+def get_history_store(backend: Optional[str] = None):
+    """Trả về store lịch sử theo HISTORY_BACKEND (bọc GroupCommitWriter nếu bật), tạo lười ở lần đầu."""
+    global _store
+    if backend is not None:
+        return _create_store(backend)
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = _create_store(HISTORY_BACKEND)
+                _store = GroupCommitWriter(store) if HISTORY_GROUP_COMMIT else store
+    return _store
@@ -0,0 +1,259 @@
+"""
+core/history_writer.py
+-----------------------------------------
+Ghi lịch sử kiểu write-behind: request chỉ đẩy bản ghi vào hàng đợi rồi trả
+kết quả cho user ngay, 1 thread nền gom các bản ghi và ghi xuống store theo lô.
+
+- Hàng đợi giới hạn HISTORY_WRITE_QUEUE_MAX bản ghi. Đầy → submit() chờ tối đa
+  HISTORY_WRITE_BLOCK_TIMEOUT_SECONDS (backpressure), quá hạn thì ghi trực tiếp
+  trên thread của request → không bao giờ bỏ bản ghi.
+- Mỗi lô: tối đa HISTORY_WRITE_BATCH_MAX bản ghi hoặc chờ HISTORY_WRITE_FLUSH_INTERVAL_MS.
+- Chỉ lần ghi store chính được thử lại (WRITE_RETRIES lần); index phụ (embedding,
+  rollup, task) cập nhật sau khi ghi thành công và lỗi ở đó không làm ghi lại lô
+  (tránh append trùng). Hết số lần thử → cả lô ghi vào HISTORY_DEAD_LETTER_PATH,
+  chạy lại bằng `python migrate_history.py --replay-dead-letters`.
+- flush() chờ mọi bản ghi đã nhận được ghi xong; close() được đăng ký với atexit
+  để luôn ghi nốt hàng đợi khi process tắt bình thường.
+- Bản ghi còn trong hàng đợi chưa xuất hiện trong build_past_context (trễ tối đa
+  ~HISTORY_WRITE_FLUSH_INTERVAL_MS).
+-----------------------------------------
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from core.config import (
+    HISTORY_DEAD_LETTER_PATH,
+    HISTORY_SEMANTIC_CONTEXT,
+    HISTORY_WRITE_QUEUE_MAX,
+    HISTORY_WRITE_BATCH_MAX,
+    HISTORY_WRITE_FLUSH_INTERVAL_MS,
+    HISTORY_WRITE_BLOCK_TIMEOUT_SECONDS,
+)
+from core.history_embeddings import get_embedding_index
+from core.history_index import get_history_index
+from core.history_rollups import get_mood_rollups
+from core.history_store import get_history_store
+from core.task_store import get_task_store
+from core.utils import file_lock, read_jsonl
+
+WRITE_RETRIES = 3
+
+
+def store_entries(entries: List[Dict[str, Any]]) -> None:
+    """Ghi đồng bộ xuống store chính (qua index RAM nếu bật để index cập nhật luôn). Lỗi → raise."""
+    index = get_history_index()
+    if index is not None:
+        index.append_many(entries)
+    elif len(entries) == 1:
+        get_history_store().append(entries[0])
+    else:
+        get_history_store().append_many(entries)
+
+
+def index_entries(entries: List[Dict[str, Any]]) -> None:
+    """
+    Cập nhật các index phụ cho entry đã lưu: embed vào index ngữ nghĩa
+    (HISTORY_SEMANTIC_CONTEXT), cộng dồn rollup mood theo ngày (HISTORY_ROLLUPS_ENABLED)
+    và lưu nhiệm vụ vào bảng task (TASK_STORE_ENABLED). Không bao giờ raise.
+    """
+    # Lịch sử đã lưu xong; lỗi ở đây (thiếu thư viện embedding, file meta hỏng,
+    # lỗi lúc dựng lại...) chỉ làm context kém đi, không làm mất bản ghi
+    if HISTORY_SEMANTIC_CONTEXT:
+        try:
+            # Lần đầu index tự dựng từ lịch sử → bỏ các entry vừa ghi, add_many cộng riêng
+            get_embedding_index(exclude=entries).add_many(entries)
+        except Exception as e:
+            print(f"⚠️ Lỗi embed lịch sử: {e}")
+
+    try:
+        # Như index embedding: lần đầu rollup tự dựng từ lịch sử, bỏ các entry vừa ghi
+        rollups = get_mood_rollups(exclude=entries)
+        if rollups is not None:
+            rollups.add_entries(entries)
+    except Exception as e:
+        print(f"⚠️ Lỗi cập nhật rollup mood: {e}")
+
+    tasks = get_task_store()
+    if tasks is not None:
+        try:
+            tasks.add_entries(entries)
+        except Exception as e:
+            print(f"⚠️ Lỗi lưu nhiệm vụ: {e}")
+
+
+def write_entries(entries: List[Dict[str, Any]]) -> None:
+    """Ghi đồng bộ: store chính rồi các index phụ (xem store_entries / index_entries)."""
+    store_entries(entries)
+    index_entries(entries)
+
+
+def write_dead_letters(entries: List[Dict[str, Any]], path: str = HISTORY_DEAD_LETTER_PATH) -> None:
+    """Ghi lô không lưu được vào file JSONL riêng (1 lần ghi, có khoá file giữa các worker)."""
+    payload = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+    with file_lock(path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def replay_dead_letters(path: str = HISTORY_DEAD_LETTER_PATH) -> int:
+    """Ghi lại các bản ghi trong file dead letter vào lịch sử rồi xoá file. Trả về số bản ghi."""
+    with file_lock(path):
+        if not os.path.exists(path):
+            return 0
+        entries = read_jsonl(path, strict=False)
+        if entries:
+            write_entries(entries)
+        os.remove(path)
+    return len(entries)
+
+
+class HistoryWriteBehind:
+    """Hàng đợi + thread nền ghi lịch sử theo lô."""
+
+    def __init__(self, write_many: Callable[[List[Dict[str, Any]]], None] = store_entries,
+                 after_write: Optional[Callable[[List[Dict[str, Any]]], None]] = index_entries,
+                 dead_letter_path: Optional[str] = HISTORY_DEAD_LETTER_PATH,
+                 max_queue: int = HISTORY_WRITE_QUEUE_MAX,
+                 max_batch: int = HISTORY_WRITE_BATCH_MAX,
+                 flush_interval_ms: float = HISTORY_WRITE_FLUSH_INTERVAL_MS,
+                 block_timeout: float = HISTORY_WRITE_BLOCK_TIMEOUT_SECONDS):
+        self.write_many = write_many
+        self.after_write = after_write
+        self.dead_letter_path = dead_letter_path
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, entry: Dict[str, Any]) -> None:
+        """Đưa bản ghi vào hàng đợi (không chờ I/O, trừ khi hàng đợi đầy)."""
+        if self._closed:
+            self._write([entry])
+            return
+        try:
+            self._queue.put(entry, timeout=self.block_timeout)
+        except queue.Full:
+            print("⚠️ Hàng đợi ghi lịch sử đầy → ghi trực tiếp")
+            self._write([entry])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Chờ đến khi mọi bản ghi đã submit được ghi xong. Trả về False nếu hết timeout."""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self) -> None:
+        """Dừng nhận bản ghi mới, ghi nốt hàng đợi rồi dừng thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                self.write_many(batch)
+                break
+            except Exception as e:
+                print(f"⚠️ Lỗi ghi lịch sử (lần {attempt}/{WRITE_RETRIES}, {len(batch)} bản ghi): {e}")
+                time.sleep(0.05 * attempt)
+        else:
+            self._dead_letter(batch)
+            return
+
+        # Store chính đã có lô này → index phụ lỗi cũng KHÔNG ghi lại (sẽ append trùng)
+        if self.after_write is not None:
+            try:
+                self.after_write(batch)
+            except Exception as e:
+                print(f"⚠️ Lỗi cập nhật index phụ cho {len(batch)} bản ghi: {e}")
+
+    def _dead_letter(self, batch: List[Dict[str, Any]]) -> None:
+        if self.dead_letter_path is None:
+            raise RuntimeError(f"Không ghi được {len(batch)} bản ghi lịch sử")
+        try:
+            write_dead_letters(batch, self.dead_letter_path)
+        except Exception as e:
+            # Hết cách lưu → báo rõ kèm dữ liệu để còn khôi phục từ log
+            print(f"❌ Không ghi được {len(batch)} bản ghi lịch sử, kể cả vào dead letter ({e}): "
+                  f"{json.dumps(batch, ensure_ascii=False)}")
+            raise
+        print(f"❌ Không ghi được {len(batch)} bản ghi lịch sử → đã lưu vào {self.dead_letter_path}")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            try:
+                self._write(batch)
+            except Exception:
+                pass  # đã báo trong _dead_letter; thread ghi vẫn phải chạy tiếp cho lô sau
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            if stop:
+                return
+
+
+_writer: Optional[HistoryWriteBehind] = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer() -> HistoryWriteBehind:
+    """Write-behind dùng chung cho toàn process (tự ghi nốt khi process tắt)."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = HistoryWriteBehind()
+                atexit.register(close_history_writer)
+    return _writer
+
+
+def flush_history_writer(timeout: Optional[float] = None) -> bool:
+    """Chờ hàng đợi ghi lịch sử rỗng (vd trước khi đọc lại lịch sử / trong test)."""
+    return _writer.flush(timeout) if _writer is not None else True
+
+
+def close_history_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
@@ -8,8 +8,16 @@
 # ---------------------------------------------------------
 # File này đóng vai trò trung tâm của hệ thống thông báo.
 # Mỗi hàm đều có comment chi tiết để cậu dễ tích hợp vào pipeline.
+#
+# - generate_notification(user_id): 1 user, thử A → B → C → D, trả 1 thông báo.
+# - sweep_notifications(): mọi user trong 1 lượt – đọc lịch sử 1 lần, lấy task
+#   sắp đến hạn / quá hạn bằng 2 range query, rồi chạy A → B → C → D cho từng
+#   user trên dữ liệu đã có sẵn trong RAM; emit_notifications() ghi cả lô.
 
 import datetime
+import json
+import os
+import time
 from typing import List, Dict, Optional, Any
 
 # ---------------------------------------------------------
@@ -17,22 +25,34 @@ from typing import List, Dict, Optional, Any
 # ---------------------------------------------------------
 # history_engine: đọc lịch sử cảm xúc, mood trend, pattern
 # todo_engine: lấy các task còn hạn, task stress, deadline
-# (Giả sử 2 module này đã có trong core như mô tả của cậu)
 # ---------------------------------------------------------
 
+from core.config import (
+    HISTORY_ROLLUP_WINDOW_DAYS,
+    NOTIFICATION_SWEEP_BUDGET_SECONDS,
+    NOTIFICATION_STATE_PATH,
+    NOTIFICATION_OUTBOX_PATH,
+)
+
 from core.history_engine import (
     load_full_history,
+    get_user_rollup,
+    load_user_rollups,
     get_recent_mood_trend,
     get_success_patterns,
     get_last_entry_time,
 )
 
+from core.history_rollups import get_mood_rollups
+from core.task_store import get_task_store
 from core.todo_engine import (
     get_upcoming_tasks,
     get_tasks_due_soon,
     get_overdue_tasks,
 )
 
+from core.utils import VN_TZ, atomic_write_json, file_lock
+
 # ---------------------------------------------------------
 # CÁC RULE DÙNG CHUNG (tách riêng để dễ chỉnh sửa)
 # ---------------------------------------------------------
@@ -45,7 +65,8 @@ from core.notification_rules import RULES
 # ---------------------------------------------------------
 
 def now():
-    return datetime.datetime.now()
+    # Giờ VN (có múi giờ) – cùng mốc với timestamp entry và deadline của task
+    return datetime.datetime.now(VN_TZ)
 
 # Tạo object notification trả về pipeline
 
@@ -58,23 +79,35 @@ def build_notification(ntype: str, message: str, reason: str) -> Dict[str, Any]:
         "source": "notification_engine",
     }
 
+
+def _user_rollup(rollup=None, history=None, user_id=None):
+    """
+    Rollup mood theo ngày của 1 user (sweep truyền sẵn `rollup`);
+    `history` (list entry) → tính thẳng từ list đó.
+    """
+    if rollup is not None:
+        return rollup
+    return get_user_rollup(user_id, history, max_days=HISTORY_ROLLUP_WINDOW_DAYS)
+
 # ---------------------------------------------------------
 # A – EMOTION-AWARE NOTIFICATION
 # ---------------------------------------------------------
 
-def check_emotion_notification() -> Optional[Dict[str, Any]]:
+def check_emotion_notification(history=None, user_id=None, rollup=None) -> Optional[Dict[str, Any]]:
     """
     Gửi thông báo khi:
     - mood giảm liên tục RULES["emotion_drop_days"] ngày
     - user lâu không ghi nhật ký (no_journal_hours)
+    `rollup`: rollup mood của user (sweep truyền sẵn); None → tự đọc.
     """
-    history = load_full_history()
-    if not history:
+    rollup = _user_rollup(rollup, history, user_id)
+    if not rollup["days"] and not rollup["last_timestamp"]:
         return None
 
-    # 1) Mood trend check
-    mood_trend = get_recent_mood_trend(history, days=RULES["emotion_drop_days"])
-    if mood_trend and all(m == "negative" for m in mood_trend):
+    # 1) Mood trend check: đủ N ngày ghi nhật ký gần nhất và đều tiêu cực
+    days = RULES["emotion_drop_days"]
+    mood_trend = get_recent_mood_trend(days=days, rollup=rollup)
+    if len(mood_trend) >= days and all(m == "negative" for m in mood_trend):
         return build_notification(
             "EMOTION_ALERT",
             "Dạo gần đây cậu có vẻ hơi mệt và tiêu cực. Mình ở đây nếu cậu muốn kể thêm nhé.",
@@ -82,7 +115,7 @@ def check_emotion_notification() -> Optional[Dict[str, Any]]:
         )
 
     # 2) No journal too long
-    last_time = get_last_entry_time(history)
+    last_time = get_last_entry_time(rollup=rollup)
     if last_time:
         hours_passed = (now() - last_time).total_seconds() / 3600
         if hours_passed > RULES["no_journal_hours"]:
@@ -98,19 +131,22 @@ def check_emotion_notification() -> Optional[Dict[str, Any]]:
 # B – TASK-AWARE NOTIFICATION
 # ---------------------------------------------------------
 
-def check_task_notification() -> Optional[Dict[str, Any]]:
+def check_task_notification(user_id=None, due_soon=None, overdue=None) -> Optional[Dict[str, Any]]:
     """
     Gửi thông báo dựa trên:
     - task sắp đến hạn trong RULES["deadline_hours"]
     - task đã quá hạn
+    `due_soon` / `overdue`: task của user (sweep truyền sẵn); None → tự truy vấn.
     """
-    due_soon = get_tasks_due_soon(hours=RULES["deadline_hours"])
+    if due_soon is None:
+        due_soon = get_tasks_due_soon(hours=RULES["deadline_hours"], user_id=user_id)
     if due_soon:
         task = due_soon[0]
         msg = f"Nhiệm vụ '{task['action']}' sắp đến hạn. Muốn mình chia nhỏ giúp cậu bắt đầu nhẹ nhàng không?"
         return build_notification("TASK_DEADLINE", msg, reason="deadline_coming")
 
-    overdue = get_overdue_tasks()
+    if overdue is None:
+        overdue = get_overdue_tasks(user_id=user_id)
     if overdue:
         task = overdue[0]
         msg = f"Nhiệm vụ '{task['action']}' đã quá hạn một chút. Ta làm 5 phút để giảm áp lực nhé?"
@@ -122,11 +158,12 @@ def check_task_notification() -> Optional[Dict[str, Any]]:
 # C – SUCCESS-PATTERN NOTIFICATION
 # ---------------------------------------------------------
 
-def check_success_pattern_notification() -> Optional[Dict[str, Any]]:
+def check_success_pattern_notification(history=None, user_id=None, rollup=None) -> Optional[Dict[str, Any]]:
     """
     Gợi ý thói quen từng giúp user cải thiện mood.
     """
-    patterns = get_success_patterns(days=RULES["success_pattern_days"])
+    rollup = _user_rollup(rollup, history, user_id)
+    patterns = get_success_patterns(days=RULES["success_pattern_days"], today=now().date(), rollup=rollup)
     if not patterns:
         return None
 
@@ -140,15 +177,26 @@ def check_success_pattern_notification() -> Optional[Dict[str, Any]]:
 # D – WEEKLY / MONTHLY SUMMARY
 # ---------------------------------------------------------
 
-def check_summary_notification() -> Optional[Dict[str, Any]]:
+def _entries_since(rollup, start_day) -> int:
+    """Số nhật ký user ghi từ ngày `start_day` (datetime.date) tới nay, theo rollup."""
+    start = start_day.isoformat()
+    return sum(d["count"] for d in rollup["days"] if d["day"] >= start)
+
+
+def check_summary_notification(today=None, history=None, user_id=None, rollup=None) -> Optional[Dict[str, Any]]:
     """
-    - Chủ nhật → tổng kết tuần
-    - Ngày 1 tháng → tổng kết tháng
+    - Chủ nhật → tổng kết tuần (7 ngày tới hôm nay)
+    - Ngày 1 tháng → tổng kết tháng (từ đầu tháng trước tới hôm nay)
+    Chỉ gửi khi user có ghi nhật ký trong kỳ đó — không có gì để tổng kết thì thôi.
+    `rollup`: rollup mood của user (sweep truyền sẵn); None → tự đọc.
     """
-    today = now()
+    today = today or now()
+    day = today.date() if isinstance(today, datetime.datetime) else today
+    rollup = _user_rollup(rollup, history, user_id)
 
     # Weekly summary
-    if today.weekday() == RULES["weekly_summary_day"]:
+    if today.weekday() == RULES["weekly_summary_day"] and \
+            _entries_since(rollup, day - datetime.timedelta(days=6)):
         return build_notification(
             "WEEKLY_SUMMARY",
             "Đây là tổng kết tuần của cậu. Muốn xem phân tích chi tiết không?",
@@ -156,7 +204,8 @@ def check_summary_notification() -> Optional[Dict[str, Any]]:
         )
 
     # Monthly summary
-    if today.day == RULES["monthly_summary_day"]:
+    if today.day == RULES["monthly_summary_day"] and \
+            _entries_since(rollup, (day.replace(day=1) - datetime.timedelta(days=1)).replace(day=1)):
         return build_notification(
             "MONTHLY_SUMMARY",
             "Đã đến lúc tổng kết tháng rồi. Cậu muốn xem lại hành trình cảm xúc tháng này không?",
@@ -169,29 +218,146 @@ def check_summary_notification() -> Optional[Dict[str, Any]]:
 # HÀM TỔNG – GỌI TỪ PIPELINE
 # ---------------------------------------------------------
 
-def generate_notification() -> Optional[Dict[str, Any]]:
+def _evaluate_user(user_id, rollup, due_soon=None, overdue=None, skip=()) -> Optional[Dict[str, Any]]:
+    """
+    Thử lần lượt A → B → C → D cho 1 user, bỏ qua thông báo có type trong `skip`
+    (đang trong thời gian chờ chống spam).
+    """
+    checks = (
+        lambda: check_emotion_notification(user_id=user_id, rollup=rollup),             # A – Emotion
+        lambda: check_task_notification(user_id, due_soon=due_soon, overdue=overdue),   # B – Task
+        lambda: check_success_pattern_notification(user_id=user_id, rollup=rollup),     # C – Success pattern
+        lambda: check_summary_notification(user_id=user_id, rollup=rollup),             # D – Summary
+    )
+    for check in checks:
+        n = check()
+        if n and n["type"] not in skip:
+            return n
+    return None
+
+
+def generate_notification(user_id=None) -> Optional[Dict[str, Any]]:
     """
     Thử lần lượt A → B → C → D.
     Chỉ gửi 1 thông báo/lần để tránh spam.
     """
-    # A – Emotion
-    n = check_emotion_notification()
-    if n:
-        return n
+    return _evaluate_user(user_id, _user_rollup(user_id=user_id))
 
-    # B – Task
-    n = check_task_notification()
-    if n:
-        return n
 
-    # C – Success pattern
-    n = check_success_pattern_notification()
-    if n:
-        return n
+# ---------------------------------------------------------
+# SWEEP – MỌI USER TRONG 1 LƯỢT (chạy định kỳ vài phút / lần)
+# ---------------------------------------------------------
 
-    # D – Summary
-    n = check_summary_notification()
-    if n:
-        return n
+def _group_by_user(items) -> Dict[Any, list]:
+    groups: Dict[Any, list] = {}
+    for item in items:
+        groups.setdefault(item.get("user_id"), []).append(item)
+    return groups
 
-    return None
+
+def _load_state(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {"last_sent": {}, "cursor": None}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Không đọc được trạng thái sweep ({e}) → bắt đầu lại")
+        return {"last_sent": {}, "cursor": None}
+    state.setdefault("last_sent", {})
+    state.setdefault("cursor", None)
+    return state
+
+
+def _cooldown_limit(current) -> str:
+    return (current - datetime.timedelta(hours=RULES["cooldown_hours"])).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _cooling_types(state: Dict[str, Any], user_key: str, limit: str) -> set:
+    """Các loại thông báo user vừa nhận sau mốc `limit` (trong thời gian chờ)."""
+    sent = state["last_sent"].get(user_key, {})
+    return {ntype for ntype, sent_at in sent.items() if sent_at > limit}
+
+
+def sweep_notifications(history=None, time_budget_seconds: float = NOTIFICATION_SWEEP_BUDGET_SECONDS,
+                        state_path: Optional[str] = NOTIFICATION_STATE_PATH) -> List[Dict[str, Any]]:
+    """
+    Đánh giá A → B → C → D cho mọi user trong 1 lượt.
+
+    - Mood: rollup theo ngày của mọi user trong HISTORY_ROLLUP_WINDOW_DAYS ngày
+      gần nhất, đọc 1 lượt (2 query); truyền `history` → tính từ list đó.
+    - Task sắp đến hạn / quá hạn: 2 range query trên bảng task cho mọi user.
+    - Tầng nào không có store (hoặc có truyền `history`) thì tính từ lịch sử;
+      lịch sử khi đó chỉ được đọc 1 lần cho cả lượt.
+    - Chống spam: mỗi (user, loại thông báo) cách nhau ≥ RULES["cooldown_hours"].
+    - Hết `time_budget_seconds` → dừng; lượt sau tiếp tục từ user kế tiếp (con trỏ
+      vòng lưu trong state) nên mọi user đều lần lượt được xét.
+    - state_path=None → không đọc / ghi trạng thái (không chống spam giữa các lượt).
+
+    Returns:
+        list[dict]: thông báo (có thêm "user_id"), mỗi user tối đa 1.
+    """
+    started = time.monotonic()
+    since_day = (now().date() - datetime.timedelta(days=HISTORY_ROLLUP_WINDOW_DAYS)).isoformat()
+    rollups_from_store = history is None and get_mood_rollups() is not None
+    tasks_from_store = history is None and get_task_store() is not None
+    if history is None and not (rollups_from_store and tasks_from_store):
+        history = load_full_history()
+    by_user = load_user_rollups(since_day, history=None if rollups_from_store else history)
+    task_history = None if tasks_from_store else history
+    due_soon = _group_by_user(get_tasks_due_soon(task_history, hours=RULES["deadline_hours"]))
+    overdue = _group_by_user(get_overdue_tasks(task_history))
+
+    state = _load_state(state_path) if state_path else {"last_sent": {}, "cursor": None}
+    users = sorted(set(by_user) | set(due_soon) | set(overdue), key=lambda u: "" if u is None else str(u))
+    if state["cursor"] is not None:
+        # Xoay vòng: bắt đầu ngay sau user cuối cùng của lượt trước
+        keys = ["" if u is None else str(u) for u in users]
+        start = next((i for i, k in enumerate(keys) if k > state["cursor"]), 0)
+        users = users[start:] + users[:start]
+
+    limit = _cooldown_limit(now())
+    results: List[Dict[str, Any]] = []
+    evaluated = 0
+    for user_id in users:
+        if time.monotonic() - started > time_budget_seconds:
+            print(f"⏱️ Hết thời gian sweep: mới xét {evaluated}/{len(users)} user, phần còn lại để lượt sau")
+            break
+        user_key = "" if user_id is None else str(user_id)
+        n = _evaluate_user(
+            user_id,
+            by_user.get(user_id) or {"user_id": user_id, "last_timestamp": None, "days": []},
+            due_soon=due_soon.get(user_id, []),
+            overdue=overdue.get(user_id, []),
+            skip=_cooling_types(state, user_key, limit),
+        )
+        evaluated += 1
+        state["cursor"] = user_key
+        if n:
+            n["user_id"] = user_id
+            state["last_sent"].setdefault(user_key, {})[n["type"]] = n["created_at"]
+            results.append(n)
+
+    if state_path:
+        # Bỏ mốc gửi đã hết thời gian chờ để file trạng thái không phình mãi
+        last_sent = {}
+        for user_key, sent in state["last_sent"].items():
+            kept = {ntype: ts for ntype, ts in sent.items() if ts > limit}
+            if kept:
+                last_sent[user_key] = kept
+        state["last_sent"] = last_sent
+        atomic_write_json(state_path, state)
+
+    print(f"🔔 Sweep: {evaluated} user, {len(results)} thông báo, {time.monotonic() - started:.2f}s")
+    return results
+
+
+def emit_notifications(notifications: List[Dict[str, Any]], path: str = NOTIFICATION_OUTBOX_PATH) -> int:
+    """Ghi cả lô thông báo vào outbox (JSONL) bằng 1 lần ghi, có khoá file giữa các worker."""
+    if not notifications:
+        return 0
+    payload = "".join(json.dumps(n, ensure_ascii=False) + "\n" for n in notifications)
+    with file_lock(path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(payload)
+    return len(notifications)
@@ -36,4 +36,10 @@ RULES = {
 
     # Monthly summary: gửi vào ngày số mấy?
     "monthly_summary_day": 1,
+
+    # -----------------------------------------------------
+    # CHỐNG SPAM (sweep chạy mỗi vài phút)
+    # -----------------------------------------------------
+    # Cùng 1 loại thông báo cho cùng 1 user: cách nhau tối thiểu bao nhiêu giờ?
+    "cooldown_hours": 24,
 }
\ No newline at end of file
@@ -1,11 +1,17 @@
 # --- pipeline.py ---
 # AI Mood Journal: Sentiment + Response Pipeline
-# Phiên bản: v4.0 (simple emotion mapping + JSON logging)
-
+# Phiên bản: v4.2 (simple emotion mapping + JSON logging + async / stream variants)
+#
+# Pipeline được tách thành các bước nhỏ (_analyze_chunks, _parse_response, ...)
+# để bản đồng bộ run_ai_pipeline(), bản asyncio run_ai_pipeline_async() và
+# các bản stream dùng chung logic, chỉ khác ở phần gọi I/O (model, file lịch sử).
+
+import asyncio
+import json
+import re
 import time
-import torch
-import torch.nn.functional as F
-from core.history_engine import build_past_context
+import math
+from core.history_engine import build_past_context, save_history_entry
 # 🆕 To-Do Engine
 from core.todo_engine import (
     extract_tasks_from_text,
@@ -13,17 +19,32 @@ from core.todo_engine import (
     create_todo_plan
 )
 
-from core.hf_client import query_model
+from core.hf_client import (
+    query_model,
+    query_sentiment_batch,
+    query_model_async,
+    query_sentiment_batch_async,
+    query_sentiment_concurrent,
+    query_sentiment_concurrent_async,
+    stream_model_response,
+    stream_model_response_async,
+    build_streamed_response,
+)
 from core.config import (
     SENTIMENT_MODEL_NAME,
     ROUND_DECIMALS,
     SOFTMAX_TEMPERATURE,
-    CHUNK_SIZE
+    CHUNK_SIZE,
+    SENTIMENT_DISPATCH_MODE,
+    SENTIMENT_AGGREGATION,
 )
 from core.utils import (
     get_vn_timestamp,
     detect_sentiment_case,
+    chunks_to_matrix,
+    aggregate_by_case,
     chunk_text,
+    ResponseFieldStreamer,
 )
 
 
@@ -42,105 +63,103 @@ def print_pipeline_result(result):
     print("=====================================\n")
 
 
-# ======================== #
-#  PIPELINE CHÍNH
-# ======================== #
-def run_ai_pipeline(text: str, user_id: str = None):
-    pipeline_start_time = get_vn_timestamp()
-    start = time.time()
-    print(f"⏳ Pipeline started at {pipeline_start_time}")
+# ==== FIX PROBS ROBUST ====
+def _extract_probs(sr):
+    """
+    Trả về [neg, neu, pos] trong mọi trường hợp.
+    """
+    # CASE 1 — model trả probs
+    if isinstance(sr.get("probs"), list) and len(sr["probs"]) == 3:
+        p = sr["probs"]
+        s = sum(p) or 1
+        return [p[0]/s, p[1]/s, p[2]/s]
+
+    # CASE 2 — trả label_distribution (%)
+    dist = sr.get("label_distribution")
+    if isinstance(dist, dict) and {"negative","neutral","positive"} <= set(dist):
+        n = float(dist["negative"])
+        u = float(dist["neutral"])
+        p = float(dist["positive"])
+        s = n + u + p or 1
+        return [n/s, u/s, p/s]
+
+    # CASE 3 — trả raw_logits
+    logits = sr.get("raw_logits")
+    if isinstance(logits, list) and len(logits) == 3:
+        exp = [math.exp(x) for x in logits]
+        s = sum(exp)
+        return [exp[0]/s, exp[1]/s, exp[2]/s]
+
+    # CASE 4 — fallback
+    return [0.0, 0.0, 0.0]
+
+
+# ------------------------------
+# SIMPLE EMOTION MAPPING
+# ------------------------------
+def _emotion_from_probs(probs):
+    neg, neu, pos = probs
+
+    if pos > 0.8:
+        return "vui vẻ"
+    elif pos > 0.5:
+        return "tích cực nhẹ"
+    elif neu > 0.5:
+        return "bình thường"
+    elif neg > 0.8:
+        return "rất tiêu cực"
+    elif neg > 0.5:
+        return "buồn bã"
+    else:
+        return "không rõ"
 
-    # ------------------------------
-    # BƯỚC 1: CHUNKING
-    # ------------------------------
-    chunks = chunk_text(text, chunk_size=CHUNK_SIZE)
-    print(f"📘 Chunked into {len(chunks)} parts")
 
+# ======================== #
+#  CÁC BƯỚC CỦA PIPELINE
+# ======================== #
+def _query_sentiment(chunks):
+    """BƯỚC 2: gửi mọi chunk theo SENTIMENT_DISPATCH_MODE ("batch" | "concurrent")."""
+    if SENTIMENT_DISPATCH_MODE == "concurrent":
+        return query_sentiment_concurrent(chunks)
+    return query_sentiment_batch(chunks)
+
+
+async def _query_sentiment_async(chunks):
+    if SENTIMENT_DISPATCH_MODE == "concurrent":
+        return await query_sentiment_concurrent_async(chunks)
+    return await query_sentiment_batch_async(chunks)
+
+
+def _analyze_chunks(chunks, sentiment_results, pipeline_start_time):
+    """
+    BƯỚC 2: chuẩn hoá kết quả sentiment từng chunk.
+    `sentiment_results` có thể chứa None (chunk bị huỷ khi fail fast) — chunk
+    không có kết quả cũng là lỗi, không được tổng hợp như chunk trung tính.
+    Returns:
+        (all_chunk_results, error) — error là dict lỗi của pipeline hoặc None.
+    """
     all_chunk_results = []
-    all_probs = []
-
-    # ------------------------------
-    # BƯỚC 2: SENTIMENT TỪNG CHUNK
-    # ------------------------------
-    for i, chunk in enumerate(chunks):
-        print(f"\n--- Analyzing chunk {i+1}/{len(chunks)} ---")
 
-        sentiment_result = query_model("sentiment", chunk)
-        if "error" in sentiment_result:
-            return {
-                "status": "error",
-                "error_message": f"Sentiment model failed on chunk {i+1}: {sentiment_result['error']}",
-                "timestamp": pipeline_start_time,
-            }
-        # ==== FIX PROBS ROBUST ====
-
-        def extract_probs(sr):
-            """
-            Trả về [neg, neu, pos] trong mọi trường hợp.
-            """
-            # CASE 1 — model trả probs
-            if isinstance(sr.get("probs"), list) and len(sr["probs"]) == 3:
-                p = sr["probs"]
-                s = sum(p) or 1
-                return [p[0]/s, p[1]/s, p[2]/s]
-
-            # CASE 2 — trả label_distribution (%)
-            dist = sr.get("label_distribution")
-            if isinstance(dist, dict) and {"negative","neutral","positive"} <= set(dist):
-                n = float(dist["negative"])
-                u = float(dist["neutral"])
-                p = float(dist["positive"])
-                s = n + u + p or 1
-                return [n/s, u/s, p/s]
-
-            # CASE 3 — trả raw_logits
-            logits = sr.get("raw_logits")
-            if isinstance(logits, list) and len(logits) == 3:
-                import math
-                exp = [math.exp(x) for x in logits]
-                s = sum(exp)
-                return [exp[0]/s, exp[1]/s, exp[2]/s]
-
-            # CASE 4 — fallback
-            return [0.0, 0.0, 0.0]
-
-
-        # ---- dùng extract_probs để không lỗi nữa ----
-        probs = extract_probs(sentiment_result)
-
-        label_distribution = {
-            "negative": round(probs[0]*100, 2),
-            "neutral":  round(probs[1]*100, 2),
-            "positive": round(probs[2]*100, 2)
+    # Chunk lỗi / thiếu kết quả đầu tiên (theo thứ tự) → trả lỗi ngay
+    for i, sentiment_result in enumerate(sentiment_results):
+        if sentiment_result is None:
+            reason = "không có kết quả"
+        elif "error" in sentiment_result:
+            reason = sentiment_result["error"]
+        else:
+            continue
+        return None, {
+            "status": "error",
+            "error_message": f"Sentiment model failed on chunk {i+1}: {reason}",
+            "timestamp": pipeline_start_time,
         }
 
-        label = sentiment_result.get("predicted_label", "unknown")
-
-
-        # ------------------------------
-        # SIMPLE EMOTION MAPPING
-        # ------------------------------
-        neg, neu, pos = probs
-
-        if pos > 0.8:
-            emotion_detail = "vui vẻ"
-        elif pos > 0.5:
-            emotion_detail = "tích cực nhẹ"
-        elif neu > 0.5:
-            emotion_detail = "bình thường"
-        elif neg > 0.8:
-            emotion_detail = "rất tiêu cực" 
-        elif neg > 0.5:
-            emotion_detail = "buồn bã"
-        else:
-            emotion_detail = "không rõ"
+    for i, (chunk, sentiment_result) in enumerate(zip(chunks, sentiment_results)):
+        print(f"\n--- Analyzing chunk {i+1}/{len(chunks)} ---")
 
-        # label_distribution cho từng chunk
-        label_distribution = {
-            "negative": round(probs[0] * 100, ROUND_DECIMALS),
-            "neutral": round(probs[1] * 100, ROUND_DECIMALS),
-            "positive": round(probs[2] * 100, ROUND_DECIMALS),
-        }
+        # ---- dùng _extract_probs để không lỗi nữa ----
+        probs = _extract_probs(sentiment_result)
+        label = sentiment_result.get("predicted_label", "unknown")
 
         # Schema chuẩn cho detect_sentiment_case
         all_chunk_results.append({
@@ -148,15 +167,32 @@ def run_ai_pipeline(text: str, user_id: str = None):
             "label": label,
             "probs": probs,
             "length": len(chunk),
-            "emotion_detail": emotion_detail,
+            "emotion_detail": _emotion_from_probs(probs),
         })
 
-        all_probs.append(probs)
+    return all_chunk_results, None
+
 
+def _aggregate_chunks(all_chunk_results):
+    """
+    BƯỚC 3 → 5: nhận diện case, tổng hợp toàn văn bản theo case, gộp cảm xúc.
+    Returns:
+        (predicted_label, label_distribution, emotion_detail_summary, case_type)
+    """
     # ------------------------------
-    # BƯỚC 3: TỔNG HỢP TOÀN VĂN BẢN
+    # BƯỚC 3 + 5: NHẬN DIỆN CASE & TỔNG HỢP TOÀN VĂN BẢN
     # ------------------------------
-    avg_probs = torch.tensor(all_probs).mean(dim=0).tolist()
+    # Kết quả chunk → ma trận (n_chunks, 3), từ nối được quét 1 lần khi dựng ma trận;
+    # detect + aggregate_* của case chạy trên cùng ma trận đó
+    chunk_matrix = chunks_to_matrix(all_chunk_results)
+    if SENTIMENT_AGGREGATION == "mean":
+        avg_probs = chunk_matrix.probs.mean(axis=0).tolist()
+        case_type = detect_sentiment_case(chunk_matrix)
+    else:
+        probs, case_type, _ = aggregate_by_case(chunk_matrix)
+        avg_probs = probs.tolist()
+    print(f"🧠 Detected sentiment case: {case_type}")
+
     label_distribution = {
         "negative": round(avg_probs[0] * 100, ROUND_DECIMALS),
         "neutral": round(avg_probs[1] * 100, ROUND_DECIMALS),
@@ -176,25 +212,15 @@ def run_ai_pipeline(text: str, user_id: str = None):
 
     emotion_detail_summary = ", ".join(emotion_set) if emotion_set else "không rõ"
 
-    # ------------------------------
-    # BƯỚC 5: NHẬN DIỆN CASE
-    # ------------------------------
-    case_type = detect_sentiment_case(all_chunk_results)
-    print(f"🧠 Detected sentiment case: {case_type}")
-    # ------------------------------
-    # BƯỚC 5.5: ĐỌC LẠI HISTORY → TẠO BỐI CẢNH QUÁ KHỨ
-    # ------------------------------
-    history_context = build_past_context(
-        current_label=predicted_label,
-        case_type=case_type,
-        #user_id=user_id,
-    )
-    print("📚 History context:")
-    print(history_context)
-    # ============================================
-    # 🆕 BƯỚC 5.6: TODO ENGINE – PHÁT HIỆN NHIỆM VỤ
-    # ============================================
+    return predicted_label, label_distribution, emotion_detail_summary, case_type
 
+
+def _detect_todo(text, case_type):
+    """
+    🆕 BƯỚC 5.6: TODO ENGINE – PHÁT HIỆN NHIỆM VỤ
+    Returns:
+        (todo_candidates, best_task, todo_question)
+    """
     todo_candidates = extract_tasks_from_text(
         text,
         context_tags=[case_type] if case_type else []
@@ -212,15 +238,12 @@ def run_ai_pipeline(text: str, user_id: str = None):
         print("\n🆕 [To-Do] Câu hỏi nhẹ nhàng:")
         print(todo_question)
 
-    # ------------------------------
-   # ------------------------------
-   # ------------------------------
-    # BƯỚC 6: SINH PHẢN HỒI VÀ PHÂN LOẠI TOPIC (GỘP 2 TRONG 1)
-    # ------------------------------
-    import json # Cần import để đọc JSON
-    print("🤖 Calling unified model for response and topic...")
+    return todo_candidates, best_task, todo_question
+
 
-    # PROMPT NÀY PHẢI KHỚP VỚI ĐỊNH DẠNG TRONG prompts.py
+def _build_prompt(text, predicted_label, label_distribution, emotion_detail_summary,
+                  case_type, history_context, todo_question):
+    """BƯỚC 6: prompt gộp (phản hồi + topic) — PHẢI KHỚP VỚI ĐỊNH DẠNG TRONG prompts.py"""
     prompt = (
         f"NỘI DUNG HIỆN TẠI: Người dùng vừa chia sẻ: \"{text}\"\n"
         f"Cảm xúc chính được nhận diện là: {predicted_label} (Phân bố: {label_distribution})\n"
@@ -236,147 +259,166 @@ def run_ai_pipeline(text: str, user_id: str = None):
             f"{todo_question}\n"
             "Nếu người dùng đồng ý, hãy trả lời: 'Ok, mình tạo kế hoạch nhé!'\n"
         )
+    return prompt
+
 
+FALLBACK_ADVICE = "Mình đang hơi trục trặc một chút, nhưng mình vẫn ở đây để lắng nghe bạn 🌿."
+
+
+def _parse_response(response_result):
+    """
+    BƯỚC 6 (tiếp): tách advice + topic từ output của model response.
+    Returns:
+        (advice_text, topic_label, advice_source, ok) — ok=False khi model lỗi.
+    """
     # --- Khởi tạo giá trị mặc định ---
-    fallback_advice = "Mình đang hơi trục trặc một chút, nhưng mình vẫn ở đây để lắng nghe bạn 🌿."
+    fallback_advice = FALLBACK_ADVICE
     advice_text = fallback_advice
     topic_label = "không xác định"
     advice_source = "fallback"
-    
-    # --- Gọi Model 1 LẦN DUY NHẤT ---
-    response_result = query_model("response", prompt)
 
     if "error" in response_result:
         print(f"⚠️ Lỗi model response: {response_result['error']}")
         # Lỗi, giữ nguyên giá trị mặc định
-    else:
-        raw_text = response_result.get("text", "").strip()
-        advice_source = response_result.get("source", "gemini_flash")
-        # Nếu advice_text chứa JSON (vì model có thể trả toàn bộ trong 1 chuỗi)
-        if raw_text.strip().startswith("{") and "response" in raw_text:
-            try:
-                inner_data = json.loads(raw_text)
-                advice_text = inner_data.get("response", fallback_advice).strip()
-                topic_label = inner_data.get("topic", "không xác định").strip()
-                print(f"✅ Đã tách topic bên trong advice_text: {topic_label}")
-            except Exception as e:
-                print(f"⚠️ Lỗi parse advice_text nội bộ: {e}")
+        return advice_text, topic_label, advice_source, False
 
+    raw_text = response_result.get("text", "").strip()
+    advice_source = response_result.get("source", "gemini_flash")
+    # Nếu advice_text chứa JSON (vì model có thể trả toàn bộ trong 1 chuỗi)
+    if raw_text.strip().startswith("{") and "response" in raw_text:
         try:
-                    # --- LẦN 1: Parse JSON thẳng ---
-            json_start = raw_text.find('{')
-            json_end = raw_text.rfind('}') + 1
-            if json_start == -1 or json_end == 0:
-                raise json.JSONDecodeError("Không tìm thấy JSON object", raw_text, 0)
+            inner_data = json.loads(raw_text)
+            advice_text = inner_data.get("response", fallback_advice).strip()
+            topic_label = inner_data.get("topic", "không xác định").strip()
+            print(f"✅ Đã tách topic bên trong advice_text: {topic_label}")
+        except Exception as e:
+            print(f"⚠️ Lỗi parse advice_text nội bộ: {e}")
 
-            json_str = raw_text[json_start:json_end]
+    try:
+        # --- LẦN 1: Parse JSON thẳng ---
+        json_start = raw_text.find('{')
+        json_end = raw_text.rfind('}') + 1
+        if json_start == -1 or json_end == 0:
+            raise json.JSONDecodeError("Không tìm thấy JSON object", raw_text, 0)
 
-            # --- Chuẩn hóa khóa JSON ---
-            json_str = json_str.replace(" response:", ' "response":')
-            json_str = json_str.replace("response:", ' "response":')
-            json_str = json_str.replace(" topic:", ' "topic":')
-            json_str = json_str.replace("topic:", ' "topic":')
+        json_str = raw_text[json_start:json_end]
 
-            data = json.loads(json_str)
+        # --- Chuẩn hóa khóa JSON ---
+        json_str = json_str.replace(" response:", ' "response":')
+        json_str = json_str.replace("response:", ' "response":')
+        json_str = json_str.replace(" topic:", ' "topic":')
+        json_str = json_str.replace("topic:", ' "topic":')
 
-           # --- Parse và tách JSON lồng nhau ---
-            try:
-                # Nếu advice_text là JSON string, parse thêm 1 lớp nữa
-                advice_raw = data.get("response", "")
-                if advice_raw.strip().startswith("{"):
-                    inner = json.loads(advice_raw)
-                    advice_text = inner.get("response", fallback_advice).strip()
-                    topic_label = inner.get("topic", "không xác định").strip()
-                    print(f"✅ Đã lấy topic từ lớp JSON trong advice_text: {topic_label}")
-                else:
-                    advice_text = advice_raw or fallback_advice
-                    topic_label = data.get("topic", "không xác định").strip()
+        data = json.loads(json_str)
 
-            except Exception as e:
-                print(f"⚠️ Lỗi khi parse advice_text lồng nhau: {e}")
-                advice_text = fallback_advice
-                topic_label = "không xác định"
+        # --- Parse và tách JSON lồng nhau ---
+        try:
+            # Nếu advice_text là JSON string, parse thêm 1 lớp nữa
+            advice_raw = data.get("response", "")
+            if advice_raw.strip().startswith("{"):
+                inner = json.loads(advice_raw)
+                advice_text = inner.get("response", fallback_advice).strip()
+                topic_label = inner.get("topic", "không xác định").strip()
+                print(f"✅ Đã lấy topic từ lớp JSON trong advice_text: {topic_label}")
+            else:
+                advice_text = advice_raw or fallback_advice
+                topic_label = data.get("topic", "không xác định").strip()
 
-            if not advice_text:
-                advice_text = fallback_advice
-            print(f"👍 Response parsed (Lần 1).")
+        except Exception as e:
+            print(f"⚠️ Lỗi khi parse advice_text lồng nhau: {e}")
+            advice_text = fallback_advice
+            topic_label = "không xác định"
 
-        except (json.JSONDecodeError, Exception) as e:
-            # --- LẦN 2: Thử parse lại bằng cách làm sạch chuỗi ---
-            print(f"⚠️ Lỗi parse JSON lần 1 ({e}). Thử lại với replace...")
-            try:
-                # Làm sạch ký tự đặc biệt và escape ký tự xuống dòng
-                cleaned = raw_text.replace("\r", "").replace("\n", "\\n").strip()
-                cleaned = cleaned.replace("```json", "").replace("```", "")
+        if not advice_text:
+            advice_text = fallback_advice
+        print(f"👍 Response parsed (Lần 1).")
 
-                json_start = cleaned.find('{')
-                json_end = cleaned.rfind('}') + 1
-                if json_start == -1 or json_end <= 0:
-                    raise ValueError("Không tìm thấy JSON object trong lần 2")
+    except (json.JSONDecodeError, Exception) as e:
+        # --- LẦN 2: Thử parse lại bằng cách làm sạch chuỗi ---
+        print(f"⚠️ Lỗi parse JSON lần 1 ({e}). Thử lại với replace...")
+        try:
+            # Làm sạch ký tự đặc biệt và escape ký tự xuống dòng
+            cleaned = raw_text.replace("\r", "").replace("\n", "\\n").strip()
+            cleaned = cleaned.replace("```json", "").replace("```", "")
 
-                json_str = cleaned[json_start:json_end]
+            json_start = cleaned.find('{')
+            json_end = cleaned.rfind('}') + 1
+            if json_start == -1 or json_end <= 0:
+                raise ValueError("Không tìm thấy JSON object trong lần 2")
 
-                # Escape ký tự đặc biệt để tránh lỗi JSON
-                import re
-                json_str = re.sub(r'(?<=\{|,)\s*(\w+):', r'"\1":', json_str)
+            json_str = cleaned[json_start:json_end]
 
-                # Thử parse lại
-                data = json.loads(json_str)
+            # Escape ký tự đặc biệt để tránh lỗi JSON
+            json_str = re.sub(r'(?<=\{|,)\s*(\w+):', r'"\1":', json_str)
 
-                advice_text = data.get("response", fallback_advice).strip()
-                topic_label = data.get("topic", "không xác định").strip()
-                advice_source = response_result.get("source", "gemini_flash")
-                print(f"✅ JSON parsed thành công (Lần 2). Topic: {topic_label}")
+            # Thử parse lại
+            data = json.loads(json_str)
 
-            except Exception as e2:
-                print(f"⚠️ Lỗi parse JSON lần 2 ({e2}). Fallback về raw text.")
-                advice_text = raw_text.replace("```json", "").replace("```", "").strip()
-                if not advice_text:
-                    advice_text = fallback_advice
-                topic_label = "không xác định"
-                print(f"👍 Fallback: Set advice to raw text. Topic: {topic_label}")
+            advice_text = data.get("response", fallback_advice).strip()
+            topic_label = data.get("topic", "không xác định").strip()
+            advice_source = response_result.get("source", "gemini_flash")
+            print(f"✅ JSON parsed thành công (Lần 2). Topic: {topic_label}")
 
+        except Exception as e2:
+            print(f"⚠️ Lỗi parse JSON lần 2 ({e2}). Fallback về raw text.")
+            advice_text = raw_text.replace("```json", "").replace("```", "").strip()
+            if not advice_text:
+                advice_text = fallback_advice
+            topic_label = "không xác định"
+            print(f"👍 Fallback: Set advice to raw text. Topic: {topic_label}")
 
+    # --- FIX BỔ SUNG: Tự động trích topic từ advice_text nếu còn dạng chuỗi JSON ---
+    if isinstance(advice_text, str) and advice_text.strip().startswith("{") and "topic" in advice_text:
+        try:
+            inner = json.loads(advice_text)
+            advice_text = inner.get("response", advice_text).strip()
+            topic_label = inner.get("topic", topic_label).strip()
+            print(f"✅ Đã tách topic từ advice_text (fix cuối): {topic_label}")
+        except Exception as e:
+            print(f"⚠️ Không thể parse topic trong advice_text (fix cuối): {e}")
 
-                # --- FIX BỔ SUNG: Tự động trích topic từ advice_text nếu còn dạng chuỗi JSON ---
-        if isinstance(advice_text, str) and advice_text.strip().startswith("{") and "topic" in advice_text:
-            try:
-                inner = json.loads(advice_text)
-                advice_text = inner.get("response", advice_text).strip()
-                topic_label = inner.get("topic", topic_label).strip()
-                print(f"✅ Đã tách topic từ advice_text (fix cuối): {topic_label}")
-            except Exception as e:
-                print(f"⚠️ Không thể parse topic trong advice_text (fix cuối): {e}")
+    return advice_text, topic_label, advice_source, True
 
-        # ------------------------------
-    # ------------------------------
-    # ============================================
-    # 🆕 BƯỚC 7: USER ĐỒNG Ý → TẠO TO-DO PLAN
-    # ============================================
-        todo_plan = None
 
-        if todo_question:
-            user_reply = advice_text.lower().strip()
+def _maybe_create_todo_plan(todo_question, best_task, advice_text, text):
+    """🆕 BƯỚC 7: USER ĐỒNG Ý → TẠO TO-DO PLAN"""
+    todo_plan = None
+
+    if todo_question:
+        user_reply = advice_text.lower().strip()
+
+        need_plan = any(k in user_reply for k in [
+            "ok", "oke", "đồng ý", "tạo kế hoạch", "làm đi", "yes"
+        ])
 
-            need_plan = any(k in user_reply for k in [
-                "ok", "oke", "đồng ý", "tạo kế hoạch", "làm đi", "yes"
-            ])
+        if need_plan and best_task:
+            todo_plan = create_todo_plan(best_task, text)
+            print("🆕 [To-Do] Đã tạo kế hoạch:", todo_plan)
 
-            if need_plan and best_task:
-                todo_plan = create_todo_plan(best_task, text)
-                print("🆕 [To-Do] Đã tạo kế hoạch:", todo_plan)
- # BƯỚC 8: KẾT QUẢ CUỐI
+    return todo_plan
 
-    final_result = {
+
+def _cache_summary(sentiment_results):
+    """Số chunk lấy từ cache sentiment (để đo hit rate)."""
+    hits = sum(1 for r in sentiment_results if r and r.get("cache_hit"))
+    return {"hits": hits, "chunks": len(sentiment_results)}
+
+
+def _build_final_result(text, todo_candidates, todo_question, todo_plan, predicted_label,
+                        label_distribution, emotion_detail_summary, topic_label, case_type,
+                        advice_text, advice_source, start):
+    """BƯỚC 8: KẾT QUẢ CUỐI"""
+    return {
         "todo_candidates": [
-    {
-        "action": t.action,
-        "description": t.description,
-        "confidence": t.confidence,
-        "context_tags": t.context_tags,
-    }
-    for t in todo_candidates
-],
+            {
+                "action": t.action,
+                "description": t.description,
+                "confidence": t.confidence,
+                "context_tags": t.context_tags,
+                "deadline": t.deadline,
+            }
+            for t in todo_candidates
+        ],
 
         "todo_question": todo_question,
 
@@ -399,14 +441,15 @@ def run_ai_pipeline(text: str, user_id: str = None):
         "timestamp": get_vn_timestamp(),
         "processing_time": round(time.time() - start, 2),
     }
-    
-   # =========================
-# BƯỚC 8: APPEND LỊCH SỬ KHÔNG GHI ĐÈ
-# =========================
-    import os, json
 
-    save_path = "pipeline_history.json"
 
+# =========================
+# BƯỚC 8: APPEND LỊCH SỬ KHÔNG GHI ĐÈ
+# =========================
+# Ghi qua history store (mặc định JSONL append-only, xem core/history_store.py)
+# → mỗi lần lưu chỉ ghi thêm 1 dòng, store tự khoá khi nhiều thread cùng ghi.
+# Mặc định write-behind (HISTORY_WRITE_BEHIND): chỉ đưa vào hàng đợi, không chờ I/O đĩa.
+def _save_history(final_result):
     try:
         # --- FIX TOPIC TRƯỚC ---
         advice_raw = final_result.get("advice_text", "")
@@ -421,31 +464,229 @@ def run_ai_pipeline(text: str, user_id: str = None):
             except Exception as e:
                 print(f"⚠️ Lỗi parse advice_text nội bộ: {e}")
 
-        # --- TẠO FILE NẾU CHƯA CÓ ---
-        if not os.path.exists(save_path):
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-
         # --- APPEND DỮ LIỆU MỚI ---
-        with open(save_path, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    data = []
-            except json.JSONDecodeError:
-                data = []
-
-        # Thêm bản ghi mới
-        data.append(final_result)
-
-        # --- GHI LẠI (OVERWRITE TOÀN BỘ LIST) ---
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        save_history_entry(final_result)
 
-        print("✅ Đã lưu kết quả mới vào pipeline_history.json")
+        print("✅ Đã lưu kết quả mới vào lịch sử")
 
     except Exception as e:
         print(f"⚠️ Lỗi khi ghi dữ liệu lịch sử: {e}")
 
+
+# ======================== #
+#  CÁC GIAI ĐOẠN (dùng chung cho bản sync / async / stream)
+# ======================== #
+def _begin(text, user_id, mode=""):
+    """BƯỚC 1: CHUNKING — khởi tạo state của 1 lần chạy pipeline."""
+    pipeline_start_time = get_vn_timestamp()
+    print(f"⏳ Pipeline{mode} started at {pipeline_start_time}")
+
+    chunks = chunk_text(text, chunk_size=CHUNK_SIZE)
+    print(f"📘 Chunked into {len(chunks)} parts")
+
+    return {
+        "text": text,
+        "user_id": user_id,
+        "start": time.time(),
+        "pipeline_start_time": pipeline_start_time,
+        "chunks": chunks,
+    }
+
+
+def _after_sentiment(state, sentiment_results):
+    """BƯỚC 2 → 5: chuẩn hoá sentiment, tổng hợp, nhận diện case. Trả về dict lỗi hoặc None."""
+    all_chunk_results, error = _analyze_chunks(
+        state["chunks"], sentiment_results, state["pipeline_start_time"]
+    )
+    if error:
+        return error
+
+    predicted_label, label_distribution, emotion_detail_summary, case_type = \
+        _aggregate_chunks(all_chunk_results)
+
+    state.update(
+        sentiment_results=sentiment_results,
+        predicted_label=predicted_label,
+        label_distribution=label_distribution,
+        emotion_detail_summary=emotion_detail_summary,
+        case_type=case_type,
+    )
+    return None
+
+
+def _history_context_kwargs(state):
+    """Tham số cho build_past_context (BƯỚC 5.5)."""
+    return {
+        "current_label": state["predicted_label"],
+        "case_type": state["case_type"],
+        "user_id": state["user_id"],
+        "text": state["text"],  # context theo ngữ nghĩa: ký ức giống nhật ký này nhất
+    }
+
+
+def _before_response(state, history_context):
+    """BƯỚC 5.6 + 6: TODO ENGINE và dựng prompt cho model response."""
+    print("📚 History context:")
+    print(history_context)
+
+    todo_candidates, best_task, todo_question = _detect_todo(state["text"], state["case_type"])
+
+    print("🤖 Calling unified model for response and topic...")
+    state.update(
+        todo_candidates=todo_candidates,
+        best_task=best_task,
+        todo_question=todo_question,
+        prompt=_build_prompt(
+            state["text"], state["predicted_label"], state["label_distribution"],
+            state["emotion_detail_summary"], state["case_type"], history_context, todo_question,
+        ),
+    )
+    return state["prompt"]
+
+
+def _finish(state, response_result):
+    """BƯỚC 6 (parse) → 8: tách advice/topic, tạo to-do plan, dựng kết quả cuối."""
+    advice_text, topic_label, advice_source, ok = _parse_response(response_result)
+
+    # BƯỚC 7: USER ĐỒNG Ý → TẠO TO-DO PLAN
+    todo_plan = _maybe_create_todo_plan(
+        state["todo_question"], state["best_task"], advice_text, state["text"]
+    ) if ok else None
+
+    # BƯỚC 8: KẾT QUẢ CUỐI
+    final_result = _build_final_result(
+        state["text"], state["todo_candidates"], state["todo_question"], todo_plan,
+        state["predicted_label"], state["label_distribution"], state["emotion_detail_summary"],
+        topic_label, state["case_type"], advice_text, advice_source, state["start"],
+    )
+    final_result["user_id"] = state["user_id"]  # để lưu vào đúng phần lịch sử của user
+    final_result["sentiment_cache"] = _cache_summary(state["sentiment_results"])
     return final_result
 
+
+# ======================== #
+#  PIPELINE CHÍNH
+# ======================== #
+def run_ai_pipeline(text: str, user_id: str = None):
+    # BƯỚC 1: CHUNKING
+    state = _begin(text, user_id)
+
+    # BƯỚC 2: SENTIMENT TỪNG CHUNK (batch hoặc song song, xem SENTIMENT_DISPATCH_MODE)
+    error = _after_sentiment(state, _query_sentiment(state["chunks"]))
+    if error:
+        return error
+
+    # BƯỚC 5.5: ĐỌC LẠI HISTORY → TẠO BỐI CẢNH QUÁ KHỨ
+    history_context = build_past_context(**_history_context_kwargs(state))
+
+    # BƯỚC 6: SINH PHẢN HỒI VÀ PHÂN LOẠI TOPIC (GỘP 2 TRONG 1) — gọi model 1 LẦN DUY NHẤT
+    prompt = _before_response(state, history_context)
+    response_result = query_model("response", prompt)
+
+    # BƯỚC 7 → 8: KẾT QUẢ CUỐI + LƯU LỊCH SỬ
+    final_result = _finish(state, response_result)
+    _save_history(final_result)
+
+    return final_result
+
+
+# ======================== #
+#  PIPELINE ASYNC (asyncio)
+# ======================== #
+async def run_ai_pipeline_async(text: str, user_id: str = None):
+    """
+    Bản asyncio của run_ai_pipeline(): cùng input/output, nhưng các bước I/O
+    (sentiment, Gemini, đọc/ghi lịch sử) không chặn event loop → 1 process
+    phục vụ được nhiều nhật ký đồng thời.
+    """
+    state = _begin(text, user_id, mode=" (async)")
+
+    error = _after_sentiment(state, await _query_sentiment_async(state["chunks"]))
+    if error:
+        return error
+
+    # Đọc lịch sử trong thread riêng (file I/O)
+    history_context = await asyncio.to_thread(
+        lambda: build_past_context(**_history_context_kwargs(state))
+    )
+
+    prompt = _before_response(state, history_context)
+    response_result = await query_model_async("response", prompt)
+
+    final_result = _finish(state, response_result)
+    await asyncio.to_thread(_save_history, final_result)
+
+    return final_result
+
+
+# ======================== #
+#  PIPELINE STREAM (trả token phản hồi ngay khi model sinh ra)
+# ======================== #
+def run_ai_pipeline_stream(text: str, user_id: str = None):
+    """
+    Generator: giống run_ai_pipeline() nhưng stream phản hồi của Gemini.
+
+    Yield lần lượt các event:
+        {"type": "token", "text": "..."}      – phần nội dung "response" mới sinh
+        {"type": "result", "result": {...}}   – kết quả cuối (giống run_ai_pipeline)
+    Nếu sentiment lỗi → chỉ yield {"type": "result", "result": <dict lỗi>}.
+    Topic / JSON được parse đầy đủ ở cuối từ toàn bộ text đã nhận.
+    """
+    state = _begin(text, user_id, mode=" (stream)")
+
+    error = _after_sentiment(state, _query_sentiment(state["chunks"]))
+    if error:
+        yield {"type": "result", "result": error}
+        return
+
+    history_context = build_past_context(**_history_context_kwargs(state))
+    prompt = _before_response(state, history_context)
+
+    parts = []
+    streamer = ResponseFieldStreamer()
+    try:
+        for delta in stream_model_response(prompt):
+            parts.append(delta)
+            visible = streamer.feed(delta)
+            if visible:
+                yield {"type": "token", "text": visible}
+        response_result = build_streamed_response(parts)
+    except Exception as e:
+        response_result = {"error": f"Lỗi khi stream model response: {e}"}
+
+    final_result = _finish(state, response_result)
+    _save_history(final_result)
+
+    yield {"type": "result", "result": final_result}
+
+
+async def run_ai_pipeline_stream_async(text: str, user_id: str = None):
+    """Bản async-generator của run_ai_pipeline_stream(), cùng định dạng event."""
+    state = _begin(text, user_id, mode=" (async stream)")
+
+    error = _after_sentiment(state, await _query_sentiment_async(state["chunks"]))
+    if error:
+        yield {"type": "result", "result": error}
+        return
+
+    history_context = await asyncio.to_thread(
+        lambda: build_past_context(**_history_context_kwargs(state))
+    )
+    prompt = _before_response(state, history_context)
+
+    parts = []
+    streamer = ResponseFieldStreamer()
+    try:
+        async for delta in stream_model_response_async(prompt):
+            parts.append(delta)
+            visible = streamer.feed(delta)
+            if visible:
+                yield {"type": "token", "text": visible}
+        response_result = build_streamed_response(parts)
+    except Exception as e:
+        response_result = {"error": f"Lỗi khi stream model response: {e}"}
+
+    final_result = _finish(state, response_result)
+    await asyncio.to_thread(_save_history, final_result)
+
+    yield {"type": "result", "result": final_result}
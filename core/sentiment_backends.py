@@ -0,0 +1,193 @@
+"""
+core/sentiment_backends.py
+-----------------------------------------
+Backend sentiment chạy ngay trong process (không gọi Hugging Face Space).
+
+- LocalSentimentBackend: load PhoBERT (SENTIMENT_MODEL_NAME) từ thư mục local
+  bằng transformers + torch, suy luận theo batch trên CPU.
+- OnnxSentimentBackend: chạy bản ONNX đã lượng tử hoá int8
+  (tạo bằng export_sentiment_onnx.py) qua ONNX Runtime, không cần torch.
+
+Backend chỉ trả về logits (thứ tự theo LABELS); hf_client lo phần softmax,
+làm tròn và dựng dict kết quả giống hệt khi gọi Space.
+-----------------------------------------
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from core.config import (
+    LABELS,
+    SENTIMENT_LOCAL_MODEL_PATH,
+    SENTIMENT_LOCAL_BATCH_SIZE,
+    SENTIMENT_LOCAL_NUM_THREADS,
+    SENTIMENT_ONNX_MODEL_DIR,
+    SENTIMENT_ONNX_FILE,
+    SENTIMENT_ONNX_INTRA_OP_THREADS,
+)
+
+
+def _label_order(id2label) -> List[int]:
+    """
+    Trả về index cột logits theo đúng thứ tự LABELS.
+    Nếu config của model không có tên nhãn khớp LABELS → giữ nguyên thứ tự model.
+    """
+    names = {str(name).lower(): int(idx) for idx, name in (id2label or {}).items()}
+    if all(label in names for label in LABELS):
+        return [names[label] for label in LABELS]
+    return list(range(len(LABELS)))
+
+
+class LocalSentimentBackend:
+    """PhoBERT classifier chạy CPU, load lười ở lần gọi đầu tiên."""
+
+    def __init__(self, model_path: str = SENTIMENT_LOCAL_MODEL_PATH,
+                 batch_size: int = SENTIMENT_LOCAL_BATCH_SIZE,
+                 num_threads: int = SENTIMENT_LOCAL_NUM_THREADS,
+                 max_length: Optional[int] = None):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.max_length = max_length  # None → theo model_max_length của tokenizer (PhoBERT: 256)
+        self._tokenizer = None
+        self._model = None
+        self._order = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_path)
+        model.eval()
+        self._order = _label_order(getattr(model.config, "id2label", None))
+        self._model = model
+
+    def predict_logits(self, texts: List[str]) -> List[List[float]]:
+        """Trả về logits [neg, neu, pos] cho từng text, chạy theo batch."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._load()
+
+        import torch
+
+        logits: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            encoded = self._tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt",
+            )
+            with torch.inference_mode():
+                out = self._model(**encoded).logits
+            logits.extend(row[self._order].tolist() for row in out)
+        return logits
+
+
+class OnnxSentimentBackend:
+    """
+    PhoBERT bản ONNX (int8) chạy bằng ONNX Runtime trên CPU.
+    Thư mục model gồm: file .onnx, tokenizer và config.json (để lấy id2label).
+    """
+
+    def __init__(self, model_dir: str = SENTIMENT_ONNX_MODEL_DIR,
+                 onnx_file: str = SENTIMENT_ONNX_FILE,
+                 batch_size: int = SENTIMENT_LOCAL_BATCH_SIZE,
+                 intra_op_threads: int = SENTIMENT_ONNX_INTRA_OP_THREADS,
+                 max_length: Optional[int] = None):
+        self.model_dir = model_dir
+        self.onnx_file = onnx_file
+        self.batch_size = batch_size
+        self.intra_op_threads = intra_op_threads
+        self.max_length = max_length
+        self._tokenizer = None
+        self._session = None
+        self._input_names = None
+        self._order = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        # Số thread cố định → latency ổn định, không tranh CPU giữa các worker
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self._tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        self._session = ort.InferenceSession(
+            os.path.join(self.model_dir, self.onnx_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._order = _label_order(_read_id2label(self.model_dir))
+
+    def predict_logits(self, texts: List[str]) -> List[List[float]]:
+        """Trả về logits [neg, neu, pos] cho từng text, chạy theo batch."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._load()
+
+        logits: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            encoded = self._tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype("int64") for k, v in encoded.items() if k in self._input_names}
+            out = self._session.run(None, feeds)[0]
+            logits.extend(row[self._order].tolist() for row in out)
+        return logits
+
+
+def _read_id2label(model_dir: str) -> Dict:
+    """Đọc id2label từ config.json cạnh file ONNX (nếu có)."""
+    try:
+        with open(os.path.join(model_dir, "config.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("id2label") or {}
+    except (OSError, ValueError):
+        return {}
+
+
+# ============================================================
+# Backend dùng chung cho toàn process
+# ============================================================
+_BACKEND_CLASSES = {
+    "local": LocalSentimentBackend,
+    "onnx": OnnxSentimentBackend,
+}
+_backends: Dict[str, object] = {}
+_backend_lock = threading.Lock()
+
+
+def get_backend(name: str):
+    """Trả về backend in-process ("local" | "onnx") dùng chung, tạo lười ở lần đầu."""
+    if name not in _backends:
+        with _backend_lock:
+            if name not in _backends:
+                if name not in _BACKEND_CLASSES:
+                    raise ValueError(f"Backend sentiment '{name}' không được hỗ trợ.")
+                _backends[name] = _BACKEND_CLASSES[name]()
+    return _backends[name]
+
+
+def get_local_backend() -> LocalSentimentBackend:
+    return get_backend("local")
@@ -0,0 +1,155 @@
+"""
+core/sentiment_cache.py
+-----------------------------------------
+Cache kết quả sentiment theo nội dung chunk (content-addressed).
+
+- Key = sha256(SENTIMENT_MODEL_NAME + SOFTMAX_TEMPERATURE + clean_text(chunk))
+  → đổi model hoặc nhiệt độ softmax thì cache cũ tự động không còn khớp.
+- Tầng 1: LRU trong RAM (OrderedDict), có TTL.
+- Tầng 2 (tuỳ chọn): SQLite trên đĩa, có TTL, dùng chung giữa các worker / các lần chạy.
+-----------------------------------------
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from core.config import (
+    SENTIMENT_MODEL_NAME,
+    SOFTMAX_TEMPERATURE,
+    SENTIMENT_CACHE_ENABLED,
+    SENTIMENT_CACHE_MAX_ITEMS,
+    SENTIMENT_CACHE_TTL_SECONDS,
+    SENTIMENT_CACHE_DB_PATH,
+)
+from core.utils import clean_text
+
+
+def make_cache_key(text: str) -> str:
+    """Hash nội dung chunk (đã clean) cùng tên model + nhiệt độ softmax."""
+    raw = f"{SENTIMENT_MODEL_NAME}\x1f{SOFTMAX_TEMPERATURE}\x1f{clean_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SentimentCache:
+    """
+    Cache 2 tầng cho kết quả sentiment (dict giống query_model trả về).
+    Thread-safe: dùng chung cho mọi pipeline trong process.
+    """
+
+    def __init__(self, max_items: int = 4096, ttl_seconds: Optional[float] = None,
+                 db_path: Optional[str] = None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    # ---------- Helpers ----------
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, value: Dict[str, Any], created_at: float) -> None:
+        self._items[key] = (value, created_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    # ---------- API ----------
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Trả về bản sao kết quả đã cache hoặc None (miss / hết hạn)."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, created_at = item
+                if not self._expired(created_at):
+                    self._items.move_to_end(key)
+                    self._hits += 1
+                    return dict(value)
+                del self._items[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM sentiment_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = json.loads(row[0]), row[1]
+                    if not self._expired(created_at):
+                        self._remember(key, value, created_at)
+                        self._hits += 1
+                        return dict(value)
+                    self._db.execute("DELETE FROM sentiment_cache WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._misses += 1
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Lưu kết quả (chỉ nên gọi với kết quả không lỗi)."""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, dict(value), created_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sentiment_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), created_at),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._hits = 0
+            self._misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM sentiment_cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Số hit/miss để đo hit rate."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+                "size": len(self._items),
+            }
+
+
+# ============================================================
+# Cache dùng chung cho toàn process
+# ============================================================
+_cache: Optional[SentimentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_sentiment_cache() -> Optional[SentimentCache]:
+    """Trả về cache dùng chung, hoặc None nếu SENTIMENT_CACHE_ENABLED = False."""
+    global _cache
+    if not SENTIMENT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SentimentCache(
+                    max_items=SENTIMENT_CACHE_MAX_ITEMS,
+                    ttl_seconds=SENTIMENT_CACHE_TTL_SECONDS,
+                    db_path=SENTIMENT_CACHE_DB_PATH,
+                )
+    return _cache
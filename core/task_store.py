@@ -0,0 +1,283 @@
+"""
+core/task_store.py
+-----------------------------------------
+Bảng nhiệm vụ (task) đã trích từ nhật ký, lưu trong SQLite (TASK_DB_PATH).
+
+- Nhiệm vụ được trích 1 lần khi pipeline lưu entry (ghi cùng lô với lịch sử,
+  xem core/history_writer.py) và lưu kèm thời điểm đến hạn tuyệt đối (due_at,
+  neo vào timestamp của entry, giờ VN) → giá trị không đổi dù tính lại lúc nào.
+- Kiểm tra thông báo (sắp đến hạn / quá hạn) là range query trên due_at qua
+  index (status, due_at) / (user_id, status, due_at) → không phải đọc lại lịch
+  sử và chạy lại rule với mọi entry mỗi lần kiểm tra.
+- Mỗi (user_id, timestamp entry, hash nội dung entry, action) chỉ lưu 1 lần
+  → ghi lại / backfill nhiều lần không tạo bản trùng, còn 2 entry khác nhau ghi
+  cùng 1 giây (timestamp chỉ chính xác tới giây) vẫn là 2 task riêng.
+-----------------------------------------
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from core.config import TASK_STORE_ENABLED, TASK_DB_PATH
+from core.history_store import ALL_USERS, get_history_store
+from core.todo_engine import extract_tasks_from_text, resolve_entry_deadline
+from core.utils import VN_TZ, file_lock
+
+TASK_STATUSES = ("open", "done", "dismissed")
+DUE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _epoch(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def entry_hash(entry: Dict[str, Any]) -> str:
+    """Hash nội dung entry – cùng timestamp + user, khác text → khác entry."""
+    return hashlib.sha1((entry.get("text") or "").encode("utf-8")).hexdigest()
+
+
+def entry_tasks(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Nhiệm vụ của 1 entry: dùng todo_candidates pipeline đã trích; entry cũ
+    (chưa có trường này) → trích lại từ text 1 lần.
+    """
+    if "todo_candidates" in entry:
+        return [t for t in entry.get("todo_candidates") or [] if t.get("action")]
+    return [
+        {
+            "action": t.action,
+            "description": t.description,
+            "confidence": t.confidence,
+            "context_tags": t.context_tags,
+            "deadline": t.deadline,
+        }
+        for t in extract_tasks_from_text(entry.get("text", ""))
+    ]
+
+
+class TaskStore:
+    """Bảng task SQLite (WAL), truy vấn theo khoảng due_at."""
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tasks ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " user_id TEXT NOT NULL DEFAULT '',"
+        " entry_timestamp TEXT NOT NULL DEFAULT '',"
+        " entry_hash TEXT NOT NULL DEFAULT '',"
+        " action TEXT NOT NULL,"
+        " description TEXT,"
+        " deadline TEXT,"
+        " due_at REAL,"
+        " confidence REAL,"
+        " context_tags TEXT,"
+        " source_text TEXT,"
+        " status TEXT NOT NULL DEFAULT 'open',"
+        " UNIQUE (user_id, entry_timestamp, entry_hash, action))",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status_due ON tasks (status, due_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user_status_due ON tasks (user_id, status, due_at)",
+        "CREATE TABLE IF NOT EXISTS task_meta ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT)",
+    )
+    _COLUMNS = ("id", "user_id", "entry_timestamp", "entry_hash", "action", "description", "deadline",
+                "due_at", "confidence", "context_tags", "source_text", "status")
+
+    def __init__(self, path: str = TASK_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        for statement in self._SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def _migrate(self) -> None:
+        """
+        Bảng cũ (UNIQUE theo user, timestamp, action – chưa có entry_hash) → dựng lại
+        bảng mới, giữ nguyên id / status, hash tính từ source_text (text của entry).
+        """
+        columns = [r[1] for r in self._db.execute("PRAGMA table_info(tasks)")]
+        if not columns or "entry_hash" in columns:
+            return
+        old_columns = [c for c in self._COLUMNS if c != "entry_hash"]
+        rows = self._db.execute(f"SELECT {', '.join(old_columns)} FROM tasks").fetchall()
+        source = old_columns.index("source_text")
+        self._db.execute("DROP TABLE tasks")
+        for statement in self._SCHEMA:
+            self._db.execute(statement)
+        self._db.executemany(
+            f"INSERT OR IGNORE INTO tasks ({', '.join(old_columns)}, entry_hash)"
+            f" VALUES ({', '.join('?' * (len(old_columns) + 1))})",
+            [(*row, entry_hash({"text": row[source]})) for row in rows],
+        )
+        self._db.commit()
+        print(f"🔧 Đã nâng cấp bảng task ({len(rows)} task) sang khoá có entry_hash")
+
+    @staticmethod
+    def _rows(entry: Dict[str, Any]) -> List[tuple]:
+        rows = []
+        for t in entry_tasks(entry):
+            deadline = t.get("deadline")
+            due = resolve_entry_deadline(deadline, entry.get("timestamp"))
+            rows.append((
+                entry.get("user_id") or "",
+                entry.get("timestamp") or "",
+                entry_hash(entry),
+                t["action"],
+                t.get("description"),
+                deadline,
+                _epoch(due),
+                t.get("confidence"),
+                json.dumps(t.get("context_tags") or [], ensure_ascii=False),
+                entry.get("text"),
+            ))
+        return rows
+
+    @classmethod
+    def _to_dict(cls, row: tuple) -> Dict[str, Any]:
+        task = dict(zip(cls._COLUMNS, row))
+        task["user_id"] = task["user_id"] or None
+        task["context_tags"] = json.loads(task["context_tags"] or "[]")
+        if task["due_at"] is not None:
+            task["due_at"] = datetime.fromtimestamp(task["due_at"], VN_TZ).strftime(DUE_FORMAT)
+        return task
+
+    def add_entries(self, entries: List[Dict[str, Any]], mark_built: bool = False) -> int:
+        """
+        Lưu nhiệm vụ của các entry (bỏ qua bản đã có). Trả về số task mới.
+        mark_built=True: đánh dấu đã backfill xong trong cùng transaction (xem built()).
+        """
+        rows = [row for entry in entries for row in self._rows(entry)]
+        if not rows and not mark_built:
+            return 0
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tasks (user_id, entry_timestamp, entry_hash, action, description,"
+                " deadline, due_at, confidence, context_tags, source_text)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            added = self._db.total_changes - before
+            if mark_built:
+                self._db.execute("INSERT OR REPLACE INTO task_meta (key, value) VALUES ('built', '1')")
+            self._db.commit()
+            return added
+
+    def built(self) -> bool:
+        """Đã backfill từ lịch sử chưa (file tạo bởi bản cũ, đã có task → coi như rồi)."""
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM task_meta WHERE key = 'built'").fetchone():
+                return True
+            return self._db.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is not None
+
+    def due_between(self, start=None, end=None, user_id: Any = ALL_USERS,
+                    status: Optional[str] = "open", limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Task có start <= due_at < end (datetime hoặc epoch, None = không chặn),
+        sắp theo due_at tăng dần. Task không có deadline không bao giờ khớp.
+        user_id: như history store – None → chỉ user ẩn danh, ALL_USERS (mặc định) → mọi user.
+        """
+        where, params = ["due_at IS NOT NULL"], []
+        if user_id is not ALL_USERS:
+            where.append("user_id = ?")
+            params.append(user_id or "")          # user ẩn danh được lưu là ''
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if start is not None:
+            where.append("due_at >= ?")
+            params.append(_epoch(start))
+        if end is not None:
+            where.append("due_at < ?")
+            params.append(_epoch(end))
+
+        sql = f"SELECT {', '.join(self._COLUMNS)} FROM tasks WHERE {' AND '.join(where)} ORDER BY due_at, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def set_status(self, task_id: int, status: str) -> None:
+        if status not in TASK_STATUSES:
+            raise ValueError(f"status '{status}' không hợp lệ, chọn một trong {TASK_STATUSES}.")
+        with self._lock:
+            self._db.execute("UPDATE tasks SET status = ? WHERE id = ?", (status, task_id))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def scan_due_between(entries: List[Dict[str, Any]], start=None, end=None, user_id: Any = ALL_USERS,
+                     limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Như TaskStore.due_between nhưng trích thẳng từ list entry (khi không có bảng task):
+    cùng dạng dict, cùng điều kiện start <= due_at < end, sắp theo due_at tăng dần.
+    Task chưa được lưu nên id = None, status = "open".
+    """
+    start, end = _epoch(start), _epoch(end)
+    seen, rows = set(), []
+    for entry in entries:
+        if user_id is not ALL_USERS and (entry.get("user_id") or None) != (user_id or None):
+            continue
+        for row in TaskStore._rows(entry):
+            due = row[6]
+            if due is None or (start is not None and due < start) or (end is not None and due >= end):
+                continue
+            key = row[:4]                      # như ràng buộc UNIQUE của bảng task
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append((None, *row, "open"))
+    rows.sort(key=lambda r: r[7])
+    if limit is not None:
+        rows = rows[:limit]
+    return [TaskStore._to_dict(r) for r in rows]
+
+
+# ============================================================
+# Store dùng chung cho toàn process
+# ============================================================
+_store: Optional[TaskStore] = None
+_store_lock = threading.Lock()
+
+
+def get_task_store() -> Optional[TaskStore]:
+    """
+    Bảng task dùng chung, hoặc None nếu TASK_STORE_ENABLED = False.
+    Chưa backfill → trích task từ lịch sử đang có 1 lần, trong file_lock(TASK_DB_PATH)
+    (worker khác chờ rồi dùng luôn); dựng dở (crash) thì lần mở sau dựng lại.
+    Có thể dựng trước bằng `python migrate_history.py --backfill`.
+    """
+    global _store
+    if not TASK_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                with file_lock(TASK_DB_PATH):
+                    store = TaskStore(TASK_DB_PATH)
+                    if not store.built():
+                        count = store.add_entries(get_history_store().load_all(), mark_built=True)
+                        if count:
+                            print(f"📋 Đã trích {count} nhiệm vụ từ lịch sử vào {TASK_DB_PATH}")
+                _store = store
+    return _store
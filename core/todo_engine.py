@@ -5,11 +5,19 @@
 #  - Dò deadline
 #  - Chuẩn bị dữ liệu cho Notification Engine
 # ============================================================
-from datetime import datetime, timedelta
+import calendar
+from datetime import date, datetime, time, timedelta
+import json
 import re
-from dataclasses import dataclass
+import threading
+import unicodedata
+from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 
+from core.config import TODO_RULES_PATH
+from core.history_store import ALL_USERS
+from core.utils import VN_TZ, parse_vn_timestamp
+
 
 # ============================================================
 # 1. DATA CLASS CHUẨN CHO 1 NHIỆM VỤ
@@ -21,60 +29,146 @@ class TodoCandidate:
     source_text: str           # câu user nói
     confidence: float          # độ tự tin rule-based
     context_tags: List[str]    # từ khóa
-    deadline: Optional[str] = None   # deadline dạng string (“mai”, “thứ 3”, …)
+    deadline: Optional[str] = None   # deadline dạng string (“mai”, “thứ 3”, “20/11”, …)
 
 
 # ============================================================
-# 2. TRÍCH NHIỆM VỤ TỪ TEXT (RULE-BASED)
+# 2. BỘ RULE TRÍCH NHIỆM VỤ (nạp từ TODO_RULES_PATH)
+# ------------------------------------------------------------
+# Keyword của mọi rule được gộp thành 1 regex dạng trie (keyword chung
+# tiền tố dùng chung nhánh), có ranh giới từ ("thi" không khớp "thích",
+# "thiết") → 1 lượt quét text tìm ra mọi rule khớp; thêm rule vào
+# danh mục gần như không làm chậm mỗi entry.
 # ============================================================
-def extract_tasks_from_text(text: str, context_tags: Optional[List[str]] = None) -> List[TodoCandidate]:
-    """
-    Rule-based V1 → chỉ để chạy ngay.
-    Sau này có thể nâng cấp bằng LLM.
-    """
-    text_low = text.lower()
-    cands: List[TodoCandidate] = []
-
-    # ---------- Rule 1: Thi cử ----------
-    if "thi" in text_low:
-        cands.append(
-            TodoCandidate(
-                action="Ôn bài thi",
-                description="Ôn 1 chương hoặc làm 1 đề ngắn.",
-                source_text=text,
-                confidence=0.7,
-                context_tags=(context_tags or []) + ["thi_cu"],
-                deadline=detect_deadline(text),
+@dataclass
+class TodoRule:
+    id: str
+    keywords: List[str]
+    action: str
+    description: str
+    confidence: float
+    tags: List[str] = field(default_factory=list)
+
+
+def _normalize_text(text: str) -> str:
+    """NFC + lower: gõ tiếng Việt dựng sẵn hay tổ hợp đều khớp như nhau."""
+    return unicodedata.normalize("NFC", text).lower()
+
+
+def _normalize_keyword(keyword: str) -> str:
+    return " ".join(_normalize_text(keyword).split())
+
+
+def _trie_pattern(keywords: List[str]) -> str:
+    """Gộp danh sách keyword thành 1 pattern regex dạng trie (khoảng trắng → \\s+)."""
+    trie: Dict[str, Any] = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [
+            (r"\s+" if ch == " " else re.escape(ch)) + build(child)
+            for ch, child in sorted(node.items()) if ch
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class TodoRuleSet:
+    """Bộ rule đã biên dịch: 1 regex gộp + bảng keyword → rule."""
+
+    def __init__(self, rules: List[TodoRule]):
+        self.rules = list(rules)
+        self._by_keyword: Dict[str, List[int]] = {}
+        for idx, rule in enumerate(self.rules):
+            for kw in rule.keywords:
+                kw = _normalize_keyword(kw)
+                if kw and idx not in self._by_keyword.get(kw, []):
+                    self._by_keyword.setdefault(kw, []).append(idx)
+        self._pattern = None
+        if self._by_keyword:
+            self._pattern = re.compile(
+                r"(?<!\w)(" + _trie_pattern(list(self._by_keyword)) + r")(?!\w)"
             )
-        )
 
-    # ---------- Rule 2: Thuyết trình ----------
-    if "slide" in text_low or "thuyết trình" in text_low or "presentation" in text_low:
-        cands.append(
-            TodoCandidate(
-                action="Làm slide thuyết trình",
-                description="Chuẩn bị dàn ý + intro.",
-                source_text=text,
-                confidence=0.75,
-                context_tags=(context_tags or []) + ["slide", "presentation"],
-                deadline=detect_deadline(text),
-            )
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def match(self, text: str) -> List[TodoRule]:
+        """Trả về các rule khớp text, theo thứ tự trong file rule."""
+        if self._pattern is None or not text:
+            return []
+        hit = set()
+        for m in self._pattern.finditer(_normalize_text(text)):
+            hit.update(self._by_keyword[" ".join(m.group(1).split())])
+        return [self.rules[i] for i in sorted(hit)]
+
+
+def load_todo_rules(path: str = TODO_RULES_PATH) -> TodoRuleSet:
+    """Đọc file rule JSON ({"rules": [...]}) → TodoRuleSet."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = [
+        TodoRule(
+            id=r["id"],
+            keywords=list(r["keywords"]),
+            action=r["action"],
+            description=r.get("description", ""),
+            confidence=float(r.get("confidence", 0.5)),
+            tags=list(r.get("tags", [])),
         )
+        for r in data.get("rules", [])
+    ]
+    return TodoRuleSet(rules)
+
+
+_rule_set: Optional[TodoRuleSet] = None
+_rule_set_lock = threading.Lock()
 
-    # ---------- Rule 3: Deadline ----------
-    if "deadline" in text_low or "nộp" in text_low:
-        cands.append(
-            TodoCandidate(
-                action="Hoàn thành bài tập/đồ án",
-                description="Làm 1 phần nhỏ trước.",
-                source_text=text,
-                confidence=0.8,
-                context_tags=(context_tags or []) + ["deadline"],
-                deadline=detect_deadline(text),
-            )
-        )
 
-    return cands
+def get_todo_rules() -> TodoRuleSet:
+    """Bộ rule dùng chung cho toàn process (nạp 1 lần)."""
+    global _rule_set
+    if _rule_set is None:
+        with _rule_set_lock:
+            if _rule_set is None:
+                _rule_set = load_todo_rules()
+    return _rule_set
+
+
+# ============================================================
+# 2b. TRÍCH NHIỆM VỤ TỪ TEXT (RULE-BASED)
+# ============================================================
+def extract_tasks_from_text(text: str, context_tags: Optional[List[str]] = None,
+                            rules: Optional[TodoRuleSet] = None) -> List[TodoCandidate]:
+    """
+    Khớp text với bộ rule trong 1 lượt, mỗi rule khớp → 1 TodoCandidate.
+    Deadline được dò 1 lần cho cả entry (không lặp lại theo từng rule).
+    Sau này có thể nâng cấp bằng LLM.
+    """
+    matched = (rules or get_todo_rules()).match(text)
+    if not matched:
+        return []
+
+    deadline = detect_deadline(text)
+    return [
+        TodoCandidate(
+            action=rule.action,
+            description=rule.description,
+            source_text=text,
+            confidence=rule.confidence,
+            context_tags=(context_tags or []) + list(rule.tags),
+            deadline=deadline,
+        )
+        for rule in matched
+    ]
 
 
 # ============================================================
@@ -89,142 +183,276 @@ def generate_gentle_question(task: TodoCandidate) -> str:
 
 
 # ============================================================
-# 4. PHÁT HIỆN DEADLINE ĐƠN GIẢN TỪ TEXT
+# 3b. TẠO KẾ HOẠCH TO-DO (khi user đồng ý)
+# ------------------------------------------------------------
+# Chia nhiệm vụ thành vài bước nhỏ cố định; có deadline → rải các bước
+# đều từ mốc neo tới deadline, không có → chỉ đánh số thứ tự.
 # ============================================================
-def detect_deadline(text: str) -> Optional[str]:
-    """
-    V1: Regex đơn giản để nhận diện các deadline gần.
-    """
-    t = text.lower()
+@dataclass
+class TodoPlan:
+    main_task: str             # nhiệm vụ chính (action của TodoCandidate)
+    subtasks: List[str]        # các bước nhỏ, theo thứ tự làm
+    deadline: Optional[str]    # deadline dạng chuẩn ("mai", "thứ 3", ...) hoặc None
+    timeline: List[str]        # mỗi bước kèm mốc thời gian gợi ý
 
-    if "mai" in t:
-        return "mai"
 
-    if "tối nay" in t or "hôm nay" in t:
-        return "hôm nay"
+def create_todo_plan(task: TodoCandidate, text: str, reference=None) -> TodoPlan:
+    """
+    Dựng kế hoạch cho `task`. Deadline lấy từ task, thiếu thì dò lại trong `text`;
+    `reference` là mốc neo như convert_deadline_to_datetime (None → bây giờ).
+    """
+    deadline = task.deadline or detect_deadline(text)
+    subtasks = [
+        f"Liệt kê những phần cần làm cho việc {task.action.lower()}",
+        "Làm phần quan trọng / khó nhất trước",
+        "Rà soát lại và hoàn thiện",
+    ]
+
+    start = _as_vn_datetime(reference)
+    due = convert_deadline_to_datetime(deadline, reference=start) if deadline else None
+    if due is not None and due > start:
+        step = (due - start) / len(subtasks)
+        timeline = [
+            f"Bước {i}: {sub} — trước {(start + step * i).strftime('%H:%M %d/%m')}"
+            for i, sub in enumerate(subtasks, start=1)
+        ]
+    else:
+        timeline = [f"Bước {i}: {sub}" for i, sub in enumerate(subtasks, start=1)]
+
+    return TodoPlan(main_task=task.action, subtasks=subtasks, deadline=deadline, timeline=timeline)
 
-    m = re.search(r"thứ\s*(\d+)", t)
-    if m:
-        return f"thứ {m.group(1)}"
 
+# ============================================================
+# 4. NGỮ PHÁP DEADLINE TIẾNG VIỆT
+# ------------------------------------------------------------
+# Mỗi rule: (regex, resolve(match, ngày gốc) → date | None, canonical(match) → str).
+# detect_deadline() trả dạng chuẩn ("mai", "thứ 3", "20/11", ...);
+# convert_deadline_to_datetime() chạy lại cùng ngữ pháp trên dạng chuẩn đó,
+# neo vào ngày viết entry → deadline là mốc tuyệt đối, không trôi theo lúc kiểm tra.
+# Thứ tự rule = độ ưu tiên (ngày cụ thể trước, "thứ 3 tuần sau" trước "tuần sau").
+# Mọi deadline hết hạn lúc 23:59 (giờ VN) của ngày đích.
+# ============================================================
+END_OF_DAY = time(23, 59)
+_WEEKDAY_WORDS = {"hai": 2, "ba": 3, "tư": 4, "bốn": 4, "năm": 5, "sáu": 6, "bảy": 7}
+
+
+def _date_or_none(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _end_of_week(ref: date, weeks: int = 0) -> date:
+    """Chủ nhật của tuần chứa ref (+ weeks tuần)."""
+    return ref + timedelta(days=6 - ref.weekday() + 7 * weeks)
+
+
+def _end_of_month(ref: date, months: int = 0) -> date:
+    year, month = divmod(ref.month - 1 + months, 12)
+    year, month = ref.year + year, month + 1
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _resolve_day_month(m, ref: date) -> Optional[date]:
+    day, month, year = int(m.group("d")), int(m.group("m")), m.group("y")
+    if year:
+        year = int(year)
+        return _date_or_none(year + 2000 if year < 100 else year, month, day)
+    d = _date_or_none(ref.year, month, day)
+    if d is not None and d < ref:
+        d = _date_or_none(ref.year + 1, month, day)   # "5/1" viết cuối tháng 12 → năm sau
+    return d
+
+
+def _canon_day_month(m) -> str:
+    y = m.group("y")
+    return f"{int(m.group('d'))}/{int(m.group('m'))}" + (f"/{y}" if y else "")
+
+
+def _weekday_index(m) -> int:
+    """weekday() đích: thứ 2 → 0 … thứ 7 → 5, chủ nhật → 6."""
+    if m.group("cn"):
+        return 6
+    n = m.group("n")
+    return (int(n) if n.isdigit() else _WEEKDAY_WORDS[n]) - 2
+
+
+def _resolve_weekday(m, ref: date) -> date:
+    target = _weekday_index(m)
+    if m.group("next"):
+        return ref + timedelta(days=7 - ref.weekday() + target)   # trong tuần sau (thứ 2 → CN)
+    diff = (target - ref.weekday()) % 7
+    return ref + timedelta(days=diff or 7)                         # trùng hôm nay → tuần sau
+
+
+def _canon_weekday(m) -> str:
+    target = _weekday_index(m)
+    name = "chủ nhật" if target == 6 else f"thứ {target + 2}"
+    return name + (" tuần sau" if m.group("next") else "")
+
+
+_W = r"(?<!\w)"
+_E = r"(?!\w)"
+_DEADLINE_RULES = [
+    (re.compile(r"(?<!\d)(?P<d>\d{1,2})\s*/\s*(?P<m>\d{1,2})(?:\s*/\s*(?P<y>\d{4}|\d{2}))?(?![\d/])"),
+     _resolve_day_month, _canon_day_month),
+    (re.compile(_W + r"ngày\s+(?P<d>\d{1,2})\s+tháng\s+(?P<m>\d{1,2})(?:\s+năm\s+(?P<y>\d{4}))?" + _E),
+     _resolve_day_month, _canon_day_month),
+    (re.compile(_W + r"(?:ngày\s+kia|(?:ngày\s+)?mốt)" + _E),
+     lambda m, ref: ref + timedelta(days=2), lambda m: "ngày kia"),
+    (re.compile(_W + r"(?:ngày\s+)?mai" + _E),
+     lambda m, ref: ref + timedelta(days=1), lambda m: "mai"),
+    (re.compile(_W + r"(?:hôm\s+nay|(?P<toi>tối)\s+nay|(?:sáng|trưa|chiều)\s+nay)" + _E),
+     lambda m, ref: ref, lambda m: "tối nay" if m.group("toi") else "hôm nay"),
+    (re.compile(_W + r"(?:thứ\s*(?P<n>[2-7]|hai|ba|tư|bốn|năm|sáu|bảy)|(?P<cn>chủ\s+nhật))"
+                r"(?P<next>\s+tuần\s+(?:sau|tới))?" + _E),
+     _resolve_weekday, _canon_weekday),
+    (re.compile(_W + r"cuối\s+tuần(?P<next>\s+(?:sau|tới))?" + _E),
+     lambda m, ref: _end_of_week(ref, 1 if m.group("next") else 0),
+     lambda m: "cuối tuần" + (" sau" if m.group("next") else "")),
+    (re.compile(_W + r"tuần\s+(?:(?P<this>này)|sau|tới)" + _E),
+     lambda m, ref: _end_of_week(ref, 0 if m.group("this") else 1),
+     lambda m: "tuần này" if m.group("this") else "tuần sau"),
+    (re.compile(_W + r"(?:cuối\s+)?tháng\s+(?P<next>sau|tới)" + _E),
+     lambda m, ref: _end_of_month(ref, 1), lambda m: "tháng sau"),
+    (re.compile(_W + r"(?:cuối\s+tháng|tháng\s+này)" + _E),
+     lambda m, ref: _end_of_month(ref), lambda m: "cuối tháng"),
+    (re.compile(_W + r"(?:(?P<k>\d{1,3})\s+ngày\s+nữa|trong\s+(?P<k2>\d{1,3})\s+ngày)" + _E),
+     lambda m, ref: ref + timedelta(days=int(m.group("k") or m.group("k2"))),
+     lambda m: f"{int(m.group('k') or m.group('k2'))} ngày nữa"),
+]
+
+
+def _as_vn_datetime(reference=None) -> datetime:
+    """Mốc neo: None → bây giờ; "YYYY-MM-DD HH:MM:SS" (timestamp entry) / datetime → giờ VN."""
+    if reference is None:
+        return datetime.now(VN_TZ)
+    if isinstance(reference, str):
+        return parse_vn_timestamp(reference)
+    if reference.tzinfo is None:
+        return reference.replace(tzinfo=VN_TZ)
+    return reference.astimezone(VN_TZ)
+
+
+def _match_deadline(text: str, ref: date):
+    """Rule đầu tiên khớp và cho ra ngày hợp lệ → (match, resolve, canonical)."""
+    for pattern, resolve, canonical in _DEADLINE_RULES:
+        for m in pattern.finditer(text):
+            if resolve(m, ref) is not None:
+                return m, resolve, canonical
     return None
 
 
 # ============================================================
-# 5. TỪ LỊCH SỬ (pipeline_history.json) → tìm nhiệm vụ sắp đến hạn
+# 4b. PHÁT HIỆN DEADLINE TỪ TEXT
 # ============================================================
-def get_upcoming_tasks(history: List[Dict[str, Any]]) -> List[TodoCandidate]:
+def detect_deadline(text: str) -> Optional[str]:
     """
-    Input: lịch sử pipeline (list dict)
-    Output: list nhiệm vụ có deadline (cho notification A,B,C,D)
+    Tìm deadline trong text, trả về dạng chuẩn (hoặc None):
+    "20/11", "20/11/2025", "ngày kia", "mai", "hôm nay", "tối nay",
+    "thứ 3", "chủ nhật", "thứ 5 tuần sau", "cuối tuần", "tuần này",
+    "tuần sau", "cuối tháng", "tháng sau", "3 ngày nữa".
     """
-    results: List[TodoCandidate] = []
-
-    for item in history:
-        text = item.get("text", "").lower()
+    found = _match_deadline(_normalize_text(text), datetime.now(VN_TZ).date())
+    if found is None:
+        return None
+    m, _, canonical = found
+    return canonical(m)
 
-        # → dùng lại extract_tasks_from_text
-        tasks = extract_tasks_from_text(text)
 
-        for t in tasks:
-            if t.deadline:       # chỉ lấy tasks có deadline
-                results.append(t)
-
-    return results
 # ============================================================
-# 6. TASK SẮP ĐẾN HẠN (Deadline Soon)
+# 5. TỪ LỊCH SỬ → tìm nhiệm vụ sắp đến hạn
+# ------------------------------------------------------------
+# Mặc định (history=None) đọc bảng task đã lưu sẵn lúc ghi entry
+# (core/task_store.py) → range query theo due_at.
+# Truyền `history` (list entry) → trích lại từ text từng entry
+# (dùng khi TASK_STORE_ENABLED = False / để test).
+# Cả 2 cách trả cùng 1 dạng: list dict task (có user_id, action, deadline,
+# due_at...) sắp theo due_at, cùng điều kiện thời gian.
 # ============================================================
-def get_tasks_due_soon(history, hours=24):
-    """
-    Tìm các task có deadline nằm trong vòng X giờ tới.
-    Vì deadline đang ở dạng 'mai', 'hôm nay', 'thứ 3',
-    ta convert về dạng datetime đơn giản.
-    """
-    results = []
-    now = datetime.now()
+def _task_store():
+    from core.task_store import get_task_store  # import lười: task_store import ngược todo_engine
+    return get_task_store()
 
-    for item in history:
-        text = item.get("text", "")
-        tasks = extract_tasks_from_text(text)
 
-        for t in tasks:
-            if not t.deadline:
-                continue
+def _due_between(history, **kwargs) -> List[Dict[str, Any]]:
+    if history is None:
+        store = _task_store()
+        if store is not None:
+            return store.due_between(**kwargs)
+        from core.history_store import get_history_store
+        history = get_history_store().load_all()
+    from core.task_store import scan_due_between
+    return scan_due_between(history, **kwargs)
 
-            # Convert deadline text -> datetime (version đơn giản)
-            dl = convert_deadline_to_datetime(t.deadline)
 
-            if dl is None:
-                continue
+def get_upcoming_tasks(history: Optional[List[Dict[str, Any]]] = None,
+                       user_id: Any = ALL_USERS) -> List[Dict[str, Any]]:
+    """
+    Input: lịch sử pipeline (list dict) hoặc None (đọc bảng task)
+    Output: nhiệm vụ có deadline chưa tới hạn (due_at >= now) của user
+    (None → user ẩn danh, mặc định ALL_USERS → mọi user)
+    """
+    return _due_between(history, start=datetime.now(VN_TZ), user_id=user_id)
 
-            diff_hours = (dl - now).total_seconds() / 3600
-            if 0 < diff_hours <= hours:
-                results.append(t)
 
-    return results
+# ============================================================
+# 6. TASK SẮP ĐẾN HẠN (Deadline Soon)
+# ============================================================
+def get_tasks_due_soon(history=None, hours=24, user_id=ALL_USERS):
+    """
+    Tìm các task có deadline nằm trong vòng X giờ tới.
+    Bảng task: 1 range query now <= due_at < now + hours.
+    """
+    now = datetime.now(VN_TZ)
+    return _due_between(history, start=now, end=now + timedelta(hours=hours), user_id=user_id)
 
 
 # ============================================================
 # 7. TASK ĐÃ QUÁ HẠN
 # ============================================================
-def get_overdue_tasks(history):
+def get_overdue_tasks(history=None, user_id=ALL_USERS):
     """
     Tìm các task đã quá hạn (deadline < now).
+    Bảng task: 1 range query due_at < now (chỉ task còn "open").
     """
-    results = []
-    now = datetime.now()
-
-    for item in history:
-        text = item.get("text", "")
-        tasks = extract_tasks_from_text(text)
-
-        for t in tasks:
-            if not t.deadline:
-                continue
-
-            dl = convert_deadline_to_datetime(t.deadline)
-
-            if dl is None:
-                continue
-
-            if dl < now:
-                results.append(t)
-
-    return results
+    return _due_between(history, end=datetime.now(VN_TZ), user_id=user_id)
 
 
 # ============================================================
 # 8. Chuyển deadline dạng chữ → datetime
 # ============================================================
-def convert_deadline_to_datetime(deadline_str: str):
+def convert_deadline_to_datetime(deadline_str: str, reference=None) -> Optional[datetime]:
     """
     Ví dụ:
-    - 'hôm nay'
-    - 'tối nay'
-    - 'mai'
-    - 'thứ 3'
-    
-    Convert sang datetime để so sánh deadline.
-    """
-    now = datetime.now()
-    dl = deadline_str.lower()
-
-    # hôm nay
-    if dl in ["hôm nay", "tối nay"]:
-        return now.replace(hour=23, minute=59, second=0)
-
-    # mai
-    if dl == "mai":
-        return now + timedelta(days=1)
-
-    # thứ X
-    m = re.search(r"thứ\\s*(\\d+)", dl)
-    if m:
-        target = int(m.group(1))
-        today = now.weekday() + 2  # weekday(): Mon=0 → Thứ 2=2
-        diff = (target - today) % 7
-        if diff == 0:
-            diff = 7
-        return now + timedelta(days=diff)
+    - 'hôm nay' / 'tối nay' → 23:59 ngày gốc
+    - 'mai'                 → 23:59 ngày gốc + 1
+    - 'thứ 3'               → 23:59 thứ 3 kế tiếp
+    - '20/11', 'cuối tháng', 'tuần sau', ... (xem _DEADLINE_RULES)
+
+    `reference` là mốc neo — nên truyền timestamp của entry ("YYYY-MM-DD HH:MM:SS",
+    giờ VN) để cùng 1 deadline luôn ra cùng 1 mốc; None → bây giờ.
+    Trả về datetime có múi giờ UTC+7, hoặc None nếu không hiểu deadline.
+    """
+    if not deadline_str:
+        return None
+    ref = _as_vn_datetime(reference).date()
+    found = _match_deadline(_normalize_text(deadline_str), ref)
+    if found is None:
+        return None
+    m, resolve, _ = found
+    return datetime.combine(resolve(m, ref), END_OF_DAY, tzinfo=VN_TZ)
 
-    return None
+
+def resolve_entry_deadline(deadline_str: Optional[str], entry_timestamp: Optional[str]) -> Optional[datetime]:
+    """
+    Deadline của 1 entry, neo vào timestamp của chính entry đó.
+    Entry không có / sai định dạng timestamp → neo vào bây giờ.
+    """
+    if not deadline_str:
+        return None
+    try:
+        return convert_deadline_to_datetime(deadline_str, reference=entry_timestamp or None)
+    except ValueError:
+        return convert_deadline_to_datetime(deadline_str)
@@ -8,14 +8,24 @@ Chứa các hàm tiện ích dùng chung giữa:
 Mục tiêu: tái sử dụng, tránh lặp code, dễ bảo trì.
 """
 
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 import json
 import os
 import re
-from typing import Any, Dict, List
+import tempfile
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Union
 import numpy as np
 import re
 
+# Khoá file giữa các process: fcntl (Linux/macOS) hoặc msvcrt (Windows)
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 def chunk_text(text, chunk_size=300):
     """
     Chia văn bản dài thành các đoạn nhỏ (chunk) theo câu, cụm ngữ nghĩa hoặc từ nối.
@@ -45,10 +55,19 @@ def chunk_text(text, chunk_size=300):
 # Lấy thời gian hiện tại theo múi giờ Việt Nam (UTC+7)
 # Dùng để gắn timestamp vào log, response, hoặc database.
 # ============================================================
+VN_TZ = timezone(timedelta(hours=7))
+VN_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
 def get_vn_timestamp() -> str:
     """Trả về timestamp giờ Việt Nam (ISO 8601 format)."""
     vn_time = datetime.now(timezone.utc) + timedelta(hours=7)
-    return vn_time.strftime("%Y-%m-%d %H:%M:%S")
+    return vn_time.strftime(VN_TIMESTAMP_FORMAT)
+
+
+def parse_vn_timestamp(timestamp: str) -> datetime:
+    """Ngược lại get_vn_timestamp(): "YYYY-MM-DD HH:MM:SS" → datetime có múi giờ UTC+7."""
+    return datetime.strptime(timestamp[:19], VN_TIMESTAMP_FORMAT).replace(tzinfo=VN_TZ)
 
 # ============================================================
 # 2. Hàm: append_jsonl()
@@ -56,15 +75,21 @@ def get_vn_timestamp() -> str:
 # Ghi thêm 1 dòng dữ liệu JSON vào file .jsonl
 # Dùng cho test log hoặc backend ghi log người dùng.
 # ============================================================
-def append_jsonl(path: str, data: Dict[str, Any]) -> None:
+def append_jsonl(path: str, data: Dict[str, Any], fsync: bool = False) -> None:
     """
     Ghi dữ liệu dạng JSON vào file .jsonl
-    Mỗi dòng = 1 JSON object.
+    Mỗi dòng = 1 JSON object, ghi bằng 1 lần write (không đọc lại file cũ).
+    fsync=True → ép dữ liệu xuống đĩa trước khi trả về (chậm hơn, không mất khi sập máy).
     """
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = json.dumps(data, ensure_ascii=False) + "\n"
     with open(path, "a", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False)
-        f.write("\n")
+        f.write(line)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
 
 # ============================================================
 #  3. Hàm: read_jsonl()
@@ -72,12 +97,26 @@ def append_jsonl(path: str, data: Dict[str, Any]) -> None:
 # Đọc toàn bộ dữ liệu từ file .jsonl -> list[dict]
 # Dùng trong analyze_logs.py hoặc dashboard backend.
 # ============================================================
-def read_jsonl(path: str) -> List[Dict[str, Any]]:
-    """Đọc toàn bộ file .jsonl, trả về danh sách các dict."""
+def read_jsonl(path: str, strict: bool = True) -> List[Dict[str, Any]]:
+    """
+    Đọc toàn bộ file .jsonl, trả về danh sách các dict.
+    strict=False → bỏ qua dòng hỏng (vd dòng cuối ghi dở khi process bị kill).
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"Không tìm thấy file log: {path}")
+    rows = []
     with open(path, "r", encoding="utf-8") as f:
-        return [json.loads(line.strip()) for line in f if line.strip()]
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                if strict:
+                    raise
+                print(f"⚠️ Bỏ qua dòng JSONL hỏng trong {path}")
+    return rows
 
 # ============================================================
 #  4. Hàm: clean_text()
@@ -116,6 +155,72 @@ def normalize_sentiment(label: str) -> str:
     }
     return mapping.get(label.strip().upper(), "neutral")
 
+# ============================================================
+#  5b. Lớp: ChunkMatrix / chunks_to_matrix()
+# ------------------------------------------------------------
+# Biểu diễn kết quả các chunk dưới dạng ma trận để các hàm aggregate_*
+# và detect_sentiment_case tính toán vector hoá (không lặp Python,
+# không tạo np.array cho từng chunk):
+#   - probs:   ma trận (n_chunks, 3) float64
+#   - lengths: vector (n_chunks,) độ dài chunk (trọng số)
+#   - labels:  nhãn từng chunk (mảng str)
+#   - has_connector: văn bản có từ nối đảo chiều hay không — quét text
+#     MỘT lần khi dựng ma trận, các bước sau không cần đọc lại text.
+# Mọi hàm aggregate_* / detect_sentiment_case nhận được cả list dict
+# (schema cũ) lẫn ChunkMatrix.
+# ============================================================
+SHIFT_CONNECTORS = ("nhưng", "tuy nhiên", "song", "trái lại", "mặc dù")
+
+
+class ChunkMatrix(NamedTuple):
+    probs: np.ndarray
+    lengths: np.ndarray
+    labels: np.ndarray
+    has_connector: bool = False
+
+
+def chunks_to_matrix(chunks: List[Dict[str, Any]]) -> ChunkMatrix:
+    """
+    Chuyển list chunk dict ({"text", "probs", "label", "length"}) → ChunkMatrix.
+    Thiếu "length" → dùng len(text); thiếu "label" → "unknown".
+    """
+    n = len(chunks)
+    probs = np.empty((n, 3), dtype=np.float64)
+    lengths = np.empty(n, dtype=np.float64)
+    labels = []
+    texts = []
+    for i, c in enumerate(chunks):
+        probs[i] = c["probs"]
+        text = c.get("text", "")
+        lengths[i] = c.get("length", len(text))
+        labels.append(c.get("label", "unknown"))
+        texts.append(text)
+    joined = " ".join(texts).lower()
+    return ChunkMatrix(
+        probs=probs,
+        lengths=lengths,
+        labels=np.asarray(labels, dtype=object),
+        has_connector=any(conn in joined for conn in SHIFT_CONNECTORS),
+    )
+
+
+def as_chunk_matrix(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]) -> ChunkMatrix:
+    """Nhận list chunk dict hoặc ChunkMatrix → luôn trả ChunkMatrix."""
+    if isinstance(chunks, ChunkMatrix):
+        return chunks
+    return chunks_to_matrix(chunks)
+
+
+def _weighted_mean(probs: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Trung bình có trọng số theo hàng: (w @ probs) / sum(w)."""
+    return weights @ probs / weights.sum()
+
+
+def _intensity(probs: np.ndarray) -> np.ndarray:
+    """Độ rõ nét từng chunk: I = max_prob - mean_prob (theo hàng)."""
+    return probs.max(axis=1) - probs.mean(axis=1)
+
+
 # ============================================================
 #  6. Hàm: aggregate_consistent()
 # ------------------------------------------------------------
@@ -123,7 +228,7 @@ def normalize_sentiment(label: str) -> str:
 #  Tính weighted mean theo độ dài chunk
 #Ví dụ Có 2 chunk cùng positive [0.8, 0.9] → pos≈0.85
 # ============================================================
-def aggregate_consistent(chunks: List[Dict[str, Any]]) -> np.ndarray:
+def aggregate_consistent(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]) -> np.ndarray:
     """
     ✅ Định nghĩa:
         Khi các chunk đều có cảm xúc cùng hướng (đều pos hoặc neg).
@@ -136,12 +241,8 @@ def aggregate_consistent(chunks: List[Dict[str, Any]]) -> np.ndarray:
     📘 Ví dụ:
         [pos=0.8, pos=0.9] → pos≈0.85
     """
-    total_weight, weighted_probs = 0, np.zeros(3)
-    for c in chunks:
-        w = c["length"]
-        weighted_probs += np.array(c["probs"]) * w
-        total_weight += w
-    return weighted_probs / total_weight
+    m = as_chunk_matrix(chunks)
+    return _weighted_mean(m.probs, m.lengths)
 
 
 # ============================================================
@@ -167,7 +268,7 @@ def aggregate_consistent(chunks: List[Dict[str, Any]]) -> np.ndarray:
 #neu = (0.2 * 29.334 + 0.1 * 42) / 71.334 = 0.147
 #neg = (0.1 * 29.334 + 0.6 * 42) / 71.334 = 0.366
 # ============================================================
-def aggregate_mild_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
+def aggregate_mild_shift(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]) -> np.ndarray:
     """
     ✅ Định nghĩa:
         Khi cảm xúc lệch nhẹ, không đảo cực.
@@ -179,14 +280,8 @@ def aggregate_mild_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
     🎯 Output:
         Cảm xúc nghiêng nhẹ về phía mạnh hơn.
     """
-    total_weight, weighted_probs = 0, np.zeros(3)
-    for c in chunks:
-        probs = np.array(c["probs"])
-        intensity = np.max(probs) - np.mean(probs)
-        w = c["length"] * (1 + intensity)
-        weighted_probs += probs * w
-        total_weight += w
-    return weighted_probs / total_weight
+    m = as_chunk_matrix(chunks)
+    return _weighted_mean(m.probs, m.lengths * (1 + _intensity(m.probs)))
 
 
 # ============================================================
@@ -200,7 +295,7 @@ def aggregate_mild_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
 #Suy ra probs của VD:
 #probs = [0.1, 0.1, 0.8]
 # ============================================================
-def aggregate_polarity_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
+def aggregate_polarity_shift(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]) -> np.ndarray:
     """
     ✅ Định nghĩa:
         Khi cảm xúc đảo cực rõ (vui rồi buồn).
@@ -212,7 +307,7 @@ def aggregate_polarity_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
     🎯 Output:
         Cảm xúc chính (label chunk cuối).
     """
-    return chunks[-1]["probs"]
+    return as_chunk_matrix(chunks).probs[-1].copy()
 
 
 # ============================================================
@@ -226,7 +321,7 @@ def aggregate_polarity_shift(chunks: List[Dict[str, Any]]) -> np.ndarray:
 #Tính probs của VD:
 #probs = [0.33, 0.34, 0.33]
 # ============================================================
-def aggregate_uncertain(chunks: List[Dict[str, Any]]):
+def aggregate_uncertain(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]):
     """
     ✅ Định nghĩa:
         Khi xác suất các nhãn gần nhau.
@@ -252,7 +347,7 @@ def aggregate_uncertain(chunks: List[Dict[str, Any]]):
 #Tính probs của VD: ( Cách tính tương tự aggregate_consistent)
 #probs = [0.45, 0.15, 0.4]
 # ============================================================
-def aggregate_multi_sentiment(chunks: List[Dict[str, Any]]):
+def aggregate_multi_sentiment(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]):
     """
     ✅ Định nghĩa:
         Có >=2 cảm xúc mạnh độc lập, không phủ định nhau.
@@ -263,13 +358,8 @@ def aggregate_multi_sentiment(chunks: List[Dict[str, Any]]):
     🎯 Output:
         (avg_probs, "mixed_sentiment")
     """
-    total_weight, weighted_probs = 0, np.zeros(3)
-    for c in chunks:
-        w = c["length"]
-        weighted_probs += np.array(c["probs"]) * w
-        total_weight += w
-    avg_probs = weighted_probs / total_weight
-    return avg_probs, "mixed_sentiment"
+    m = as_chunk_matrix(chunks)
+    return _weighted_mean(m.probs, m.lengths), "mixed_sentiment"
 # ============================================================
 # 11. Hàm: detect_sentiment_case()
 # ------------------------------------------------------------
@@ -282,7 +372,7 @@ def aggregate_multi_sentiment(chunks: List[Dict[str, Any]]):
 #   - multi_sentiment
 # ============================================================
 
-def detect_sentiment_case(chunks: list) -> str:
+def detect_sentiment_case(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]) -> str:
     """
     ✅ Mục đích:
         Tự động xác định loại cảm xúc của văn bản dựa trên kết quả các chunk.
@@ -292,6 +382,7 @@ def detect_sentiment_case(chunks: list) -> str:
             {"text": "Hôm nay tôi rất vui", "probs": [0.82, 0.12, 0.06], "label": "positive", "length": 12},
             {"text": "nhưng tôi không về nhà nên hơi nhớ mẹ", "probs": [0.08, 0.20, 0.72], "label": "negative", "length": 29}
         ]
+        hoặc ChunkMatrix (xem chunks_to_matrix) — khi đó không quét lại text.
 
     ✅ Output:
         "consistent", "mild_shift", "polarity_shift", "uncertain", hoặc "multi_sentiment"
@@ -323,35 +414,286 @@ def detect_sentiment_case(chunks: list) -> str:
     ------------------------------------------------------------
     """
 
-    # ---- Tiền xử lý
-    labels = [c["label"] for c in chunks]
-    probs = [c["probs"] for c in chunks]
-    texts = " ".join([c["text"] for c in chunks]).lower()
+    # ---- Tiền xử lý (ma trận (n, 3) + nhãn + cờ từ nối)
+    m = as_chunk_matrix(chunks)
+    probs, labels = m.probs, m.labels
+    label_set = set(labels)
 
-    # ---- 1. Trường hợp uncertain
-    def is_uncertain_chunk(p):
-        sorted_p = sorted(p, reverse=True)
-        return (sorted_p[0] - sorted_p[1]) < 0.1
-    if all(is_uncertain_chunk(p) for p in probs):
+    # ---- 1. Trường hợp uncertain: top1 - top2 < 0.1 ở mọi chunk
+    top2 = np.partition(probs, -2, axis=1)[:, -2:]
+    if np.all(top2[:, 1] - top2[:, 0] < 0.1):
         return "uncertain"
 
     # ---- 2. Trường hợp consistent
-    if len(set(labels)) == 1:
+    if len(label_set) == 1:
         return "consistent"
 
     # ---- 3. Trường hợp polarity shift
-    connectors = ["nhưng", "tuy nhiên", "song", "trái lại", "mặc dù"]
-    if any(conn in texts for conn in connectors):
+    if m.has_connector:
         if labels[0] != labels[-1] and (
-            ("positive" in labels and "negative" in labels)
+            ("positive" in label_set and "negative" in label_set)
         ):
             return "polarity_shift"
 
     # ---- 4. Trường hợp multi_sentiment
-    strong_chunks = [c for c in chunks if max(c["probs"]) > 0.6]
-    strong_labels = list({c["label"] for c in strong_chunks})
+    strong_labels = set(labels[probs.max(axis=1) > 0.6])
     if len(strong_labels) >= 2:
         return "multi_sentiment"
 
     # ---- 5. Trường hợp mild_shift
-    return "mild_shift"
\ No newline at end of file
+    return "mild_shift"
+
+# ============================================================
+# 11b. Hàm: stack_chunk_matrices() / aggregate_batch()
+# ------------------------------------------------------------
+# Cho job phân tích lại (re-analysis) nhiều entry một lượt:
+# xếp chồng chunk của mọi entry thành 1 ma trận (N_chunks, 3) + vector
+# counts (số chunk mỗi entry), rồi gộp bằng np.add.reduceat → 1 lần
+# gọi numpy cho cả batch thay vì lặp từng entry.
+# ============================================================
+AGGREGATE_STRATEGIES = ("consistent", "mild_shift", "polarity_shift", "uncertain", "multi_sentiment")
+
+
+def stack_chunk_matrices(entries: Sequence[Union[ChunkMatrix, List[Dict[str, Any]]]]):
+    """
+    Xếp chồng chunk của nhiều entry.
+    Returns:
+        (probs (N, 3), lengths (N,), counts (n_entries,))
+    """
+    matrices = [as_chunk_matrix(e) for e in entries]
+    counts = np.fromiter((len(m.lengths) for m in matrices), dtype=np.intp, count=len(matrices))
+    if np.any(counts == 0):
+        raise ValueError("Mỗi entry phải có ít nhất 1 chunk")
+    if not matrices:
+        return np.empty((0, 3)), np.empty(0), counts
+    probs = np.concatenate([m.probs for m in matrices])
+    lengths = np.concatenate([m.lengths for m in matrices])
+    return probs, lengths, counts
+
+
+def aggregate_batch(probs: np.ndarray, lengths: np.ndarray, counts: np.ndarray,
+                    strategy: str = "consistent") -> np.ndarray:
+    """
+    Gộp nhiều entry cùng lúc theo 1 chiến lược aggregate_*.
+    Args:
+        probs:   (N, 3) xác suất mọi chunk của mọi entry, xếp liền nhau
+        lengths: (N,) độ dài chunk
+        counts:  (n_entries,) số chunk của từng entry (> 0)
+        strategy: một trong AGGREGATE_STRATEGIES
+    Returns:
+        Ma trận (n_entries, 3) — hàng i trùng với aggregate_<strategy>(entry i).
+    """
+    if strategy not in AGGREGATE_STRATEGIES:
+        raise ValueError(f"strategy không hợp lệ: {strategy}")
+    counts = np.asarray(counts, dtype=np.intp)
+    if counts.size == 0:
+        return np.empty((0, 3))
+    ends = np.cumsum(counts)
+
+    if strategy == "polarity_shift":
+        return probs[ends - 1].copy()
+    if strategy == "uncertain":
+        return np.tile([0.33, 0.34, 0.33], (counts.size, 1))
+
+    weights = np.asarray(lengths, dtype=np.float64)
+    if strategy == "mild_shift":
+        weights = weights * (1 + _intensity(probs))
+    starts = ends - counts
+    sums = np.add.reduceat(probs * weights[:, None], starts, axis=0)
+    return sums / np.add.reduceat(weights, starts)[:, None]
+
+
+# ============================================================
+# 11c. Hàm: aggregate_by_case() / aggregate_by_case_batch()
+# ------------------------------------------------------------
+# Lớp dispatch: nhận diện case rồi gộp bằng đúng hàm aggregate_* của
+# case đó, trên cùng 1 ChunkMatrix (không quét lại text tìm từ nối).
+# ============================================================
+CASE_AGGREGATORS = {
+    "consistent": aggregate_consistent,
+    "mild_shift": aggregate_mild_shift,
+    "polarity_shift": aggregate_polarity_shift,
+    "uncertain": aggregate_uncertain,
+    "multi_sentiment": aggregate_multi_sentiment,
+}
+
+
+def aggregate_by_case(chunks: Union[ChunkMatrix, List[Dict[str, Any]]]):
+    """
+    Returns:
+        (probs (3,), case_type, flag) — flag là "uncertain" / "mixed_sentiment" hoặc None.
+    """
+    m = as_chunk_matrix(chunks)
+    case_type = detect_sentiment_case(m)
+    result = CASE_AGGREGATORS[case_type](m)
+    if isinstance(result, tuple):
+        probs, flag = result
+    else:
+        probs, flag = result, None
+    return np.asarray(probs, dtype=np.float64), case_type, flag
+
+
+def aggregate_by_case_batch(entries: Sequence[Union[ChunkMatrix, List[Dict[str, Any]]]]):
+    """
+    Bản batch của aggregate_by_case cho job phân tích lại: nhận diện case
+    từng entry, rồi gộp mỗi nhóm case bằng 1 lần aggregate_batch.
+    Returns:
+        (probs (n_entries, 3), case_types list[str])
+    """
+    matrices = [as_chunk_matrix(e) for e in entries]
+    case_types = [detect_sentiment_case(m) for m in matrices]
+    probs, lengths, counts = stack_chunk_matrices(matrices)
+    out = np.empty((len(matrices), 3))
+    if not matrices:
+        return out, case_types
+
+    starts = np.cumsum(counts) - counts
+    cases = np.asarray(case_types)
+    for case_type in set(case_types):
+        idx = np.flatnonzero(cases == case_type)
+        rows = np.concatenate([np.arange(starts[i], starts[i] + counts[i]) for i in idx])
+        strategy = "consistent" if case_type == "multi_sentiment" else case_type
+        out[idx] = aggregate_batch(probs[rows], lengths[rows], counts[idx], strategy)
+    return out, case_types
+
+
+# ============================================================
+# 12. Lớp: ResponseFieldStreamer
+# ------------------------------------------------------------
+# Khi stream output của LLM dạng {"response": "...", "topic": "..."},
+# chỉ đẩy ra phần nội dung của trường "response" (đã bỏ escape) để hiển thị
+# ngay cho user; phần JSON/topic vẫn được parse đầy đủ ở cuối.
+# Nếu model trả text thường (không phải JSON) → đẩy nguyên văn.
+# ============================================================
+class ResponseFieldStreamer:
+    """
+    Bộ tách tăng dần nội dung trường "response" từ một chuỗi JSON đang stream.
+
+    ✅ Ví dụ:
+        s = ResponseFieldStreamer()
+        s.feed('{"respon')            → ""
+        s.feed('se": "Chào cậu')      → "Chào cậu"
+        s.feed('!", "topic": "Khác"}') → "!"
+    """
+
+    _KEY_RE = re.compile(r'"?response"?\s*:\s*"')
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0          # vị trí đã xử lý trong buffer
+        self._mode = None      # None (chưa rõ) | "plain" | "json"
+        self._in_value = False
+        self._done = False
+
+    def feed(self, delta: str) -> str:
+        """Nhận thêm 1 đoạn text, trả về phần nội dung "response" mới (có thể rỗng)."""
+        self._buffer += delta
+
+        if self._mode is None:
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                return ""
+            self._mode = "json" if stripped[0] in "{`" else "plain"
+
+        if self._mode == "plain":
+            out = self._buffer[self._pos:]
+            self._pos = len(self._buffer)
+            return out
+
+        if self._done:
+            return ""
+
+        if not self._in_value:
+            m = self._KEY_RE.search(self._buffer, self._pos)
+            if not m:
+                return ""
+            self._in_value = True
+            self._pos = m.end()
+
+        out = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == "\\":
+                if i + 1 >= len(buf):
+                    break  # chờ thêm dữ liệu
+                nxt = buf[i + 1]
+                if nxt == "u":
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        out.append(chr(int(buf[i + 2:i + 6], 16)))
+                    except ValueError:
+                        out.append(buf[i:i + 6])
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(nxt, nxt))
+                i += 2
+                continue
+            if ch == '"':
+                self._done = True
+                i += 1
+                break
+            out.append(ch)
+            i += 1
+
+        self._pos = i
+        return "".join(out)
+
+# ============================================================
+# 13. Hàm: file_lock() / atomic_write_json()
+# ------------------------------------------------------------
+# Khoá file giữa nhiều process (nhiều worker gunicorn/uvicorn cùng ghi 1 file)
+# và ghi JSON theo kiểu file tạm → fsync → os.replace (không bao giờ để lại file dở).
+# ============================================================
+@contextmanager
+def file_lock(path: str, sidecar: bool = True):
+    """
+    Giữ khoá độc quyền trong khối with.
+    - sidecar=True: khoá file riêng `path + ".lock"` (dùng khi file chính bị thay bằng os.replace).
+    - sidecar=False: khoá thẳng file `path` (file chỉ append, không sinh thêm file .lock);
+      trên Windows vẫn dùng file .lock vì msvcrt khoá cứng cả việc đọc.
+    Linux/macOS dùng fcntl.flock, Windows dùng msvcrt.locking (chờ đến khi lấy được khoá).
+    Yield file object đang giữ khoá.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_path = path if (not sidecar and fcntl is not None) else path + ".lock"
+    with open(lock_path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield lock_file
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2) -> None:
+    """Ghi JSON ra file tạm cùng thư mục, fsync rồi os.replace → file đích luôn nguyên vẹn."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
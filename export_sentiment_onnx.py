@@ -0,0 +1,87 @@
+# Tên file: export_sentiment_onnx.py
+"""
+Xuất model sentiment PhoBERT (SENTIMENT_MODEL_NAME) sang ONNX + lượng tử hoá động int8.
+
+Kết quả (thư mục --output, mặc định SENTIMENT_ONNX_MODEL_DIR):
+    model.onnx          – bản fp32
+    model.int8.onnx     – bản int8 (dynamic quantization) dùng cho SENTIMENT_BACKEND=onnx
+    tokenizer + config.json (id2label) để OnnxSentimentBackend dùng lại
+
+Chạy:
+    python export_sentiment_onnx.py --model models/my-phobert-sentiment-v2
+    python export_sentiment_onnx.py --model Zonecb/my-phobert-sentiment-v2 --output models/my-phobert-sentiment-v2-onnx
+
+Cần: torch, transformers, onnx, onnxruntime.
+"""
+
+import argparse
+import os
+
+from core.config import (
+    SENTIMENT_LOCAL_MODEL_PATH,
+    SENTIMENT_MODEL_NAME,
+    SENTIMENT_ONNX_MODEL_DIR,
+    SENTIMENT_ONNX_FILE,
+)
+
+OPSET = 17
+
+
+def export(model_path: str, output_dir: str, quantized_name: str = SENTIMENT_ONNX_FILE) -> str:
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    int8_path = os.path.join(output_dir, quantized_name)
+
+    print(f"Đang load model từ {model_path}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path)
+    model.eval()
+
+    # Batch + độ dài câu động → 1 file ONNX dùng cho mọi kích thước batch
+    sample = tokenizer(["Hôm nay mình hơi mệt", "vui"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    print(f"Đang export ONNX (opset {OPSET}) → {fp32_path}")
+    export_kwargs = dict(
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=OPSET,
+    )
+    try:
+        torch.onnx.export(model, tuple(sample[n] for n in input_names), fp32_path,
+                          dynamo=False, **export_kwargs)
+    except TypeError:
+        # torch cũ chưa có tham số dynamo
+        torch.onnx.export(model, tuple(sample[n] for n in input_names), fp32_path, **export_kwargs)
+
+    print(f"Đang lượng tử hoá int8 → {int8_path}")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+    # Tokenizer + config (id2label) cạnh file ONNX
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+    size_fp32 = os.path.getsize(fp32_path) / 1e6
+    size_int8 = os.path.getsize(int8_path) / 1e6
+    print(f"✅ Xong: fp32 {size_fp32:.1f} MB → int8 {size_int8:.1f} MB")
+    return int8_path
+
+
+def main():
+    default_model = SENTIMENT_LOCAL_MODEL_PATH if os.path.isdir(SENTIMENT_LOCAL_MODEL_PATH) else SENTIMENT_MODEL_NAME
+    parser = argparse.ArgumentParser(description="Export PhoBERT sentiment sang ONNX int8")
+    parser.add_argument("--model", default=default_model, help="Thư mục model hoặc tên trên Hugging Face Hub")
+    parser.add_argument("--output", default=SENTIMENT_ONNX_MODEL_DIR, help="Thư mục xuất ONNX")
+    args = parser.parse_args()
+    export(args.model, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Tên file: migrate_history.py
+"""
+Chuyển lịch sử từ pipeline_history.json (mảng JSON) sang backend mới:
+    - jsonl : pipeline_history.jsonl (mỗi dòng 1 bản ghi) – HISTORY_BACKEND=jsonl
+    - users : pipeline_history_users/ (mỗi user 1 file) – HISTORY_BACKEND=jsonl + HISTORY_PARTITION_BY_USER
+    - sqlite: pipeline_history.sqlite3 (WAL + index)     – HISTORY_BACKEND=sqlite
+      (với users / sqlite, nguồn có thể là file .json hoặc .jsonl)
+
+Chạy:
+    python migrate_history.py
+    python migrate_history.py --to sqlite --source pipeline_history.jsonl
+    python migrate_history.py --to users --source pipeline_history.jsonl
+    python migrate_history.py --source pipeline_history.json --dest pipeline_history.jsonl --force
+    python migrate_history.py --replay-dead-letters   # ghi lại các lô write-behind đã lỗi
+    python migrate_history.py --backfill              # dựng sẵn các tầng phụ đang bật (embedding, rollup, task)
+"""
+
+import argparse
+import os
+
+from core.config import (
+    HISTORY_DB_PATH,
+    HISTORY_DEAD_LETTER_PATH,
+    HISTORY_JSONL_PATH,
+    HISTORY_ROLLUPS_ENABLED,
+    HISTORY_SEMANTIC_CONTEXT,
+    HISTORY_SQLITE_PATH,
+    HISTORY_USER_DIR,
+    TASK_STORE_ENABLED,
+)
+from core.history_store import migrate_json_to_jsonl, migrate_to_sqlite, migrate_to_user_partitions
+
+
+def backfill():
+    """
+    Dựng sẵn các tầng phụ đang bật từ lịch sử hiện có (mỗi tầng chỉ dựng khi còn trống),
+    để request đầu tiên sau khi bật không phải tự backfill.
+    """
+    if HISTORY_SEMANTIC_CONTEXT:
+        from core.history_embeddings import get_embedding_index
+        print(f"🧭 Index embedding: {len(get_embedding_index())} entry")
+    else:
+        print("⏭️ HISTORY_SEMANTIC_CONTEXT tắt → bỏ qua index embedding")
+
+    if HISTORY_ROLLUPS_ENABLED:
+        from core.history_rollups import get_mood_rollups
+        get_mood_rollups()
+        print("📊 Rollup mood đã sẵn sàng")
+    else:
+        print("⏭️ HISTORY_ROLLUPS_ENABLED tắt → bỏ qua rollup mood")
+
+    if TASK_STORE_ENABLED:
+        from core.task_store import get_task_store
+        get_task_store()
+        print("📋 Bảng nhiệm vụ đã sẵn sàng")
+    else:
+        print("⏭️ TASK_STORE_ENABLED tắt → bỏ qua bảng nhiệm vụ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate lịch sử JSON → JSONL / SQLite")
+    parser.add_argument("--to", choices=["jsonl", "users", "sqlite"], default="jsonl", help="Backend đích")
+    parser.add_argument("--source", default=HISTORY_DB_PATH, help="File lịch sử nguồn")
+    parser.add_argument("--dest", default=None, help="File đích (mặc định theo config)")
+    parser.add_argument("--force", action="store_true", help="Ghi đè file đích nếu đã tồn tại")
+    parser.add_argument("--replay-dead-letters", action="store_true",
+                        help=f"Ghi lại các bản ghi trong {HISTORY_DEAD_LETTER_PATH} vào lịch sử")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Dựng sẵn các tầng phụ đang bật (embedding, rollup, task) từ lịch sử hiện có")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill()
+        return
+
+    if args.replay_dead_letters:
+        from core.history_writer import replay_dead_letters
+        count = replay_dead_letters()
+        print(f"✅ Đã ghi lại {count} bản ghi từ {HISTORY_DEAD_LETTER_PATH}")
+        return
+
+    if args.to == "sqlite":
+        dest = args.dest or HISTORY_SQLITE_PATH
+        count = migrate_to_sqlite(args.source, dest, overwrite=args.force)
+    elif args.to == "users":
+        dest = args.dest or HISTORY_USER_DIR
+        if os.path.isdir(dest) and os.listdir(dest) and not args.force:
+            raise SystemExit(f"{dest}/ đã có dữ liệu (dùng --force để ghi thêm vào).")
+        count = migrate_to_user_partitions(args.source, dest)
+    else:
+        dest = args.dest or HISTORY_JSONL_PATH
+        count = migrate_json_to_jsonl(args.source, dest, overwrite=args.force)
+    print(f"✅ Đã chuyển {count} bản ghi: {args.source} → {dest}")
+
+
+if __name__ == "__main__":
+    main()
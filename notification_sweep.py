@@ -0,0 +1,33 @@
+# Tên file: notification_sweep.py
+"""
+Sweep thông báo cho mọi user (chạy định kỳ, vd cron mỗi 5 phút):
+    - Đọc lịch sử 1 lần, lấy task sắp đến hạn / quá hạn bằng range query
+    - Xét A → B → C → D cho từng user, mỗi user tối đa 1 thông báo (có chống spam)
+    - Ghi cả lô thông báo vào outbox (JSONL) để bên gửi push / email lấy đi
+
+Chạy:
+    python notification_sweep.py
+    python notification_sweep.py --budget 30 --outbox notification_outbox.jsonl
+"""
+
+import argparse
+
+from core.config import NOTIFICATION_SWEEP_BUDGET_SECONDS, NOTIFICATION_STATE_PATH, NOTIFICATION_OUTBOX_PATH
+from core.notification_engine import emit_notifications, sweep_notifications
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep thông báo cho mọi user")
+    parser.add_argument("--budget", type=float, default=NOTIFICATION_SWEEP_BUDGET_SECONDS,
+                        help="Thời gian tối đa (giây) cho 1 lượt sweep")
+    parser.add_argument("--state", default=NOTIFICATION_STATE_PATH, help="File trạng thái (chống spam, con trỏ vòng)")
+    parser.add_argument("--outbox", default=NOTIFICATION_OUTBOX_PATH, help="File JSONL nhận thông báo")
+    args = parser.parse_args()
+
+    notifications = sweep_notifications(time_budget_seconds=args.budget, state_path=args.state)
+    count = emit_notifications(notifications, args.outbox)
+    print(f"✅ Đã ghi {count} thông báo vào {args.outbox}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,18 @@ import pytest
 # Thêm đường dẫn để import core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from core.hf_client import query_model
+from core.hf_client import query_model, query_sentiment_batch, query_sentiment_concurrent
+from core.sentiment_cache import get_sentiment_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_sentiment_cache(monkeypatch):
+    """Mỗi test bắt đầu với cache sentiment rỗng và chưa biết Space có endpoint batch hay không."""
+    import core.hf_client as hf
+    monkeypatch.setattr(hf, "_batch_endpoint_unsupported", False)
+    cache = get_sentiment_cache()
+    if cache is not None:
+        cache.clear()
 
 
 # --- TEST 1: Sentiment model ---
@@ -24,7 +35,7 @@ def test_sentiment_model(monkeypatch):
         def json(self):
             return {"predicted_label": "positive", "raw_logits": [[-0.5, 0.2, 2.3]]}
 
-    monkeypatch.setattr(requests, "post", lambda *a, **k: MockResponse())
+    monkeypatch.setattr(requests.Session, "post", lambda self, *a, **k: MockResponse())
 
     result = query_model("sentiment", "Hôm nay tôi rất vui!")
 
@@ -63,6 +74,337 @@ def test_invalid_model():
     print("\n[TEST INVALID]", result)
 
 
+# --- TEST 4: Sentiment batch ---
+def test_sentiment_batch(monkeypatch):
+    """Giả lập endpoint batch: 1 request cho nhiều chunk, giữ đúng thứ tự kết quả."""
+    import requests
+    calls = []
+
+    class MockResponse:
+        status_code = 200
+        def __init__(self, texts):
+            self.texts = texts
+        def raise_for_status(self): pass
+        def json(self):
+            return {"results": [
+                {"raw_logits": [2.0, 0.1, -1.0]} if "buồn" in t else {"raw_logits": [-1.0, 0.1, 2.0]}
+                for t in self.texts
+            ]}
+
+    def mock_post(self, url, json=None, **k):
+        calls.append(url)
+        return MockResponse(json["texts"])
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+
+    results = query_sentiment_batch(["Hôm nay buồn quá", "Mình vui lắm"])
+
+    assert len(calls) == 1
+    assert [r["predicted_label"] for r in results] == ["negative", "positive"]
+    assert all(len(r["probs"]) == 3 for r in results)
+    assert abs(sum(results[0]["probs"]) - 1) < 1e-6
+
+
+# --- TEST 5: Sentiment batch fallback khi Space chưa có endpoint batch ---
+def test_sentiment_batch_fallback(monkeypatch):
+    """Endpoint batch trả 404 → gọi lần lượt từng text qua /predict."""
+    import requests
+    from core.config import SENTIMENT_BATCH_API_URL
+
+    class MockResponse:
+        def __init__(self, status_code, payload=None):
+            self.status_code = status_code
+            self.payload = payload
+        def raise_for_status(self): pass
+        def json(self):
+            return self.payload
+
+    def mock_post(self, url, **k):
+        if url == SENTIMENT_BATCH_API_URL:
+            return MockResponse(404)
+        return MockResponse(200, {"raw_logits": [0.0, 3.0, 0.0]})
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+
+    results = query_sentiment_batch(["a", "b", "c"])
+    assert [r["predicted_label"] for r in results] == ["neutral"] * 3
+
+    # Đã biết endpoint batch không có → lần sau không gửi thử lại nữa
+    batch_calls = []
+    monkeypatch.setattr(requests.Session, "post",
+                        lambda self, url, **k: batch_calls.append(url) or mock_post(self, url, **k))
+    assert [r["predicted_label"] for r in query_sentiment_batch(["d", "e"])] == ["neutral"] * 2
+    assert SENTIMENT_BATCH_API_URL not in batch_calls and len(batch_calls) == 2
+
+
+# --- TEST 6: Session dùng chung ---
+def test_http_session_is_shared():
+    """Mọi lời gọi dùng chung 1 Session có pool theo cấu hình."""
+    from core.hf_client import get_http_session, close_http_session
+    from core.config import HTTP_POOL_MAXSIZE
+
+    close_http_session()
+    s1 = get_http_session()
+    assert get_http_session() is s1
+    adapter = s1.get_adapter("https://zonecb-my-sentiment-v2.hf.space/predict")
+    assert adapter._pool_maxsize == HTTP_POOL_MAXSIZE
+    close_http_session()
+    assert get_http_session() is not s1
+
+
+# --- TEST 7: Bản async ---
+def test_async_variants(monkeypatch):
+    """query_model_async / query_sentiment_batch_async trả cùng định dạng bản sync."""
+    import asyncio
+    import core.hf_client as hf
+
+    async def mock_post_json_async(url, payload):
+        if "texts" in payload:
+            return 200, [{"raw_logits": [-1.0, 0.0, 2.0]} for _ in payload["texts"]]
+        return 200, {"raw_logits": [2.0, 0.0, -1.0]}
+
+    class MockGenerativeModel:
+        async def generate_content_async(self, text, generation_config=None):
+            class Resp:
+                text = "Chào cậu!"
+            return Resp()
+
+    monkeypatch.setattr(hf, "_post_json_async", mock_post_json_async)
+    monkeypatch.setattr(hf, "_HAS_AIOHTTP", True)
+    monkeypatch.setattr(hf, "gemini_model", MockGenerativeModel())
+
+    async def run():
+        single = await hf.query_model_async("sentiment", "buồn")
+        batch = await hf.query_sentiment_batch_async(["a", "b"])
+        resp = await hf.query_model_async("response", "Hello!")
+        return single, batch, resp
+
+    single, batch, resp = asyncio.run(run())
+    assert single["predicted_label"] == "negative"
+    assert [r["predicted_label"] for r in batch] == ["positive", "positive"]
+    assert resp["text"] == "Chào cậu!"
+
+
+# --- TEST 8: Fan-out song song ---
+def test_sentiment_concurrent(monkeypatch):
+    """Giữ thứ tự chunk, không vượt quá giới hạn song song, fail fast khi 1 chunk lỗi."""
+    import threading
+    import time
+    import core.hf_client as hf
+
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def mock_query_model(model_name, text, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02 * (10 - int(text)))  # chunk sau xong trước
+        with lock:
+            active[0] -= 1
+        if text == "9":
+            return {"error": "boom"}
+        return {"predicted_label": "neutral", "input": text}
+
+    monkeypatch.setattr(hf, "query_model", mock_query_model)
+
+    results = query_sentiment_concurrent(["1", "2", "3", "4"], max_concurrency=2)
+    assert [r["input"] for r in results] == ["1", "2", "3", "4"]
+    assert peak[0] <= 2
+
+    results = query_sentiment_concurrent(["1", "9", "1", "1", "1", "1"], max_concurrency=2)
+    assert results[1] == {"error": "boom"}
+    assert None in results  # các chunk chưa chạy đã bị huỷ
+
+
+# --- TEST 9: Cache sentiment ---
+def test_sentiment_cache_skips_network(monkeypatch):
+    """Chunk lặp lại (sau clean_text) lấy từ cache, không gửi request."""
+    import requests
+    sent = []
+
+    class MockResponse:
+        status_code = 200
+        def __init__(self, texts):
+            self.texts = texts
+        def raise_for_status(self): pass
+        def json(self):
+            return [{"raw_logits": [2.0, 0.0, -1.0]} for _ in self.texts]
+
+    def mock_post(self, url, json=None, **k):
+        sent.extend(json["texts"])
+        return MockResponse(json["texts"])
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+
+    first = query_sentiment_batch(["mệt quá", "stress thi cử"])
+    second = query_sentiment_batch(["mệt   quá", "hôm nay ổn"])
+
+    assert sent == ["mệt quá", "stress thi cử", "hôm nay ổn"]
+    assert [r["cache_hit"] for r in first] == [False, False]
+    assert [r["cache_hit"] for r in second] == [True, False]
+    assert second[0]["label_distribution"] == first[0]["label_distribution"]
+
+
+# --- TEST 10: Backend in-process (torch local / ONNX) ---
+@pytest.mark.parametrize("backend_name", ["local", "onnx"])
+def test_local_backend(monkeypatch, backend_name):
+    """SENTIMENT_BACKEND = "local"/"onnx" → dùng model trong process, cùng định dạng kết quả."""
+    import requests
+    import core.hf_client as hf
+
+    class FakeBackend:
+        def __init__(self):
+            self.calls = []
+        def predict_logits(self, texts):
+            self.calls.append(list(texts))
+            return [[-1.0, 0.0, 2.0] for _ in texts]
+
+    def no_network(*a, **k):
+        raise AssertionError("không được gọi mạng khi dùng backend local")
+
+    backend = FakeBackend()
+    monkeypatch.setattr(hf, "SENTIMENT_BACKEND", backend_name)
+    monkeypatch.setattr(hf, "get_backend", lambda name: backend)
+    monkeypatch.setattr(requests.Session, "post", no_network)
+
+    single = query_model("sentiment", "vui")
+    batch = query_sentiment_concurrent(["a", "b", "c"])
+
+    assert single["predicted_label"] == "positive"
+    assert set(single) >= {"input", "label_distribution", "emotion_detail", "model", "timestamp"}
+    assert [r["predicted_label"] for r in batch] == ["positive"] * 3
+    assert backend.calls == [["vui"], ["a", "b", "c"]]  # 1 batch CPU cho cả 3 chunk
+
+
+# --- TEST 11: Micro-batching giữa nhiều pipeline ---
+def test_microbatcher_groups_concurrent_callers():
+    """Chunk từ nhiều thread được gom thành ít lô hơn, kết quả về đúng caller."""
+    import threading
+    from core.hf_client import SentimentMicroBatcher
+
+    batches = []
+
+    def batch_fn(texts):
+        batches.append(list(texts))
+        return [{"input": t} for t in texts]
+
+    batcher = SentimentMicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=50)
+    outputs = {}
+
+    def caller(uid):
+        futures = batcher.submit_many([f"{uid}-1", f"{uid}-2"])
+        outputs[uid] = [f.result(timeout=5)["input"] for f in futures]
+
+    threads = [threading.Thread(target=caller, args=(u,)) for u in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert outputs == {u: [f"{u}-1", f"{u}-2"] for u in range(4)}
+    assert len(batches) < 4
+    assert all(len(b) <= 8 for b in batches)
+
+
+# --- TEST 12: Stream response (Gemini) ---
+def test_stream_model_response(monkeypatch):
+    """stream_model_response yield từng đoạn, build_streamed_response ghép lại như query_model."""
+    import core.hf_client as hf
+
+    class Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    class MockGenerativeModel:
+        def generate_content(self, text, generation_config=None, stream=False):
+            assert stream
+            return [Chunk("Xin "), Chunk(""), Chunk("chào!")]
+
+    monkeypatch.setattr(hf, "gemini_model", MockGenerativeModel())
+
+    parts = list(hf.stream_model_response("Hello!"))
+    assert parts == ["Xin ", "chào!"]
+    result = hf.build_streamed_response(parts)
+    assert result["text"] == "Xin chào!"
+    assert result["source"] == "google_gemini_2.5_flash"
+
+
+# --- TEST 13: Import nhẹ ---
+def test_import_does_not_load_heavy_modules():
+    """Import hf_client không được kéo theo torch / google.generativeai / aiohttp."""
+    import subprocess
+    code = (
+        "import sys, core.hf_client; "
+        "print(','.join(m for m in ('torch', 'google.generativeai', 'aiohttp') if m in sys.modules))"
+    )
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
+
+
+def test_softmax_matches_reference():
+    """Softmax Python thuần cho kết quả giống công thức chuẩn, chấp nhận logits lồng nhau."""
+    import math
+    import core.hf_client as hf
+
+    logits = hf._flatten([[-0.5, 0.2, 2.3]])
+    probs = hf._softmax(logits, 1.0)
+    exps = [math.exp(x) for x in logits]
+    assert probs == pytest.approx([e / sum(exps) for e in exps])
+
+
+# --- TEST 14: Micro-batch bị kẹt không treo pipeline async ---
+def test_async_microbatch_wait_is_bounded(monkeypatch):
+    import asyncio
+    from concurrent.futures import Future
+    import core.hf_client as hf
+
+    ready = Future()
+    ready.set_result({"input": "xong", "predicted_label": "neutral"})
+    stalled = Future()                                   # thread micro-batch không bao giờ trả
+
+    class StuckBatcher:
+        def submit_many(self, texts):
+            return [ready, stalled]
+
+    monkeypatch.setattr(hf, "SENTIMENT_MICROBATCH_ENABLED", True)
+    monkeypatch.setattr(hf, "get_microbatcher", lambda: StuckBatcher())
+    monkeypatch.setattr(hf, "_lookup_cache", lambda texts: ([None] * len(texts), list(range(len(texts)))))
+    monkeypatch.setattr(hf, "_microbatch_timeout", lambda: 0.05)
+
+    results = asyncio.run(asyncio.wait_for(hf.query_sentiment_batch_async(["xong", "kẹt"]), timeout=2))
+    assert results[0]["predicted_label"] == "neutral"
+    assert "error" in results[1]
+
+
+# --- TEST 15: Caller bỏ chờ không làm kẹt caller khác cùng lô ---
+def test_microbatch_timeout_does_not_block_batch_mates(monkeypatch):
+    import asyncio
+    import core.hf_client as hf
+
+    sent = []
+
+    def batch_fn(texts):
+        sent.append(list(texts))
+        return [{"input": t} for t in texts]
+
+    batcher = hf.SentimentMicroBatcher(batch_fn, max_batch_size=2, max_wait_ms=2000)
+    monkeypatch.setattr(hf, "_microbatch_timeout", lambda: 0.05)
+    try:
+        first = batcher.submit("a")
+        # Caller async quá hạn khi lô còn chờ gom → future của nó bị huỷ
+        out = asyncio.run(hf._gather_microbatch([first]))
+        assert "error" in out[0] and first.cancelled()
+
+        second = batcher.submit("b")                    # đủ 2 chunk → lô [a, b] được gửi
+        assert second.result(timeout=5) == {"input": "b"}
+        assert sent == [["b"]]                          # chunk đã bị bỏ không được gửi
+    finally:
+        batcher.close()
+
+
 # --- Cho phép chạy trực tiếp ---
 if __name__ == "__main__":
     pytest.main(["-v", __file__])
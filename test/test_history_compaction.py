@@ -0,0 +1,127 @@
+"""
+Unit test cho core/history_compaction.py
+Kiểm tra compact bản ghi cũ → tổng kết ngày + kho lạnh, gộp ngày → tuần
+và đọc tổng kết xuyên suốt 2 tầng.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from core.history_compaction import (
+    HistorySummaryStore,
+    compact_history,
+    iter_archive,
+    summarize_history,
+)
+from core.history_store import JsonlHistoryStore
+
+NOW = datetime(2025, 12, 31, 12, 0, 0)
+
+
+def _entry(day, label, topic="Học tập & Thi cử", user_id="u1"):
+    dist = {"negative": 80.0, "neutral": 10.0, "positive": 10.0} if label == "negative" \
+        else {"negative": 10.0, "neutral": 10.0, "positive": 80.0}
+    return {"user_id": user_id, "predicted_label": label, "label_distribution": dist,
+            "topic": topic, "case_type": "consistent", "text": "...",
+            "timestamp": f"{day} 09:00:00"}
+
+
+def _setup(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    summaries = HistorySummaryStore(str(tmp_path / "summaries.json"))
+    store.append_many([
+        _entry("2025-08-04", "negative"),   # cũ → sẽ gộp thành tuần
+        _entry("2025-08-05", "positive"),
+        _entry("2025-11-20", "negative"),   # cũ → tổng kết ngày
+        _entry("2025-11-20", "positive"),
+        _entry("2025-12-30", "negative"),   # hot
+    ])
+    return store, summaries
+
+
+def test_compaction_moves_old_entries_to_summaries_and_archive(tmp_path):
+    store, summaries = _setup(tmp_path)
+    stats = compact_history(store, summaries, hot_days=30, weekly_after_days=90,
+                            archive_dir=str(tmp_path / "archive"), now=NOW, embed_dir=None)
+
+    assert stats == {"compacted": 4, "removed": 4, "embeddings_pruned": 0, "days_rolled_into_weeks": 2}
+    assert [e["timestamp"][:10] for e in store.load_all()] == ["2025-12-30"]
+    assert len(list(iter_archive(str(tmp_path / "archive")))) == 4
+
+    periods = {(s["period"], s["start"]): s["count"] for s in summaries.load()}
+    assert periods == {("week", "2025-08-04"): 2, ("day", "2025-11-20"): 2}
+
+
+def test_summaries_read_across_tiers(tmp_path):
+    store, summaries = _setup(tmp_path)
+    before = summarize_history("u1", since="2025-11-01", store=store, summaries=summaries)
+    compact_history(store, summaries, hot_days=30, weekly_after_days=90,
+                    archive_dir=str(tmp_path / "archive"), now=NOW, embed_dir=None)
+    after = summarize_history("u1", since="2025-11-01", store=store, summaries=summaries)
+
+    assert after == before
+    day = after[0]
+    assert day["start"] == "2025-11-20" and day["count"] == 2
+    assert day["label_counts"]["negative"] == 1
+    assert day["mean_distribution"]["positive"] == 45.0
+    assert after[-1]["start"] == "2025-12-30"
+
+
+def test_rerun_after_crash_before_removal_does_not_double_count(tmp_path, monkeypatch):
+    store, summaries = _setup(tmp_path)
+    archive = str(tmp_path / "archive")
+    # Lần 1 dừng ngay trước bước xoá khỏi store
+    monkeypatch.setattr(store, "remove_older_than", lambda cutoff: (_ for _ in ()).throw(OSError("killed")))
+    with pytest.raises(OSError):
+        compact_history(store, summaries, hot_days=30, weekly_after_days=90, archive_dir=archive,
+                        now=NOW, embed_dir=None)
+    monkeypatch.undo()
+
+    compact_history(store, summaries, hot_days=30, weekly_after_days=90, archive_dir=archive,
+                    now=NOW, embed_dir=None)
+    assert sum(s["count"] for s in summaries.load()) == 4
+    assert len(list(iter_archive(archive))) == 4
+    assert [e["timestamp"][:10] for e in store.load_all()] == ["2025-12-30"]
+
+
+def test_compaction_prunes_embedding_meta(tmp_path):
+    from core.history_embeddings import EmbeddingIndex, HashingEmbedder
+
+    store, summaries = _setup(tmp_path)
+    index = EmbeddingIndex(str(tmp_path / "emb"), embedder=HashingEmbedder(dim=32), min_score=-1.0)
+    index.add_many([dict(e, text=f"nhật ký {e['timestamp']}") for e in store.load_all()])
+
+    stats = compact_history(store, summaries, hot_days=30, weekly_after_days=90,
+                            archive_dir=str(tmp_path / "archive"), now=NOW, embed_dir=str(tmp_path / "emb"))
+    assert stats["embeddings_pruned"] == 4
+    # Index đang mở đọc lại file đã prune: chỉ còn entry hot, vector đúng hàng
+    top = index.search("nhật ký 2025-12-30 09:00:00", user_id="u1", k=5)
+    assert [r["timestamp"][:10] for r in top] == ["2025-12-30"] and top[0]["score"] > 0.99
+
+
+def test_concurrent_compactions_do_not_double_count(tmp_path, monkeypatch):
+    """2 lần chạy chồng nhau (cron chạy 2 lần / cùng worker khác) → mỗi bản ghi cũ chỉ compact 1 lần."""
+    import threading
+    import time
+
+    _setup(tmp_path)
+    archive = str(tmp_path / "archive")
+
+    def worker():
+        store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+        real_load = store.load_all
+        store.load_all = lambda: (real_load(), time.sleep(0.1))[0]   # nới rộng khoảng chen ngang
+        compact_history(store, HistorySummaryStore(str(tmp_path / "summaries.json")), hot_days=30,
+                        weekly_after_days=90, archive_dir=archive, now=NOW, embed_dir=None)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(list(iter_archive(archive))) == 4
+    periods = {(s["period"], s["start"]): s["count"]
+               for s in HistorySummaryStore(str(tmp_path / "summaries.json")).load()}
+    assert periods == {("week", "2025-08-04"): 2, ("day", "2025-11-20"): 2}
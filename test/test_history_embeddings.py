@@ -0,0 +1,66 @@
+"""
+Unit test cho core/history_embeddings.py
+Kiểm tra hashing embedder, thêm tăng dần, đọc lại từ đĩa và tìm kiếm ANN (LSH).
+"""
+
+import numpy as np
+
+from core.history_embeddings import EmbeddingIndex, HashingEmbedder
+
+TEXTS = [
+    "Mai thi giữa kỳ mà mình chưa ôn xong, lo quá",
+    "Hôm nay đi cà phê với bạn thân, vui ghê",
+    "Cãi nhau với mẹ vì chuyện điểm số",
+    "Chạy bộ buổi sáng thấy khoẻ hẳn",
+]
+
+
+def _entry(i, text, user_id="u1"):
+    return {"user_id": user_id, "text": text, "predicted_label": "neutral",
+            "timestamp": f"2025-11-01 08:{i // 60:02d}:{i % 60:02d}"}
+
+
+def test_hashing_embedder_similarity():
+    emb = HashingEmbedder(dim=256)
+    vecs = emb.embed(["lo lắng vì sắp thi giữa kỳ", TEXTS[0], TEXTS[1]])
+    assert np.allclose(np.linalg.norm(vecs, axis=1), 1.0, atol=1e-5)
+    assert vecs[0] @ vecs[1] > vecs[0] @ vecs[2]
+
+
+def test_search_is_scoped_to_user_and_incremental(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), embedder=HashingEmbedder(dim=128), min_score=-1.0)
+    index.add_many([_entry(i, t) for i, t in enumerate(TEXTS)])
+    index.add_many([_entry(9, "Lo lắng vì kỳ thi giữa kỳ sắp tới", user_id="u2")])
+
+    top = index.search("sắp thi giữa kỳ, lo quá", user_id="u1", k=2)
+    assert top[0]["text"] == TEXTS[0] and len(top) == 2
+    assert all(r["user_id"] == "u1" for r in top)
+
+    # Thêm entry mới → tìm thấy ngay; index mở lại từ đĩa (process khác) cũng thấy
+    index.add_many([_entry(10, "Thi giữa kỳ xong rồi, nhẹ cả người")])
+    reopened = EmbeddingIndex(str(tmp_path), embedder=HashingEmbedder(dim=128))
+    assert len(reopened) == 6
+    assert reopened.search("thi giữa kỳ xong", user_id="u1", k=1)[0]["text"].startswith("Thi giữa kỳ xong")
+
+
+def test_lsh_candidates_find_near_duplicate(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), embedder=HashingEmbedder(dim=128), exact_max=0)
+    rng = np.random.RandomState(1)
+    words = "học thi bạn mẹ vui buồn mệt ngủ chạy ăn đi làm điểm lo sợ thích".split()
+    noise = [" ".join(rng.choice(words, 8)) for _ in range(500)]
+    index.add_many([_entry(i, t) for i, t in enumerate(noise + TEXTS)])
+
+    top = index.search(TEXTS[2], user_id="u1", k=3)
+    assert top[0]["text"] == TEXTS[2]
+
+
+def test_anonymous_scope_and_min_score(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), embedder=HashingEmbedder(dim=128), min_score=0.25)
+    index.add_many([_entry(i, t) for i, t in enumerate(TEXTS)])
+    index.add_many([_entry(9, "Chạy bộ buổi tối cho khoẻ", user_id=None)])
+
+    # user_id=None chỉ thấy entry ẩn danh, dù entry của u1 giống hơn
+    assert [r["user_id"] for r in index.search(TEXTS[0], user_id=None, k=3)] == []
+    assert [r["user_id"] for r in index.search("chạy bộ cho khoẻ", user_id=None, k=3)] == [None]
+    # Chỉ trả entry đủ giống, không lấp cho đủ k
+    assert [r["text"] for r in index.search("sắp thi giữa kỳ, lo quá", user_id="u1", k=3)] == [TEXTS[0]]
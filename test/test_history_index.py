@@ -0,0 +1,52 @@
+"""
+Unit test cho core/history_index.py
+Kiểm tra lấy k entry gần nhất, cập nhật tăng dần và load lại khi file bị process khác ghi.
+"""
+
+import os
+
+from core.history_index import HistoryIndex
+from core.history_store import JsonlHistoryStore, UserPartitionedHistoryStore
+
+
+def _entry(user_id, label, day, text=""):
+    return {"user_id": user_id, "predicted_label": label, "text": text,
+            "timestamp": f"2025-11-{day:02d} 08:00:00"}
+
+
+def test_recent_returns_newest_first_per_user_and_label(tmp_path):
+    store = UserPartitionedHistoryStore(str(tmp_path / "users"), fsync="never")
+    store.append_many([_entry("u1", "negative", d) for d in (3, 1, 2)] + [_entry("u2", "negative", 9)])
+    index = HistoryIndex(store, max_per_label=2)
+
+    assert [e["timestamp"][8:10] for e in index.recent("negative", "u1", k=3)] == ["03", "02"]
+    assert index.recent("positive", "u1") == []
+    # user_id=None là user ẩn danh, không phải "mọi user"
+    assert index.recent("negative", None, k=5) == []
+
+
+def test_append_updates_index_without_reloading(tmp_path, monkeypatch):
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append(_entry("u1", "negative", 1))
+    index = HistoryIndex(store)
+    index.recent("negative", "u1")
+
+    monkeypatch.setattr(index, "_load", lambda user_id: (_ for _ in ()).throw(AssertionError("reload")))
+    index.append(_entry("u1", "negative", 2, "mới"))
+    assert index.recent("negative", "u1", k=1)[0]["text"] == "mới"
+    assert len(store.load_all()) == 2
+
+
+def test_external_write_invalidates_by_mtime(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append(_entry("u1", "negative", 1))
+    index = HistoryIndex(store)
+    assert len(index.recent("negative", "u1")) == 1
+
+    # Process khác ghi thêm vào cùng file
+    other = JsonlHistoryStore(store.path, fsync="never")
+    other.append(_entry("u1", "negative", 2, "từ worker khác"))
+    st = os.stat(store.path)
+    os.utime(store.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    assert index.recent("negative", "u1", k=1)[0]["text"] == "từ worker khác"
@@ -0,0 +1,117 @@
+"""
+Unit test cho core/history_rollups.py
+Kiểm tra rollup mood cộng dồn theo (user, ngày) và phân tích cho notification đọc từ rollup.
+"""
+
+from datetime import date
+
+import core.history_engine as he
+from core.history_rollups import MoodRollupStore, rollup_from_entries
+
+
+def _entry(user_id, ts, label, topic="Khác"):
+    return {"user_id": user_id, "timestamp": ts, "predicted_label": label, "topic": topic, "text": "..."}
+
+
+HISTORY = [
+    _entry("u1", "2025-03-01 08:00:00", "negative", "Học tập"),
+    _entry("u1", "2025-03-02 09:00:00", "positive", "Thể thao"),
+    _entry("u1", "2025-03-02 21:00:00", "positive", "Thể thao"),
+    _entry("u1", "2025-03-03 10:00:00", "negative", "Học tập"),
+    _entry("u2", "2025-03-03 07:00:00", "neutral"),
+]
+
+
+def test_incremental_adds_match_single_batch(tmp_path):
+    store = MoodRollupStore(str(tmp_path / "rollups.sqlite3"))
+    # Ghi từng entry (như pipeline ghi từng lô nhỏ) → cộng dồn theo (user, ngày)
+    for entry in HISTORY:
+        store.add_entries([entry])
+    assert len(store) == 4
+
+    rollup = store.user_rollup("u1")
+    assert rollup == rollup_from_entries([e for e in HISTORY if e["user_id"] == "u1"], "u1")
+    assert rollup["last_timestamp"] == "2025-03-03 10:00:00"
+    assert [(d["day"], d["count"], d["dominant_label"]) for d in rollup["days"]] == [
+        ("2025-03-01", 1, "negative"),
+        ("2025-03-02", 2, "positive"),
+        ("2025-03-03", 1, "negative"),
+    ]
+    assert [d["day"] for d in store.user_rollup("u1", max_days=2)["days"]] == ["2025-03-02", "2025-03-03"]
+
+    recent = store.load_since("2025-03-03")
+    assert set(recent) == {"u1", "u2"}
+    assert [d["day"] for d in recent["u1"]["days"]] == ["2025-03-03"]
+    assert recent["u2"]["last_timestamp"] == "2025-03-03 07:00:00"
+    store.close()
+
+
+def test_analytics_same_from_rollup_and_history(tmp_path):
+    store = MoodRollupStore(str(tmp_path / "rollups.sqlite3"))
+    store.add_entries(HISTORY)
+    rollup = store.user_rollup("u1")
+    today = date(2025, 3, 20)
+
+    assert he.get_recent_mood_trend(days=2, rollup=rollup) == ["positive", "negative"]
+    assert he.get_recent_mood_trend(HISTORY, days=2, user_id="u1") == ["positive", "negative"]
+    assert he.get_last_entry_time(rollup=rollup) == he.get_last_entry_time(HISTORY, user_id="u1")
+
+    patterns = he.get_success_patterns(days=7, today=today, rollup=rollup)
+    assert patterns == he.get_success_patterns(days=7, history=HISTORY, user_id="u1", today=today)
+    assert patterns == [{"activity": "Thể thao", "count": 1, "last_day": "2025-03-02"}]
+    # Thói quen vừa lặp lại gần đây → chưa cần nhắc
+    assert he.get_success_patterns(days=30, today=today, rollup=rollup) == []
+    store.close()
+
+
+def test_write_entries_backfills_rollup_once_and_survives_errors(tmp_path, monkeypatch):
+    import core.history_compaction as hc
+    import core.history_rollups as hr
+    import core.history_writer as hw
+    from core.history_compaction import HistorySummaryStore
+    from core.history_store import JsonlHistoryStore
+
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append_many(HISTORY[:2])
+    for name, value in (("get_history_index", lambda: None), ("get_history_store", lambda: store),
+                        ("get_task_store", lambda: None), ("HISTORY_SEMANTIC_CONTEXT", False)):
+        monkeypatch.setattr(hw, name, value)
+
+    def broken(exclude=None):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(hw, "get_mood_rollups", broken)
+    hw.write_entries([HISTORY[2]])
+    assert len(store.load_all()) == 3                  # rollup lỗi không chặn bản ghi chính
+
+    # Lần đầu tạo rollup ngay sau khi ghi: entry vừa ghi chỉ được cộng 1 lần
+    path = str(tmp_path / "rollups.sqlite3")
+    monkeypatch.setattr(hr, "_store", None)
+    monkeypatch.setattr(hr, "HISTORY_ROLLUPS_ENABLED", True)
+    monkeypatch.setattr(hr, "HISTORY_ROLLUP_PATH", path)
+    monkeypatch.setattr(hc, "get_history_store", lambda: store)
+    monkeypatch.setattr(hc, "HistorySummaryStore", lambda: HistorySummaryStore(str(tmp_path / "summaries.json")))
+    monkeypatch.setattr(hw, "get_mood_rollups", hr.get_mood_rollups)
+    hw.write_entries([HISTORY[3]])
+    assert [d["count"] for d in hr._store.user_rollup("u1")["days"]] == [1, 2, 1]
+    hr._store.close()
+
+
+def test_rollup_rebuilt_once_and_after_interrupted_build(tmp_path, monkeypatch):
+    """Dựng lại dưới file_lock + cờ "built": worker sau không cộng lần 2, file dựng dở thì dựng lại."""
+    import core.history_rollups as hr
+
+    path = str(tmp_path / "rollups.sqlite3")
+    MoodRollupStore(path).close()                      # file đã tạo nhưng chưa dựng xong (crash)
+    builds = []
+    monkeypatch.setattr(hr, "HISTORY_ROLLUPS_ENABLED", True)
+    monkeypatch.setattr(hr, "HISTORY_ROLLUP_PATH", path)
+    monkeypatch.setattr(hr, "summarize_history", lambda exclude=None: builds.append(1) or
+                        hr.summarize_entries(HISTORY, "day"))
+
+    for _ in range(2):                                 # 2 worker lần lượt khởi động
+        monkeypatch.setattr(hr, "_store", None)
+        store = hr.get_mood_rollups()
+        assert [d["count"] for d in store.user_rollup("u1")["days"]] == [1, 2, 1]
+        store.close()
+    assert builds == [1]
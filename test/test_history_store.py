@@ -0,0 +1,253 @@
+"""
+Unit test cho core/history_store.py
+Kiểm tra append JSONL, đọc bỏ qua dòng hỏng, fsync policy, SQLite (index), chia theo user và migrate từ JSON.
+"""
+
+import json
+import threading
+
+import pytest
+
+from core.history_store import (
+    JsonlHistoryStore,
+    SqliteHistoryStore,
+    UserPartitionedHistoryStore,
+    migrate_json_to_jsonl,
+    migrate_to_sqlite,
+)
+
+
+def _entries():
+    return [
+        {"user_id": "u1", "predicted_label": "negative", "case_type": "consistent", "timestamp": "2025-11-01 08:00:00"},
+        {"user_id": "u1", "predicted_label": "positive", "case_type": "mixed", "timestamp": "2025-11-02 08:00:00"},
+        {"user_id": "u2", "predicted_label": "negative", "case_type": "consistent", "timestamp": "2025-11-03 08:00:00"},
+        {"user_id": "u1", "label": "negative", "case_type": "mixed", "timestamp": "2025-11-04 08:00:00"},
+    ]
+
+
+def test_jsonl_append_and_load(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append({"text": "Hôm nay mệt", "predicted_label": "negative"})
+    store.append({"text": "Vui quá", "predicted_label": "positive"})
+
+    rows = store.load_all()
+    assert [r["predicted_label"] for r in rows] == ["negative", "positive"]
+    # Mỗi bản ghi đúng 1 dòng
+    assert len((tmp_path / "history.jsonl").read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_jsonl_concurrent_appends_keep_every_record(tmp_path):
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="always")
+    threads = [threading.Thread(target=store.append, args=({"i": i},)) for i in range(50)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(r["i"] for r in store.load_all()) == list(range(50))
+
+
+def test_jsonl_skips_torn_last_line(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"i": 1}\n{"i": 2', encoding="utf-8")
+    assert JsonlHistoryStore(str(path)).load_all() == [{"i": 1}]
+
+
+def test_invalid_fsync_policy():
+    with pytest.raises(ValueError):
+        JsonlHistoryStore("x.jsonl", fsync="sometimes")
+
+
+def test_migrate_json_to_jsonl(tmp_path):
+    source = tmp_path / "history.json"
+    dest = tmp_path / "history.jsonl"
+    source.write_text(json.dumps([{"i": 1}, {"i": 2}], ensure_ascii=False), encoding="utf-8")
+
+    assert migrate_json_to_jsonl(str(source), str(dest)) == 2
+    assert JsonlHistoryStore(str(dest)).load_all() == [{"i": 1}, {"i": 2}]
+    with pytest.raises(FileExistsError):
+        migrate_json_to_jsonl(str(source), str(dest))
+
+
+def test_sqlite_query_matches_file_store(tmp_path):
+    """SQLite và JSONL trả cùng kết quả cho cùng điều kiện lọc."""
+    sqlite_store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+    jsonl_store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    for store in (sqlite_store, jsonl_store):
+        store.append_many(_entries())
+
+    for filters in (
+        {"label": "negative", "user_id": "u1", "limit": 3},
+        {"label": "negative"},
+        {"case_type": "mixed"},
+        {"since": "2025-11-02 00:00:00", "limit": 2},
+    ):
+        assert sqlite_store.query(**filters) == jsonl_store.query(**filters)
+
+    recent = sqlite_store.query(label="negative", user_id="u1", limit=3)
+    assert [e["timestamp"][:10] for e in recent] == ["2025-11-04", "2025-11-01"]
+    assert len(sqlite_store.load_all()) == 4
+
+
+def test_sqlite_query_uses_index(tmp_path):
+    store = SqliteHistoryStore(str(tmp_path / "history.sqlite3"))
+    plan = store._db.execute(
+        "EXPLAIN QUERY PLAN SELECT data FROM history WHERE user_id = ? AND predicted_label = ?"
+        " ORDER BY timestamp DESC, id DESC LIMIT 3",
+        ("u1", "negative"),
+    ).fetchall()
+    assert "idx_history_user_label_ts" in " ".join(str(row) for row in plan)
+
+
+def test_migrate_to_sqlite(tmp_path):
+    source = tmp_path / "history.json"
+    source.write_text(json.dumps(_entries(), ensure_ascii=False), encoding="utf-8")
+    dest = tmp_path / "history.sqlite3"
+
+    assert migrate_to_sqlite(str(source), str(dest)) == 4
+    assert SqliteHistoryStore(str(dest)).load_all() == _entries()
+
+
+def test_user_partitions_only_read_own_shard(tmp_path, monkeypatch):
+    import core.history_store as hs
+
+    store = UserPartitionedHistoryStore(str(tmp_path / "users"), fsync="never")
+    store.append_many(_entries())
+    store.append({"text": "không có user", "timestamp": "2025-11-05 08:00:00"})
+    assert len(list((tmp_path / "users").iterdir())) == 3
+
+    opened = []
+    real_read = hs.read_jsonl
+    monkeypatch.setattr(hs, "read_jsonl", lambda path, strict=True: opened.append(path) or real_read(path, strict))
+
+    recent = store.query(user_id="u1", label="negative", limit=3)
+    assert [e["timestamp"][:10] for e in recent] == ["2025-11-04", "2025-11-01"]
+    assert opened == [store.shard_path("u1")]
+    assert len(store.load_all()) == 5
+
+
+def test_build_past_context_filters_by_user(monkeypatch, tmp_path):
+    import core.history_engine as he
+
+    store = UserPartitionedHistoryStore(str(tmp_path / "users"), fsync="never")
+    store.append({"user_id": "u1", "predicted_label": "negative", "text": "của u1", "timestamp": "2025-11-01 08:00:00"})
+    store.append({"user_id": "u2", "predicted_label": "negative", "text": "của u2", "timestamp": "2025-11-02 08:00:00"})
+    monkeypatch.setattr(he, "get_history_store", lambda: store)
+    monkeypatch.setattr(he, "get_history_index", lambda: None)
+
+    context = he.build_past_context("negative", "consistent", user_id="u1")
+    assert "của u1" in context and "của u2" not in context
+
+
+def test_anonymous_reads_only_anonymous_entries(tmp_path):
+    from core.history_store import ALL_USERS
+
+    entries = [*_entries(), {"predicted_label": "negative", "text": "ẩn danh", "timestamp": "2025-11-05 08:00:00"}]
+    stores = (
+        UserPartitionedHistoryStore(str(tmp_path / "users"), fsync="never"),
+        SqliteHistoryStore(str(tmp_path / "history.sqlite3")),
+        JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never"),
+    )
+    for store in stores:
+        store.append_many(entries)
+        assert [e["text"] for e in store.query(user_id=None, label="negative")] == ["ẩn danh"]
+        assert len(store.query(user_id=ALL_USERS)) == 5
+
+
+def _json_worker(path, worker, count):
+    from core.history_store import JsonHistoryStore
+    store = JsonHistoryStore(path)
+    for i in range(count):
+        store.append({"worker": worker, "i": i})
+
+
+def test_json_store_multiprocess_appends_keep_every_record(tmp_path):
+    """Nhiều process cùng đọc – sửa – ghi file JSON: khoá file giữ đủ mọi bản ghi."""
+    import multiprocessing
+
+    path = str(tmp_path / "history.json")
+    procs = [multiprocessing.Process(target=_json_worker, args=(path, w, 20)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    from core.history_store import JsonHistoryStore
+    assert len(JsonHistoryStore(path).load_all()) == 80
+
+
+def test_json_store_refuses_to_overwrite_corrupt_file(tmp_path):
+    from core.history_store import JsonHistoryStore
+
+    path = tmp_path / "history.json"
+    path.write_text('[{"i": 1}, {"i": 2', encoding="utf-8")
+    with pytest.raises(ValueError):
+        JsonHistoryStore(str(path)).append({"i": 3})
+    assert path.read_text(encoding="utf-8") == '[{"i": 1}, {"i": 2'
+
+
+def test_jsonl_append_after_torn_line_keeps_new_record(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"i": 1}\n{"i": 2', encoding="utf-8")
+    store = JsonlHistoryStore(str(path), fsync="never")
+    store.append({"i": 3})
+    assert store.load_all() == [{"i": 1}, {"i": 3}]
+
+
+def test_group_commit_batches_concurrent_appends(tmp_path):
+    from core.history_store import GroupCommitWriter
+
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="always")
+    batches = []
+    real_append_many = store.append_many
+    store.append_many = lambda entries: batches.append(len(entries)) or real_append_many(entries)
+    writer = GroupCommitWriter(store, window_ms=50, max_batch=64)
+
+    threads = [threading.Thread(target=writer.append, args=({"i": i},)) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(r["i"] for r in writer.load_all()) == list(range(20))
+    assert sum(batches) == 20 and len(batches) < 20
+
+
+def test_partition_migration_runs_once_and_never_leaves_partial_dir(tmp_path, monkeypatch):
+    """Lần đầu chia theo user: nhiều worker cùng lúc chỉ chia 1 lần; lỗi giữa chừng → lần sau chia lại."""
+    import core.history_store as hs
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(hs, "HISTORY_PARTITION_BY_USER", True)
+    monkeypatch.setattr(hs, "HISTORY_USER_DIR", "users")
+    JsonlHistoryStore(hs.HISTORY_JSONL_PATH, fsync="never").append_many(_entries())
+
+    # Lỗi giữa lúc chia → không có thư mục đích, không sót thư mục tạm
+    real_append = UserPartitionedHistoryStore.append_many
+    monkeypatch.setattr(UserPartitionedHistoryStore, "append_many",
+                        lambda self, entries: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        hs._create_store("jsonl")
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == []
+
+    monkeypatch.setattr(UserPartitionedHistoryStore, "append_many", real_append)
+    threads = [threading.Thread(target=hs._create_store, args=("jsonl",)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(UserPartitionedHistoryStore("users").load_all()) == len(_entries())
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == ["users"]
+
+
+def test_migrations_use_unique_temp_files(tmp_path):
+    """File tạm riêng mỗi lần chạy (mkstemp) và không sót lại sau khi xong."""
+    source = tmp_path / "history.json"
+    source.write_text(json.dumps([{"i": 1}]), encoding="utf-8")
+    (tmp_path / "history.jsonl.tmp").write_text("của tiến trình khác", encoding="utf-8")
+
+    assert migrate_json_to_jsonl(str(source), str(tmp_path / "history.jsonl")) == 1
+    assert migrate_to_sqlite(str(source), str(tmp_path / "history.sqlite3")) == 1
+    assert (tmp_path / "history.jsonl.tmp").read_text(encoding="utf-8") == "của tiến trình khác"
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "history.json", "history.jsonl", "history.jsonl.tmp", "history.sqlite3"]
@@ -0,0 +1,131 @@
+"""
+Unit test cho core/history_writer.py
+Kiểm tra ghi theo lô, backpressure khi hàng đợi đầy và ghi nốt khi đóng.
+"""
+
+import threading
+import time
+
+from core.history_writer import HistoryWriteBehind
+
+
+def test_submit_returns_without_waiting_and_batches_writes():
+    batches = []
+    release = threading.Event()
+
+    def slow_write(entries):
+        release.wait(timeout=2)
+        batches.append([e["i"] for e in entries])
+
+    writer = HistoryWriteBehind(slow_write, after_write=None, max_queue=100, max_batch=50, flush_interval_ms=20)
+    start = time.monotonic()
+    for i in range(10):
+        writer.submit({"i": i})
+    assert time.monotonic() - start < 0.5          # request không chờ I/O
+
+    release.set()
+    assert writer.flush(timeout=2)
+    assert sorted(i for b in batches for i in b) == list(range(10))
+    assert len(batches) < 10
+    writer.close()
+
+
+def test_full_queue_falls_back_to_inline_write():
+    written = []
+    release = threading.Event()
+
+    def blocked_write(entries):
+        if threading.current_thread().name == "history-writer":
+            release.wait(timeout=2)
+        written.extend(e["i"] for e in entries)
+
+    writer = HistoryWriteBehind(blocked_write, after_write=None, max_queue=1, max_batch=1,
+                                flush_interval_ms=0, block_timeout=0.05)
+    for i in range(4):
+        writer.submit({"i": i})
+    # Thread nền đang kẹt → ít nhất 1 bản ghi được ghi trực tiếp trên thread gọi
+    assert written
+
+    release.set()
+    writer.close()
+    assert sorted(written) == [0, 1, 2, 3]
+
+
+def test_close_flushes_pending_entries():
+    written = []
+    writer = HistoryWriteBehind(lambda entries: written.extend(entries), after_write=None, flush_interval_ms=1000)
+    writer.submit({"i": 1})
+    writer.submit({"i": 2})
+    writer.close()
+    assert written == [{"i": 1}, {"i": 2}]
+
+
+def test_retries_only_primary_write_and_dead_letters_final_failure(tmp_path, monkeypatch):
+    import json
+
+    import core.history_writer as hw
+
+    written, indexed, calls = [], [], []
+
+    def flaky_write(entries):
+        calls.append(len(entries))
+        if len(calls) == 1:
+            raise OSError("disk busy")
+        written.extend(entries)
+
+    def broken_index(entries):
+        indexed.append(len(entries))
+        raise RuntimeError("rollup locked")
+
+    dead = tmp_path / "dead.jsonl"
+    writer = HistoryWriteBehind(flaky_write, after_write=broken_index, dead_letter_path=str(dead))
+    writer.submit({"i": 1})
+    writer.close()
+    # Lỗi lần 1 → thử lại store chính; index phụ lỗi không làm ghi lại lô
+    assert calls == [1, 1] and written == [{"i": 1}] and indexed == [1]
+
+    def always_fail(entries):
+        raise OSError("disk full")
+
+    writer = HistoryWriteBehind(always_fail, after_write=None, dead_letter_path=str(dead))
+    writer.submit({"i": 2})
+    writer.submit({"i": 3})
+    writer.close()
+    lines = [json.loads(line) for line in dead.read_text(encoding="utf-8").splitlines()]
+    assert lines == [{"i": 2}, {"i": 3}]               # không bỏ bản ghi
+
+    replayed = []
+    monkeypatch.setattr(hw, "write_entries", replayed.extend)
+    assert hw.replay_dead_letters(str(dead)) == 2
+    assert replayed == lines and not dead.exists()
+
+
+def test_write_entries_persists_history_when_embedding_index_fails(tmp_path, monkeypatch):
+    import core.history_embeddings as hemb
+    import core.history_writer as hw
+    from core.history_embeddings import EmbeddingIndex, HashingEmbedder
+    from core.history_store import JsonlHistoryStore
+
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append({"user_id": "u1", "text": "nhật ký cũ", "timestamp": "2025-11-01 08:00:00"})
+    for name, value in (("get_history_index", lambda: None), ("get_history_store", lambda: store),
+                        ("get_mood_rollups", lambda: None), ("get_task_store", lambda: None),
+                        ("HISTORY_SEMANTIC_CONTEXT", True)):
+        monkeypatch.setattr(hw, name, value)
+
+    def broken(exclude=None):
+        raise RuntimeError("thiếu transformers")
+
+    monkeypatch.setattr(hw, "get_embedding_index", broken)
+    hw.write_entries([{"user_id": "u1", "text": "a", "timestamp": "2025-11-02 08:00:00"}])
+    assert len(store.load_all()) == 2                  # lỗi index phụ không chặn bản ghi chính
+
+    # Index dựng lại lần đầu ngay sau khi ghi: entry mới chỉ được embed 1 lần
+    monkeypatch.setattr(hemb, "_index", None)
+    monkeypatch.setattr(hemb, "get_history_store", lambda: store)
+    monkeypatch.setattr(hemb, "EmbeddingIndex",
+                        lambda: EmbeddingIndex(str(tmp_path / "emb"), embedder=HashingEmbedder(dim=64)))
+    monkeypatch.setattr(hw, "get_embedding_index", hemb.get_embedding_index)
+    hw.write_entries([{"user_id": "u1", "text": "b", "timestamp": "2025-11-03 08:00:00"}])
+    assert len(store.load_all()) == 3
+    assert len(hemb._index) == 3
@@ -0,0 +1,128 @@
+"""
+Unit test cho core/notification_engine.py
+Kiểm tra sweep nhiều user trong 1 lượt, chống spam và ghi outbox theo lô.
+"""
+
+import json
+from datetime import timedelta
+
+import core.notification_engine as ne
+from core.notification_rules import RULES
+from core.utils import VN_TIMESTAMP_FORMAT
+
+
+def _ts(**delta):
+    return (ne.now() - timedelta(**delta)).strftime(VN_TIMESTAMP_FORMAT)
+
+
+def _entry(user_id, label, topic="Khác", **delta):
+    return {"user_id": user_id, "predicted_label": label, "topic": topic,
+            "text": "...", "timestamp": _ts(**delta)}
+
+
+def _setup(monkeypatch, due=()):
+    monkeypatch.setattr(ne, "get_tasks_due_soon", lambda history=None, hours=24, user_id=None: list(due))
+    monkeypatch.setattr(ne, "get_overdue_tasks", lambda history=None, user_id=None: [])
+    # Không đụng tới file rollup / bảng task / lịch sử thật trong thư mục chạy test
+    monkeypatch.setattr(ne, "get_mood_rollups", lambda: None)
+    monkeypatch.setattr(ne, "get_task_store", lambda: None)
+    monkeypatch.setattr(ne, "load_full_history", lambda: list(HISTORY))
+    # Cố định D – Summary để kết quả không phụ thuộc hôm nay là thứ mấy
+    monkeypatch.setattr(ne, "check_summary_notification", lambda today=None, **kw: None)
+
+
+HISTORY = [
+    # u_sad: 3 ngày ghi gần nhất đều tiêu cực → A
+    *[_entry("u_sad", "negative", days=d) for d in (2, 1, 0)],
+    # u_away: ngày cuối ghi đã 3 ngày trước → nhắc ghi nhật ký
+    _entry("u_away", "positive", days=3),
+    # u_task: ổn, nhưng có task sắp đến hạn → B
+    _entry("u_task", "neutral", hours=1),
+    # u_ok: vui, mới ghi → không có gì
+    _entry("u_ok", "positive", hours=1),
+]
+
+
+def test_sweep_evaluates_every_user_once(monkeypatch):
+    _setup(monkeypatch, due=[{"user_id": "u_task", "action": "Ôn bài thi"}])
+    rollups = ne.load_user_rollups(history=HISTORY)
+    loads = []
+    monkeypatch.setattr(ne, "load_user_rollups", lambda since_day, history=None: loads.append(since_day) or rollups)
+
+    out = ne.sweep_notifications(state_path=None)
+    assert len(loads) == 1                                # rollup mọi user đọc 1 lượt
+    assert {n["user_id"]: n["type"] for n in out} == {
+        "u_sad": "EMOTION_ALERT",
+        "u_away": "EMOTION_REMINDER",
+        "u_task": "TASK_DEADLINE",
+    }
+
+
+def test_sweep_cooldown_and_bulk_emit(monkeypatch, tmp_path):
+    _setup(monkeypatch)
+    state = str(tmp_path / "state.json")
+
+    first = ne.sweep_notifications(HISTORY, state_path=state)
+    assert {n["user_id"] for n in first} == {"u_sad", "u_away"}
+    # Lượt sau trong thời gian chờ → không gửi lại cùng loại
+    assert ne.sweep_notifications(HISTORY, state_path=state) == []
+    assert RULES["cooldown_hours"] > 0
+
+    outbox = tmp_path / "outbox.jsonl"
+    assert ne.emit_notifications(first, str(outbox)) == 2
+    lines = [json.loads(line) for line in outbox.read_text(encoding="utf-8").splitlines()]
+    assert [n["user_id"] for n in lines] == [n["user_id"] for n in first]
+
+
+def test_sweep_time_budget_resumes_from_cursor(monkeypatch, tmp_path):
+    _setup(monkeypatch)
+    state = tmp_path / "state.json"
+    seen = []
+    real = ne._evaluate_user
+    monkeypatch.setattr(ne, "_evaluate_user", lambda uid, *a, **k: seen.append(uid) or real(uid, *a, **k))
+
+    ne.sweep_notifications(HISTORY, time_budget_seconds=-1, state_path=str(state))
+    assert seen == []                                     # hết giờ ngay → không xét ai
+
+    # Lượt trước dừng sau "u_ok" → lượt này bắt đầu từ user kế tiếp rồi xoay vòng
+    state.write_text(json.dumps({"last_sent": {}, "cursor": "u_ok"}), encoding="utf-8")
+    ne.sweep_notifications(HISTORY, state_path=str(state))
+    assert seen == ["u_sad", "u_task", "u_away", "u_ok"]
+    assert json.loads(state.read_text(encoding="utf-8"))["cursor"] == "u_ok"
+
+
+def test_summary_only_for_users_with_entries_in_period():
+    """D – Summary: chỉ gửi cho user có ghi nhật ký trong tuần / tháng được tổng kết."""
+    def rollup(*days):
+        return {"user_id": "u", "last_timestamp": None,
+                "days": [{"day": d, "count": 1, "dominant_label": "neutral"} for d in days]}
+
+    sunday = ne.datetime.date(2025, 11, 16)
+    assert ne.check_summary_notification(sunday, rollup=rollup("2025-11-10"))["type"] == "WEEKLY_SUMMARY"
+    assert ne.check_summary_notification(sunday, rollup=rollup("2025-11-09")) is None   # tuần trước
+    assert ne.check_summary_notification(sunday, rollup=rollup()) is None
+
+    first = ne.datetime.date(2025, 12, 1)   # thứ 2
+    assert ne.check_summary_notification(first, rollup=rollup("2025-11-01"))["type"] == "MONTHLY_SUMMARY"
+    assert ne.check_summary_notification(first, rollup=rollup("2025-10-31")) is None
+
+
+def test_sweep_reads_history_once_without_stores(monkeypatch, tmp_path):
+    """Không có bảng rollup / task: rollup lẫn task đều tính từ 1 lần load_all() duy nhất."""
+    import core.history_engine as he
+    from core.history_store import JsonlHistoryStore
+
+    monkeypatch.setattr(ne, "check_summary_notification", lambda today=None, **kw: None)
+    monkeypatch.setattr(ne, "get_mood_rollups", lambda: None)
+    monkeypatch.setattr(ne, "get_task_store", lambda: None)
+    store = JsonlHistoryStore(str(tmp_path / "history.jsonl"), fsync="never")
+    store.append_many(HISTORY + [{**_entry("u_ok", "positive", minutes=5), "text": "Tối nay thi Toán"}])
+    loads = []
+    real = store.load_all
+    monkeypatch.setattr(store, "load_all", lambda: loads.append(1) or real())
+    monkeypatch.setattr(he, "get_history_store", lambda: store)
+    monkeypatch.setattr(he, "get_mood_rollups", lambda: None)
+
+    out = ne.sweep_notifications(state_path=None)
+    assert len(loads) == 1
+    assert {n["user_id"]: n["type"] for n in out}["u_ok"] == "TASK_DEADLINE"
@@ -0,0 +1,157 @@
+"""
+Unit test cho core/pipeline.py
+Mọi I/O (sentiment Space, Gemini, lịch sử) được thay bằng bản giả trên module
+pipeline → kiểm tra wiring của bản sync / async / stream mà không cần mạng.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import core.pipeline as pipeline
+
+TEXT = "Hôm nay mình buồn vì mai thi. Nhưng mà gặp bạn nên thấy vui hơn."
+REPLY = {"response": "Ok, mình tạo kế hoạch nhé! Cố lên nha.", "topic": "Học tập & Thi cử"}
+
+
+def _fake_sentiment(chunk):
+    """Chunk có "buồn" → negative rõ rệt, còn lại → positive rõ rệt."""
+    logits = [2.0, 0.1, -1.0] if "buồn" in chunk else [-1.0, 0.1, 2.0]
+    return {"raw_logits": logits, "predicted_label": "negative" if "buồn" in chunk else "positive"}
+
+
+@pytest.fixture
+def fake_io(monkeypatch):
+    """Thay sentiment / model / lịch sử; trả về dict ghi lại các lần gọi."""
+    calls = {"sentiment": [], "prompts": [], "saved": [], "context": []}
+
+    def sentiment(mode):
+        def run(chunks):
+            calls["sentiment"].append((mode, list(chunks)))
+            return [_fake_sentiment(c) for c in chunks]
+        return run
+
+    async def sentiment_async(chunks):
+        return sentiment("batch_async")(chunks)
+
+    async def concurrent_async(chunks):
+        return sentiment("concurrent_async")(chunks)
+
+    def query_model(kind, prompt):
+        calls["prompts"].append(prompt)
+        return {"text": json.dumps(REPLY, ensure_ascii=False), "source": "fake"}
+
+    async def query_model_async(kind, prompt):
+        return query_model(kind, prompt)
+
+    reply = json.dumps(REPLY, ensure_ascii=False)
+    parts = [reply[i:i + 7] for i in range(0, len(reply), 7)]
+
+    def stream(prompt):
+        calls["prompts"].append(prompt)
+        yield from parts
+
+    async def stream_async(prompt):
+        calls["prompts"].append(prompt)
+        for p in parts:
+            yield p
+
+    def build_past_context(**kwargs):
+        calls["context"].append(kwargs)
+        return "Không có bối cảnh"
+
+    monkeypatch.setattr(pipeline, "CHUNK_SIZE", 40)  # TEXT → 2 chunk
+    monkeypatch.setattr(pipeline, "query_sentiment_batch", sentiment("batch"))
+    monkeypatch.setattr(pipeline, "query_sentiment_concurrent", sentiment("concurrent"))
+    monkeypatch.setattr(pipeline, "query_sentiment_batch_async", sentiment_async)
+    monkeypatch.setattr(pipeline, "query_sentiment_concurrent_async", concurrent_async)
+    monkeypatch.setattr(pipeline, "query_model", query_model)
+    monkeypatch.setattr(pipeline, "query_model_async", query_model_async)
+    monkeypatch.setattr(pipeline, "stream_model_response", stream)
+    monkeypatch.setattr(pipeline, "stream_model_response_async", stream_async)
+    monkeypatch.setattr(pipeline, "build_past_context", build_past_context)
+    monkeypatch.setattr(pipeline, "save_history_entry", calls["saved"].append)
+    return calls
+
+
+def _check_result(result, calls):
+    """Kết quả chung của mọi biến thể với TEXT + REPLY."""
+    assert result["status"] == "success"
+    assert result["user_id"] == "u1"
+    # "buồn" → "Nhưng ... vui": đổi cực + có từ nối → polarity_shift, lấy chunk cuối
+    assert result["case_type"] == "polarity_shift"
+    assert result["predicted_label"] == "positive"
+    assert result["topic"] == REPLY["topic"]
+    assert result["advice_text"] == REPLY["response"]
+    assert result["sentiment_cache"] == {"hits": 0, "chunks": 2}
+    # "thi" → nhiệm vụ ôn thi, model trả "Ok" → có kế hoạch
+    assert [t["action"] for t in result["todo_candidates"]] == ["Ôn bài thi"]
+    assert result["todo_plan"]["main_task"] == "Ôn bài thi"
+    assert result["todo_plan"]["deadline"] == "mai"
+    assert len(result["todo_plan"]["subtasks"]) == len(result["todo_plan"]["timeline"])
+
+    assert calls["context"][0]["case_type"] == "polarity_shift"
+    assert calls["context"][0]["user_id"] == "u1"
+    assert "polarity_shift" in calls["prompts"][0]
+    assert calls["saved"] == [result]
+
+
+def test_sync_pipeline(fake_io):
+    result = pipeline.run_ai_pipeline(TEXT, user_id="u1")
+
+    _check_result(result, fake_io)
+    assert [mode for mode, _ in fake_io["sentiment"]] == ["batch"]
+
+
+def test_sync_pipeline_concurrent_dispatch(fake_io, monkeypatch):
+    """SENTIMENT_DISPATCH_MODE="concurrent" → gọi bản song song, cùng kết quả."""
+    monkeypatch.setattr(pipeline, "SENTIMENT_DISPATCH_MODE", "concurrent")
+
+    result = pipeline.run_ai_pipeline(TEXT, user_id="u1")
+
+    _check_result(result, fake_io)
+    assert [mode for mode, _ in fake_io["sentiment"]] == ["concurrent"]
+
+
+def test_async_pipeline(fake_io):
+    result = asyncio.run(pipeline.run_ai_pipeline_async(TEXT, user_id="u1"))
+
+    _check_result(result, fake_io)
+    assert [mode for mode, _ in fake_io["sentiment"]] == ["batch_async"]
+
+
+def test_stream_pipeline(fake_io):
+    events = list(pipeline.run_ai_pipeline_stream(TEXT, user_id="u1"))
+
+    tokens = "".join(e["text"] for e in events if e["type"] == "token")
+    assert tokens == REPLY["response"]
+    assert [e["type"] for e in events][-1] == "result"
+    _check_result(events[-1]["result"], fake_io)
+
+
+def test_async_stream_pipeline(fake_io):
+    async def collect():
+        return [e async for e in pipeline.run_ai_pipeline_stream_async(TEXT, user_id="u1")]
+
+    events = asyncio.run(collect())
+
+    assert "".join(e["text"] for e in events if e["type"] == "token") == REPLY["response"]
+    _check_result(events[-1]["result"], fake_io)
+
+
+@pytest.mark.parametrize("bad", [None, {"error": "timeout"}])
+def test_failed_chunk_stops_pipeline(fake_io, monkeypatch, bad):
+    """Chunk thiếu kết quả (None) hay lỗi → trả lỗi, không gọi model, không ghi lịch sử."""
+    monkeypatch.setattr(pipeline, "query_sentiment_batch",
+                        lambda chunks: [_fake_sentiment(chunks[0]), bad])
+
+    result = pipeline.run_ai_pipeline(TEXT, user_id="u1")
+
+    assert result["status"] == "error"
+    assert "chunk 2" in result["error_message"]
+    assert fake_io["prompts"] == [] and fake_io["saved"] == []
+
+    events = list(pipeline.run_ai_pipeline_stream(TEXT, user_id="u1"))
+    assert events == [{"type": "result", "result": events[0]["result"]}]
+    assert events[0]["result"]["status"] == "error"
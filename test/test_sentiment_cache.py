@@ -0,0 +1,43 @@
+"""
+Unit test cho core/sentiment_cache.py
+Kiểm tra key theo nội dung, LRU, TTL và tầng SQLite.
+"""
+
+import time
+
+from core.sentiment_cache import SentimentCache, make_cache_key
+
+
+def test_cache_key_uses_clean_text():
+    """Khoảng trắng / ký tự điều khiển không làm đổi key."""
+    assert make_cache_key("mệt   quá\n") == make_cache_key("mệt quá")
+    assert make_cache_key("mệt quá") != make_cache_key("vui quá")
+
+
+def test_lru_eviction_and_stats():
+    cache = SentimentCache(max_items=2)
+    cache.set("a", {"predicted_label": "negative"})
+    cache.set("b", {"predicted_label": "neutral"})
+    assert cache.get("a") is not None      # a mới dùng → b cũ nhất
+    cache.set("c", {"predicted_label": "positive"})
+
+    assert cache.get("b") is None
+    assert cache.get("c")["predicted_label"] == "positive"
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["size"] == 2
+
+
+def test_ttl_expiry():
+    cache = SentimentCache(max_items=10, ttl_seconds=0.05)
+    cache.set("a", {"predicted_label": "negative"})
+    assert cache.get("a") is not None
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    SentimentCache(max_items=10, db_path=db_path).set("a", {"predicted_label": "positive"})
+
+    fresh = SentimentCache(max_items=10, db_path=db_path)
+    assert fresh.get("a") == {"predicted_label": "positive"}
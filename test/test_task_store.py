@@ -0,0 +1,173 @@
+"""
+Unit test cho core/task_store.py
+Kiểm tra lưu task 1 lần / entry và range query theo due_at.
+"""
+
+from datetime import datetime, timedelta
+
+import core.todo_engine as todo_engine
+from core.task_store import TaskStore
+from core.utils import VN_TZ, get_vn_timestamp
+
+
+def _entry(ts, text, user_id="u1", deadline="mai", action="Ôn bài thi"):
+    return {
+        "user_id": user_id,
+        "timestamp": ts,
+        "text": text,
+        "todo_candidates": [{"action": action, "description": "", "confidence": 0.7,
+                             "context_tags": ["thi_cu"], "deadline": deadline}],
+    }
+
+
+def test_add_entries_is_idempotent_and_extracts_legacy_entries(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.sqlite3"))
+    entries = [
+        _entry("2025-01-01 08:00:00", "Mai thi Toán"),
+        _entry("2025-01-01 09:00:00", "Hơi buồn", deadline=None, action="Nghỉ ngơi"),
+        # Entry cũ chưa có todo_candidates → trích lại từ text
+        {"user_id": "u2", "timestamp": "2025-01-01 10:00:00", "text": "Mai phải nộp đồ án"},
+    ]
+    assert store.add_entries(entries) == 3
+    assert store.add_entries(entries) == 0          # ghi lại không tạo bản trùng
+    assert len(store) == 3
+
+    legacy = store.due_between(user_id="u2")
+    assert [t["action"] for t in legacy] == ["Hoàn thành bài tập/đồ án"]
+    assert legacy[0]["deadline"] == "mai"
+    # Task không có deadline không xuất hiện trong range query
+    assert all(t["action"] != "Nghỉ ngơi" for t in store.due_between())
+    store.close()
+
+
+def test_due_between_range_user_and_status(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.sqlite3"))
+    today = get_vn_timestamp()
+    store.add_entries([
+        _entry(today, "Mai thi Toán"),
+        _entry(today, "Mai thi Văn", user_id="u2"),
+        # "mai" của entry viết năm 2025 đã qua từ lâu → quá hạn (deadline neo theo entry)
+        _entry("2025-01-01 08:00:00", "Mai thi Sử", user_id="u3"),
+    ])
+    now = datetime.now(VN_TZ)
+    soon = store.due_between(start=now, end=now + timedelta(hours=48))
+    assert {t["user_id"] for t in soon} == {"u1", "u2"}
+    overdue = store.due_between(end=now)
+    assert [(t["user_id"], t["due_at"]) for t in overdue] == [("u3", "2025-01-02 23:59:00")]
+
+    mine = store.due_between(start=now, user_id="u1")
+    assert len(mine) == 1 and mine[0]["context_tags"] == ["thi_cu"]
+
+    store.set_status(mine[0]["id"], "done")
+    assert store.due_between(user_id="u1") == []
+    assert len(store.due_between(user_id="u1", status=None)) == 1
+    store.close()
+
+
+def test_due_soon_queries_task_store(tmp_path, monkeypatch):
+    store = TaskStore(str(tmp_path / "tasks.sqlite3"))
+    store.add_entries([_entry(get_vn_timestamp(), "Mai thi Toán")])
+    monkeypatch.setattr(todo_engine, "_task_store", lambda: store)
+
+    assert [t["action"] for t in todo_engine.get_tasks_due_soon(hours=48)] == ["Ôn bài thi"]
+    assert todo_engine.get_tasks_due_soon(hours=0) == []
+    assert todo_engine.get_overdue_tasks() == []
+    store.close()
+
+
+def test_history_scan_matches_task_store(tmp_path):
+    """Không có bảng task (truyền history) → cùng dạng dict, cùng điều kiện thời gian."""
+    today = get_vn_timestamp()
+    history = [
+        _entry(today, "Mai thi Toán"),
+        _entry(today, "Mai thi Văn", user_id="u2", action="Ôn bài Văn"),
+        _entry("2025-01-01 08:00:00", "Mai thi Sử", user_id="u3", action="Ôn bài Sử"),
+    ]
+    store = TaskStore(str(tmp_path / "tasks.sqlite3"))
+    store.add_entries(history)
+
+    def strip(tasks):
+        return [{k: v for k, v in t.items() if k != "id"} for t in tasks]
+
+    now = datetime.now(VN_TZ)
+    upcoming = todo_engine.get_upcoming_tasks(history)
+    assert strip(upcoming) == strip(store.due_between(start=now))
+    assert {t["user_id"] for t in upcoming} == {"u1", "u2"}          # không gồm task quá hạn
+    assert [t["user_id"] for t in todo_engine.get_overdue_tasks(history)] == ["u3"]
+    assert [t["action"] for t in todo_engine.get_tasks_due_soon(history, hours=48, user_id="u2")] == ["Ôn bài Văn"]
+    store.close()
+
+
+def test_same_second_entries_keep_separate_tasks_and_old_table_migrates(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "tasks.sqlite3")
+    # Bảng kiểu cũ: UNIQUE (user_id, entry_timestamp, action)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL DEFAULT '',"
+               " entry_timestamp TEXT NOT NULL DEFAULT '', action TEXT NOT NULL, description TEXT,"
+               " deadline TEXT, due_at REAL, confidence REAL, context_tags TEXT, source_text TEXT,"
+               " status TEXT NOT NULL DEFAULT 'open', UNIQUE (user_id, entry_timestamp, action))")
+    db.execute("INSERT INTO tasks (user_id, entry_timestamp, action, source_text, status)"
+               " VALUES ('u1', '2025-01-01 08:00:00', 'Ôn bài thi', 'Mai thi Toán', 'done')")
+    db.commit()
+    db.close()
+
+    store = TaskStore(path)
+    assert len(store) == 1
+    entries = [_entry("2025-01-01 08:00:00", "Mai thi Toán"), _entry("2025-01-01 08:00:00", "Mai thi Lý")]
+    # Entry đã có (task cũ) bỏ qua, entry khác text cùng giây vẫn thành task riêng
+    assert store.add_entries(entries) == 1
+    assert store.add_entries(entries) == 0
+    assert len(store) == 2
+    statuses = store._db.execute("SELECT source_text, status FROM tasks ORDER BY id").fetchall()
+    assert statuses == [("Mai thi Toán", "done"), ("Mai thi Lý", "open")]   # giữ trạng thái cũ
+    store.close()
+
+
+def test_anonymous_user_sees_only_anonymous_tasks(tmp_path, monkeypatch):
+    """user_id=None → chỉ task của user ẩn danh (cả bảng task lẫn quét lịch sử); ALL_USERS → mọi user."""
+    import core.notification_engine as ne
+    from core.history_store import ALL_USERS
+
+    today = get_vn_timestamp()
+    history = [_entry(today, "Mai thi Toán"), _entry(today, "Mai thi Văn", user_id=None, action="Ôn bài Văn")]
+    store = TaskStore(str(tmp_path / "tasks.sqlite3"))
+    store.add_entries(history)
+
+    assert [t["action"] for t in store.due_between(user_id=None)] == ["Ôn bài Văn"]
+    assert [t["action"] for t in todo_engine.get_tasks_due_soon(history, hours=48, user_id=None)] == ["Ôn bài Văn"]
+    assert len(store.due_between(user_id=ALL_USERS)) == len(todo_engine.get_upcoming_tasks(history)) == 2
+
+    # Bảng task chỉ có task của u1 → user ẩn danh không được nhận thông báo của u1
+    only_u1 = TaskStore(str(tmp_path / "u1.sqlite3"))
+    only_u1.add_entries([_entry(today, "Thi Toán hôm nay", deadline="hôm nay")])
+    monkeypatch.setattr(todo_engine, "_task_store", lambda: only_u1)
+    assert ne.check_task_notification(None) is None
+    assert ne.check_task_notification("u1")["type"] == "TASK_DEADLINE"
+    only_u1.close()
+    store.close()
+
+
+def test_task_store_backfills_once_and_after_interrupted_build(tmp_path, monkeypatch):
+    """Backfill dưới file_lock + cờ "built": mở lại không trích lại, file dựng dở thì trích lại."""
+    import core.task_store as ts
+
+    path = str(tmp_path / "tasks.sqlite3")
+    TaskStore(path).close()                            # file đã tạo nhưng chưa backfill xong (crash)
+    loads = []
+
+    class History:
+        def load_all(self):
+            loads.append(1)
+            return [_entry(get_vn_timestamp(), "Mai thi Toán")]
+
+    monkeypatch.setattr(ts, "TASK_STORE_ENABLED", True)
+    monkeypatch.setattr(ts, "TASK_DB_PATH", path)
+    monkeypatch.setattr(ts, "get_history_store", lambda: History())
+    for _ in range(2):                                 # 2 worker lần lượt khởi động
+        monkeypatch.setattr(ts, "_store", None)
+        store = ts.get_task_store()
+        assert [t["action"] for t in store.due_between()] == ["Ôn bài thi"]
+        store.close()
+    assert loads == [1]
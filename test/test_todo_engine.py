@@ -0,0 +1,87 @@
+"""
+Unit test cho core/todo_engine.py
+"""
+
+from datetime import datetime
+
+import pytest
+
+from core.todo_engine import (
+    TodoRule,
+    TodoRuleSet,
+    convert_deadline_to_datetime,
+    create_todo_plan,
+    detect_deadline,
+    extract_tasks_from_text,
+    get_todo_rules,
+)
+from core.utils import VN_TZ
+
+
+def test_rules_loaded_from_data_file():
+    """Bộ rule mặc định nạp từ core/todo_rules.json."""
+    rules = get_todo_rules()
+    assert [r.id for r in rules.rules] == ["thi_cu", "thuyet_trinh", "deadline"]
+
+
+def test_extract_tasks_word_boundary():
+    """"thi" không khớp bên trong "thích" / "thiết"; cụm nhiều từ chịu khoảng trắng thừa."""
+    assert extract_tasks_from_text("Tớ thích thiết kế đồ hoạ") == []
+
+    tasks = extract_tasks_from_text("Mai thi Toán mà chưa nộp bài, còn phải thuyết   trình")
+    assert [t.action for t in tasks] == ["Ôn bài thi", "Làm slide thuyết trình", "Hoàn thành bài tập/đồ án"]
+    assert all(t.deadline == "mai" for t in tasks)
+    assert tasks[0].context_tags == ["thi_cu"]
+
+
+def test_large_rule_catalog_matches_like_substring_rules():
+    """Hàng trăm rule chung tiền tố vẫn khớp đúng từng keyword."""
+    rules = [
+        TodoRule(id=f"r{i}", keywords=[f"việc{i}", f"task {i}"], action=f"Làm việc {i}",
+                 description="", confidence=0.5)
+        for i in range(500)
+    ]
+    rule_set = TodoRuleSet(rules)
+    tasks = extract_tasks_from_text("hôm nay có việc42, task   7 và việc420x", rules=rule_set)
+    assert [t.action for t in tasks] == ["Làm việc 7", "Làm việc 42"]
+
+
+@pytest.mark.parametrize("text, canonical, due", [
+    ("Mai thi Toán rồi", "mai", "2025-11-19"),
+    ("ngày kia nộp báo cáo", "ngày kia", "2025-11-20"),
+    ("tối nay làm slide", "tối nay", "2025-11-18"),
+    ("thứ 3 thuyết trình", "thứ 3", "2025-11-25"),        # trùng thứ của ngày gốc → tuần sau
+    ("thứ năm thi giữa kỳ", "thứ 5", "2025-11-20"),
+    ("thứ 2 tuần sau nộp", "thứ 2 tuần sau", "2025-11-24"),
+    ("chủ nhật đi tình nguyện", "chủ nhật", "2025-11-23"),
+    ("nộp bài tuần này", "tuần này", "2025-11-23"),
+    ("deadline tuần sau", "tuần sau", "2025-11-30"),
+    ("cuối tháng nộp đồ án", "cuối tháng", "2025-11-30"),
+    ("hạn nộp 20/11", "20/11", "2025-11-20"),
+    ("thi ngày 5 tháng 1", "5/1", "2026-01-05"),          # đã qua trong năm → năm sau
+    ("3 ngày nữa thi", "3 ngày nữa", "2025-11-21"),
+])
+def test_deadline_grammar_anchored_to_entry(text, canonical, due):
+    """Deadline neo vào timestamp entry (thứ 3, 18/11/2025), hết hạn 23:59 giờ VN."""
+    assert detect_deadline(text) == canonical
+    dl = convert_deadline_to_datetime(canonical, reference="2025-11-18 09:30:00")
+    assert dl == datetime.fromisoformat(due + " 23:59:00").replace(tzinfo=VN_TZ)
+
+
+def test_deadline_no_false_positives():
+    assert detect_deadline("mải chơi quá") is None
+    assert detect_deadline("hạn 31/2") is None
+    assert convert_deadline_to_datetime("không rõ") is None
+
+
+def test_todo_plan_spreads_steps_until_deadline():
+    """Có deadline → các bước rải đều tới 23:59 ngày hạn; không có → chỉ đánh số."""
+    task = extract_tasks_from_text("Mai thi Toán rồi")[0]
+    plan = create_todo_plan(task, "Mai thi Toán rồi", reference="2025-11-18 11:59:00")
+    assert plan.main_task == "Ôn bài thi" and plan.deadline == "mai"
+    assert [t.rsplit("trước ", 1)[1] for t in plan.timeline] == ["23:59 18/11", "11:59 19/11", "23:59 19/11"]
+
+    task = extract_tasks_from_text("Phải làm slide thuyết trình")[0]
+    plan = create_todo_plan(task, "Phải làm slide thuyết trình")
+    assert plan.deadline is None
+    assert plan.timeline == [f"Bước {i}: {s}" for i, s in enumerate(plan.subtasks, start=1)]
@@ -0,0 +1,108 @@
+"""
+Unit test cho core/utils.py
+"""
+
+import numpy as np
+import pytest
+
+from core.utils import (
+    ResponseFieldStreamer,
+    aggregate_batch,
+    aggregate_by_case,
+    aggregate_by_case_batch,
+    aggregate_consistent,
+    aggregate_mild_shift,
+    aggregate_multi_sentiment,
+    aggregate_polarity_shift,
+    chunks_to_matrix,
+    detect_sentiment_case,
+    stack_chunk_matrices,
+)
+
+
+def _chunk(text, probs, label):
+    return {"text": text, "probs": probs, "label": label, "length": len(text)}
+
+
+SHIFT = [
+    _chunk("Hôm nay tôi rất vui", [0.05, 0.13, 0.82], "positive"),
+    _chunk("nhưng tôi không về nhà nên hơi nhớ mẹ", [0.72, 0.20, 0.08], "negative"),
+]
+MILD = [
+    _chunk("Sáng nay đi học bình thường", [0.1, 0.6, 0.3], "neutral"),
+    _chunk("chiều được khen nên thấy vui vui", [0.05, 0.25, 0.7], "positive"),
+    _chunk("tối ăn cơm xong đi ngủ", [0.1, 0.55, 0.35], "neutral"),
+]
+
+
+def _stream(raw, step):
+    s = ResponseFieldStreamer()
+    return "".join(s.feed(raw[i:i + step]) for i in range(0, len(raw), step))
+
+
+def test_response_streamer_extracts_json_field():
+    """Chỉ stream nội dung trường "response", bỏ escape, với mọi cách cắt chunk."""
+    raw = '```json\n{"response": "Chào\\n cậu \\"bạn\\" \\u00e1!", "topic": "Khác"}\n```'
+    for step in (1, 2, 5, len(raw)):
+        assert _stream(raw, step) == 'Chào\n cậu "bạn" á!'
+
+
+def test_response_streamer_plain_text_passthrough():
+    """Model trả text thường → đẩy nguyên văn."""
+    assert _stream("Mình ở đây nghe cậu nè.", 3) == "Mình ở đây nghe cậu nè."
+
+
+def test_aggregators_match_loop_reference():
+    """Bản vector hoá cho kết quả giống công thức lặp từng chunk trong docstring."""
+    probs = np.array([c["probs"] for c in MILD])
+    w = np.array([c["length"] for c in MILD], dtype=float)
+    np.testing.assert_allclose(aggregate_consistent(MILD), (probs * w[:, None]).sum(0) / w.sum())
+
+    w2 = w * (1 + probs.max(1) - probs.mean(1))
+    np.testing.assert_allclose(aggregate_mild_shift(MILD), (probs * w2[:, None]).sum(0) / w2.sum())
+
+    avg, flag = aggregate_multi_sentiment(chunks_to_matrix(MILD))
+    assert flag == "mixed_sentiment"
+    np.testing.assert_allclose(avg, aggregate_consistent(MILD))
+    np.testing.assert_allclose(aggregate_polarity_shift(SHIFT), SHIFT[-1]["probs"])
+
+
+def test_detect_sentiment_case_on_matrix():
+    """ChunkMatrix cho cùng case với list dict; từ nối được quét sẵn khi dựng ma trận."""
+    m = chunks_to_matrix(SHIFT)
+    assert m.probs.shape == (2, 3) and m.has_connector
+    assert detect_sentiment_case(m) == detect_sentiment_case(SHIFT) == "polarity_shift"
+    assert detect_sentiment_case(MILD) == "mild_shift"
+    assert detect_sentiment_case([_chunk("ừ", [0.34, 0.33, 0.33], "negative")]) == "uncertain"
+
+
+def test_aggregate_batch_matches_per_entry():
+    """Gộp cả batch một lượt = gộp từng entry riêng."""
+    entries = [SHIFT, MILD, SHIFT[:1]]
+    probs, lengths, counts = stack_chunk_matrices(entries)
+    assert probs.shape == (6, 3) and counts.tolist() == [2, 3, 1]
+
+    for strategy, fn in (("consistent", aggregate_consistent),
+                         ("mild_shift", aggregate_mild_shift),
+                         ("polarity_shift", aggregate_polarity_shift)):
+        out = aggregate_batch(probs, lengths, counts, strategy)
+        np.testing.assert_allclose(out, np.stack([fn(e) for e in entries]))
+
+    with pytest.raises(ValueError):
+        stack_chunk_matrices([SHIFT, []])
+
+
+def test_aggregate_by_case_dispatch_and_batch():
+    """Dispatch dùng đúng aggregate_* theo case; bản batch khớp từng entry."""
+    probs, case_type, flag = aggregate_by_case(SHIFT)
+    assert case_type == "polarity_shift" and flag is None
+    np.testing.assert_allclose(probs, SHIFT[-1]["probs"])
+
+    probs, case_type, _ = aggregate_by_case(MILD)
+    assert case_type == "mild_shift"
+    np.testing.assert_allclose(probs, aggregate_mild_shift(MILD))
+
+    entries = [SHIFT, MILD, SHIFT[:1], [_chunk("ừ", [0.34, 0.33, 0.33], "negative")]]
+    batch, cases = aggregate_by_case_batch(entries)
+    assert cases == ["polarity_shift", "mild_shift", "consistent", "uncertain"]
+    np.testing.assert_allclose(batch, np.stack([aggregate_by_case(e)[0] for e in entries]))